@@ -3,16 +3,25 @@
 from trytond.pool import Pool
 from . import animal
 from . import animal_group
+from . import census
 from . import events
+from . import export
+from . import ir
+from . import kpi
 from . import product
 from . import production
 from . import quality
+from . import rfid
+from . import scale
+from . import sensor
 from . import specie
 from . import stock
 from . import user
 
 def register():
     Pool.register(
+        ir.Cron,
+        ir.Model,
         specie.Specie,
         specie.SpecieModel,
         specie.SpecieFarmLine,
@@ -34,10 +43,11 @@ def register():
         animal.CreateFemaleStart,
         animal.CreateFemaleLine,
         animal.ChangeCycleObservationStart,
-        animal.EventUnion,
         animal_group.AnimalGroup,
         animal_group.AnimalGroupTag,
         animal_group.AnimalGroupWeight,
+        animal_group.AnimalGroupPerformanceWeek,
+        scale.ScaleReading,
         stock.Location,
         stock.LocationSiloLocation,
         stock.LotAnimalGroup,
@@ -48,11 +58,17 @@ def register():
         product.Product,
         events.event_order.EventOrder,
         events.move_event.MoveEvent,
+        events.move_event.MoveLocationContentsStart,
+        rfid.RfidGate,
+        rfid.RfidRead,
         events.feed_inventory.FeedInventory,
         events.feed_inventory.FeedProvisionalInventory,
         events.feed_inventory.FeedInventoryLocation,
         events.feed_inventory.FeedAnimalLocationDate,
+        sensor.SiloSensor,
+        sensor.SiloSensorReading,
         events.feed_event.FeedEvent,
+        events.feed_abstract_event.FeedMoveAllocation,
         events.medication_event.MedicationEvent,
         events.transformation_event.TransformationEvent,
         events.removal_event.RemovalEvent,
@@ -71,13 +87,22 @@ def register():
         events.weaning_event.WeaningEvent,
         events.weaning_event.WeaningEventAnimal,
         events.weaning_event.WeaningEventFemaleCycle,
+        events.weaning_event.WeanLocationStart,
         events.reclassification_event.ReclassficationEvent,
+        animal.EventJournal,
+        kpi.HerdKpi,
         stock.Move,
+        stock.StockSnapshot,
+        census.Census,
+        export.EventExport,
         production.BOM,
         quality.QualityTest,
         quality.QualityTemplate,
+        quality.QualityConfigurationLine,
         module='farm', type_='model')
     Pool.register(
         animal.CreateFemale,
         animal.ChangeCycleObservation,
+        events.move_event.MoveLocationContents,
+        events.weaning_event.WeanLocation,
         module='farm', type_='wizard')
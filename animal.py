@@ -1,16 +1,29 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
-from datetime import date, datetime, timedelta
+import operator
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
+from trytond import backend
+from trytond.config import config
 from trytond.rpc import RPC
-from trytond.model import ModelView, ModelSQL, fields, UnionMixin, Unique
+from trytond.model import ModelView, ModelSQL, fields, Index, Unique
 from trytond.pyson import Equal, Eval, Greater, Id, Not, Bool
 from trytond.transaction import Transaction
 from trytond.pool import Pool, PoolMeta
 from trytond.wizard import Wizard, StateView, StateAction, Button, StateTransition
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
-from sql import Table
+from trytond.tools import grouped_slice, reduce_ids
+from sql import Column, Literal, Null, Table, Union, Values, Window
+from sql.aggregate import Sum
+from sql.functions import CurrentTimestamp, RowNumber
+
+from .archive import ArchiveMixin
+from .events.abstract_event import _EVENT_STATES, KeysetPaginationMixin
+from .partition import (create_partitions, is_partitioned,
+    partition_interval, split_default_partition)
+from .stock import clear_quantity_memo
 
 _STATES_MALE_FIELD = {
     'invisible': Not(Equal(Eval('type'), 'male')),
@@ -26,6 +39,37 @@ ANIMAL_ORIGIN = [
     ('purchased', 'Purchased'),
     ('raised', 'Raised'),
     ]
+_NUMERIC_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    }
+
+
+def _week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _overlap(value, start, end, range_start, range_end):
+    """
+    Returns the part of value, spread evenly over the days from start
+    (included) to end (excluded), that falls between range_start and range_end
+    (both included). If start is end, all the value is on that day.
+    """
+    days = (end - start).days
+    if days <= 0:
+        return value if range_start <= end <= range_end else 0
+    first = max(start, range_start)
+    last = min(end - timedelta(days=1), range_end)
+    overlap = (last - first).days + 1
+    if overlap <= 0:
+        return 0
+    return value * overlap / days
+
+
 FEMALE_CICLE_STATES = [
     ('mated', 'Mated'),
     ('pregnant', 'Pregnant'),
@@ -58,13 +102,387 @@ class AnimalMixin:
     __slots__ = ()
     feed_unit_digits = fields.Function(fields.Integer('Feed Unit Digits'),
         'get_feed_unit_digits')
+    # Field of the feed events that links to the record and if the consumed
+    # feed is computed per animal of the events
+    _feed_event_field = None
+    _consumed_feed_per_animal = False
+    # Weight model and its field that links to the record
+    _weight_model = None
+    _weight_field = None
+    # Field of the weekly performance cache that links to the record
+    _performance_week_field = None
 
     def get_feed_unit_digits(self, name):
-        Uom = Pool().get('product.uom')
-        weight_base_uom, = Uom.search([
-                ('symbol', '=', 'kg'),
-                ])
-        return weight_base_uom.id
+        ModelData = Pool().get('ir.model.data')
+        return ModelData.get_id('product', 'uom_kilogram')
+
+    @classmethod
+    def get_consumed_feed(cls, records, name):
+        '''
+        Returns the kilograms of feed consumed by each record. The feed events
+        that are still open are pro-rated by the days elapsed.
+        '''
+        pool = Pool()
+        FeedEvent = pool.get('farm.feed.event')
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        event = FeedEvent.__table__()
+        uom = Uom.__table__()
+
+        kg = Uom(ModelData.get_id('product', 'uom_kilogram'))
+        now = datetime.now()
+        today = now.date()
+        record_column = Column(event, cls._feed_event_field)
+        quantity = event.feed_quantity * uom.factor
+        if cls._consumed_feed_per_animal:
+            quantity /= event.quantity
+        is_open = (event.start_date != Null) & (event.timestamp > now)
+        query = event.join(uom, condition=event.uom == uom.id)
+
+        consumed = dict.fromkeys([r.id for r in records], 0)
+        arrival_dates = {r.id: r.arrival_date for r in records}
+        for sub_ids in grouped_slice(list(consumed)):
+            sub_ids = list(sub_ids)
+            where = (reduce_ids(record_column, sub_ids)
+                & event.state.in_(['provisional', 'validated'])
+                & (uom.category == kg.category.id)
+                & (((event.start_date == Null) & (event.timestamp <= now))
+                    | (event.start_date <= today)))
+            dates = [arrival_dates[i] for i in sub_ids]
+            if all(dates):
+                # No event ends before the arrival, which lets the partitions
+                # of the previous periods be pruned
+                where &= event.timestamp >= datetime.combine(min(dates),
+                    time.min)
+            cursor.execute(*query.select(record_column, Sum(quantity),
+                    where=where & ~is_open,
+                    group_by=[record_column]))
+            for record_id, value in cursor:
+                consumed[record_id] += value or 0
+            cursor.execute(*query.select(record_column, quantity,
+                    event.start_date, event.timestamp,
+                    where=where & is_open))
+            for record_id, value, start_date, timestamp in cursor:
+                days = (timestamp.date() - start_date).days
+                if days:
+                    consumed[record_id] += (
+                        value * (today - start_date).days / days)
+        return {r: Decimal(str(v / kg.factor)) for r, v in consumed.items()}
+
+    @classmethod
+    def search_consumed_feed(cls, name, clause):
+        '''
+        Returns the records whose consumed feed matches the clause with a
+        query grouped by record. The few feed events that are still open are
+        pro-rated in Python and added to the query as values.
+        '''
+        pool = Pool()
+        FeedEvent = pool.get('farm.feed.event')
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        event = FeedEvent.__table__()
+        uom = Uom.__table__()
+
+        _, operator_, value = clause[:3]
+        Operator = fields.SQL_OPERATORS[operator_]
+        compare = _NUMERIC_OPERATORS[operator_]
+        value = Decimal(str(value or 0))
+        kg = Uom(ModelData.get_id('product', 'uom_kilogram'))
+        now = datetime.now()
+        today = now.date()
+        record_column = Column(event, cls._feed_event_field)
+        quantity = event.feed_quantity * uom.factor
+        if cls._consumed_feed_per_animal:
+            quantity /= event.quantity
+        is_open = (event.start_date != Null) & (event.timestamp > now)
+        query = event.join(uom, condition=event.uom == uom.id)
+        where = ((record_column != Null)
+            & event.state.in_(['provisional', 'validated'])
+            & (uom.category == kg.category.id)
+            & (((event.start_date == Null) & (event.timestamp <= now))
+                | (event.start_date <= today)))
+
+        consumed = query.select(record_column.as_('record'),
+            quantity.as_('quantity'), where=where & ~is_open)
+        cursor.execute(*query.select(record_column, quantity,
+                event.start_date, event.timestamp, where=where & is_open))
+        open_values = []
+        for record_id, feed_quantity, start_date, timestamp in cursor:
+            days = (timestamp.date() - start_date).days
+            if days:
+                open_values.append([record_id,
+                        feed_quantity * (today - start_date).days / days])
+        if open_values:
+            consumed = Union(consumed, Values(open_values), all_=True)
+
+        total = Sum(consumed.quantity) / kg.factor
+        if compare(Decimal(0), value):
+            # Records without feed events have consumed nothing
+            return [('id', 'not in', consumed.select(consumed.record,
+                        group_by=[consumed.record],
+                        having=~Operator(total, value)))]
+        return [('id', 'in', consumed.select(consumed.record,
+                    group_by=[consumed.record],
+                    having=Operator(total, value)))]
+
+    @classmethod
+    def get_performance(cls, records, names):
+        '''
+        Returns the average daily gain and the feed conversion ratio of each
+        record between its first and last weighing in the range of dates of
+        performance_start_date and performance_end_date of the context
+        '''
+        ranges = cls._get_performance_ranges(records)
+        weights = cls._get_head_weights(ranges)
+        segments = [(r, first[0].date(), last[0].date() - timedelta(days=1))
+            for r, (first, last) in weights.items()
+            if last[0].date() > first[0].date()]
+        feed = dict(zip([s[0] for s in segments],
+                cls._get_period_values('feed', segments)))
+
+        result = {n: dict.fromkeys([r.id for r in records]) for n in names}
+        for record_id, (first, last) in weights.items():
+            days = (last[0] - first[0]).total_seconds() / (24 * 60 * 60)
+            if days <= 0:
+                continue
+            gain = last[1] - first[1]
+            if 'adg' in result:
+                result['adg'][record_id] = gain / days
+            if 'fcr' in result and gain > 0 and feed.get(record_id):
+                result['fcr'][record_id] = feed[record_id] / gain
+        return result
+
+    @classmethod
+    def _get_performance_ranges(cls, records):
+        "Returns the first and last date of the performance of each record"
+        context = Transaction().context
+        today = date.today()
+        start = context.get('performance_start_date')
+        end = context.get('performance_end_date')
+        return {r.id: (start or r.arrival_date or today,
+                end or r.removal_date or today)
+            for r in records}
+
+    @classmethod
+    def _get_head_weights(cls, ranges):
+        '''
+        Returns the first and last weighings of each record in its range of
+        dates as a pair of (timestamp, kilograms per head)
+        '''
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+        Weight = pool.get(cls._weight_model)
+        cursor = Transaction().connection.cursor()
+        weight = Weight.__table__()
+        uom = Uom.__table__()
+
+        if not ranges:
+            return {}
+        kg = Uom(ModelData.get_id('product', 'uom_kilogram'))
+        record_column = Column(weight, cls._weight_field)
+        head_weight = weight.weight * uom.factor
+        where = ((weight.timestamp >= datetime.combine(
+                    min(s for s, _ in ranges.values()), time.min))
+            & (weight.timestamp <= datetime.combine(
+                    max(e for _, e in ranges.values()), time.max)))
+        if 'quantity' in Weight._fields:
+            head_weight /= weight.quantity
+            where &= weight.quantity > 0
+
+        result = {}
+        for sub_ids in grouped_slice(list(ranges)):
+            cursor.execute(*weight.join(uom,
+                    condition=weight.uom == uom.id
+                    ).select(record_column, weight.timestamp, head_weight,
+                    where=where & reduce_ids(record_column, sub_ids),
+                    order_by=[record_column, weight.timestamp.asc]))
+            for record_id, timestamp, value in cursor:
+                start, end = ranges[record_id]
+                if not start <= timestamp.date() <= end:
+                    continue
+                weighing = (timestamp, value / kg.factor)
+                if record_id in result:
+                    result[record_id] = (result[record_id][0], weighing)
+                else:
+                    result[record_id] = (weighing, weighing)
+        return result
+
+    @classmethod
+    def get_current_weight(cls, records, name):
+        "Returns the last weight record of each record"
+        pool = Pool()
+        Weight = pool.get(cls._weight_model)
+        cursor = Transaction().connection.cursor()
+        weight = Weight.__table__()
+
+        record_column = Column(weight, cls._weight_field)
+        rank = RowNumber(window=Window([record_column],
+                order_by=[weight.timestamp.desc, weight.id.desc]))
+        result = dict.fromkeys([r.id for r in records])
+        for sub_ids in grouped_slice(list(result)):
+            query = weight.select(record_column.as_('record'), weight.id,
+                rank.as_('rank'),
+                where=reduce_ids(record_column, sub_ids))
+            cursor.execute(*query.select(query.record, query.id,
+                    where=query.rank == 1))
+            result.update(cursor)
+        return result
+
+    @classmethod
+    def get_weight_series(cls, ids, start_date=None, end_date=None,
+            step_days=None):
+        '''
+        Returns the weighings of the records with ids between start_date and
+        end_date as a list of (record id, timestamp, kilograms per head)
+        ordered by record and timestamp.
+        If step_days is set, the weighings are averaged by periods of step_days
+        days from start_date, or the first weighing of each record, and the
+        timestamp is the start of the period.
+        '''
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+        Weight = pool.get(cls._weight_model)
+        cursor = Transaction().connection.cursor()
+        weight = Weight.__table__()
+        uom = Uom.__table__()
+
+        kg = Uom(ModelData.get_id('product', 'uom_kilogram'))
+        record_column = Column(weight, cls._weight_field)
+        head_weight = weight.weight * uom.factor
+        where = Literal(True)
+        if 'quantity' in Weight._fields:
+            head_weight /= weight.quantity
+            where &= weight.quantity > 0
+        if start_date:
+            where &= weight.timestamp >= datetime.combine(start_date,
+                time.min)
+        if end_date:
+            where &= weight.timestamp <= datetime.combine(end_date, time.max)
+        step = timedelta(days=step_days) if step_days else None
+
+        series = []
+        for sub_ids in grouped_slice(sorted(set(ids))):
+            cursor.execute(*weight.join(uom,
+                    condition=weight.uom == uom.id
+                    ).select(record_column, weight.timestamp, head_weight,
+                    where=where & reduce_ids(record_column, sub_ids),
+                    order_by=[record_column, weight.timestamp.asc]))
+            if not step:
+                series.extend((r, t, float(v) / kg.factor)
+                    for r, t, v in cursor)
+                continue
+            bucket = None
+            for record_id, timestamp, value in cursor:
+                if not bucket or bucket[0] != record_id:
+                    origin = datetime.combine(
+                        start_date or timestamp.date(), time.min)
+                elif timestamp < bucket[1] + step:
+                    bucket[2] += float(value)
+                    bucket[3] += 1
+                    continue
+                if bucket:
+                    series.append((bucket[0], bucket[1],
+                            bucket[2] / bucket[3] / kg.factor))
+                bucket = [record_id, origin + step * (
+                        (timestamp - origin) // step), float(value), 1]
+            if bucket:
+                series.append((bucket[0], bucket[1],
+                        bucket[2] / bucket[3] / kg.factor))
+        return series
+
+    @classmethod
+    def _get_period_values(cls, name, segments):
+        '''
+        Returns the list of the values of name for each segment of segments
+        given as (record id, first date, last date). The values of the closed
+        weeks are read from the weekly cache, only the days before and after
+        them are computed.
+        '''
+        Week = Pool().get('farm.animal.group.performance.week')
+        current_week = _week_start(date.today())
+        one_day, one_week = timedelta(days=1), timedelta(days=7)
+
+        parts, weeks = [], []
+        for i, (record_id, start, end) in enumerate(segments):
+            week = first_week = _week_start(start + timedelta(days=6))
+            while week + one_week - one_day <= end and week < current_week:
+                weeks.append((i, (record_id, week)))
+                week += one_week
+            if week == first_week:
+                parts.append((i, (record_id, start, end)))
+                continue
+            if start < first_week:
+                parts.append((i, (record_id, start, first_week - one_day)))
+            if week <= end:
+                parts.append((i, (record_id, week, end)))
+
+        values = [0] * len(segments)
+        computed = cls._compute_period_values(name, [p for _, p in parts])
+        for (i, _), value in zip(parts, computed):
+            values[i] += value
+        cached = Week.get_values(cls, name, [k for _, k in weeks])
+        for i, key in weeks:
+            values[i] += cached[key]
+        return values
+
+    @classmethod
+    def _compute_period_values(cls, name, segments):
+        "Computes the values of name for each segment without the cache"
+        getter = getattr(cls, '_get_%s' % name, None)
+        if getter is None:
+            return [0] * len(segments)
+        return getter(segments)
+
+    @classmethod
+    def _get_feed(cls, segments):
+        '''
+        Returns the kilograms of feed consumed in each segment, per animal for
+        groups. The feed events with a start date are spread by day.
+        '''
+        pool = Pool()
+        FeedEvent = pool.get('farm.feed.event')
+        ModelData = pool.get('ir.model.data')
+        Uom = pool.get('product.uom')
+        cursor = Transaction().connection.cursor()
+        event = FeedEvent.__table__()
+        uom = Uom.__table__()
+
+        values = [0.0] * len(segments)
+        if not segments:
+            return values
+        kg = Uom(ModelData.get_id('product', 'uom_kilogram'))
+        by_record = defaultdict(list)
+        for i, (record_id, start, end) in enumerate(segments):
+            by_record[record_id].append((i, start, end))
+        first = min(s for _, s, _ in segments)
+        last = max(e for _, _, e in segments)
+        record_column = Column(event, cls._feed_event_field)
+        quantity = event.feed_quantity * uom.factor
+        if cls._consumed_feed_per_animal:
+            quantity /= event.quantity
+        where = (event.state.in_(['provisional', 'validated'])
+            & (uom.category == kg.category.id)
+            & (event.timestamp >= datetime.combine(first, time.min))
+            & ((event.start_date <= last)
+                | ((event.start_date == Null)
+                    & (event.timestamp <= datetime.combine(last, time.max)))))
+
+        for sub_ids in grouped_slice(list(by_record)):
+            cursor.execute(*event.join(uom,
+                    condition=event.uom == uom.id
+                    ).select(record_column, quantity, event.start_date,
+                    event.timestamp,
+                    where=where & reduce_ids(record_column, sub_ids)))
+            for record_id, value, start_date, timestamp in cursor:
+                end = timestamp.date()
+                for i, range_start, range_end in by_record[record_id]:
+                    values[i] += _overlap(value, start_date or end, end,
+                        range_start, range_end)
+        return [v / kg.factor for v in values]
 
     @classmethod
     def _create_and_done_first_stock_move(cls, records):
@@ -127,6 +545,10 @@ class AnimalMixin:
 class Animal(ModelSQL, ModelView, AnimalMixin):
     "Farm Animal"
     __name__ = 'farm.animal'
+    _feed_event_field = 'animal'
+    _weight_model = 'farm.animal.weight'
+    _weight_field = 'animal'
+    _performance_week_field = 'animal'
 
     type = fields.Selection([
             ('male', 'Male'),
@@ -186,14 +608,20 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
         'Weight Records', readonly=False, order=[('timestamp', 'DESC')])
     current_weight = fields.Function(fields.Many2One('farm.animal.weight',
             'Current Weight'),
-        'on_change_with_current_weight')
+        'get_current_weight')
     tags = fields.Many2Many('farm.animal-farm.tag', 'animal', 'tag', 'Tags')
     notes = fields.Text('Notes')
     active = fields.Boolean('Active')
     consumed_feed = fields.Function(fields.Numeric('Consumed Feed (Kg)',
             digits=(16, Eval('feed_unit_digits', 2)),
             depends=['feed_unit_digits']),
-        'get_consumed_feed')
+        'get_consumed_feed', searcher='search_consumed_feed')
+    adg = fields.Function(fields.Float('Average Daily Gain (Kg)',
+            digits=(16, 3)),
+        'get_performance')
+    fcr = fields.Function(fields.Float('Feed Conversion Ratio',
+            digits=(16, 3)),
+        'get_performance')
     # Individual Fields
     sex = fields.Selection([
             ('male', "Male"),
@@ -214,6 +642,13 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
     # checked on view before execute 'create()' function where this
     # field is filled in.
 
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.__rpc__.update({
+                'get_weight_series': RPC(),
+                })
+
     @classmethod
     def __register__(cls, module_name):
         table = cls.__table_handler__(module_name)
@@ -271,12 +706,24 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
     def default_active():
         return True
 
-    def get_rec_name(self, name):
-        if self.lot:
-            name = self.lot.number
-            if not self.active:
-                name += ' (*)'
-            return name
+    @classmethod
+    def get_rec_name(cls, animals, name):
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        lot = Lot.__table__()
+
+        names = dict.fromkeys([a.id for a in animals])
+        for sub_ids in grouped_slice(list(names)):
+            cursor.execute(*table.join(lot,
+                    condition=table.lot == lot.id
+                    ).select(table.id, lot.number, table.active,
+                    where=reduce_ids(table.id, sub_ids)))
+            for animal_id, number, active in cursor:
+                names[animal_id] = (number or '') + (
+                    '' if active else ' (*)')
+        return names
 
     @classmethod
     def search_rec_name(cls, name, clause):
@@ -313,40 +760,6 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
         if self.weights:
             return self.weights[0].id
 
-    def get_consumed_feed(self, name):
-        pool = Pool()
-        FeedEvent = pool.get('farm.feed.event')
-        Uom = pool.get('product.uom')
-
-        now = datetime.now()
-        feed_events = FeedEvent.search([
-                ('animal_type', '=', self.type),
-                ('animal', '=', self.id),
-                ('state', 'in', ['provisional', 'validated']),
-                ['OR', [
-                    ('start_date', '=', None),
-                    ('timestamp', '<=', now),
-                    ], [
-                    ('start_date', '<=', now.date()),
-                    ]],
-                ])
-
-        kg, = Uom.search([
-                ('symbol', '=', 'kg'),
-                ])
-        consumed_feed = Decimal(0)
-        for event in feed_events:
-            # TODO: it uses compute_price() because quantity is a Decimal
-            # quantity in feed_product default uom. The method is not for
-            # this purpose but it works
-            event_feed_quantity = Uom.compute_price(kg, event.feed_quantity,
-                event.uom)
-            if event.timestamp > now:
-                event_feed_quantity /= (event.end_date - event.start_date).days
-                event_feed_quantity *= (now.date() - event.start_date).days
-            consumed_feed += event_feed_quantity
-        return consumed_feed
-
     def check_in_location(self, location, timestamp):
         Lot = Pool().get('stock.lot')
         with Transaction().set_context(
@@ -394,6 +807,10 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
 
         context = Transaction().context
         vlist = [x.copy() for x in vlist]
+        locations = {l.id: l for l in Location.browse(list({
+                        v['initial_location'] for v in vlist
+                        if not v.get('number')}))}
+        to_number = defaultdict(list)
         for vals in vlist:
             if not vals.get('specie'):
                 vals['specie'] = cls.default_specie()
@@ -402,54 +819,72 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
             if vals['type'] in ('male', 'female'):
                 vals['sex'] = vals['type']
             if not vals.get('number'):
-                location = Location(vals['initial_location'])
-                vals['number'] = cls._calc_number(vals['specie'],
-                        location.warehouse.id, vals['type'])
+                location = locations[vals['initial_location']]
+                to_number[(vals['specie'], location.warehouse.id,
+                        vals['type'])].append(vals)
+        for (specie_id, farm_id, type), to_number_vlist in to_number.items():
+            numbers = cls._calc_numbers(specie_id, farm_id, type,
+                len(to_number_vlist))
+            for vals, number in zip(to_number_vlist, numbers):
+                vals['number'] = number
+
+        # Lots are created before the animals, in a single call, and linked
+        # back to them once the animals exist
+        to_create = [vals for vals in vlist if not vals.get('lot')]
+        new_lots = Lot.create([cls._get_lot_values(vals, True)
+                for vals in to_create])
+        for vals, lot in zip(to_create, new_lots):
+            vals['lot'] = lot.id
+        new_lot_ids = {l.id for l in new_lots}
 
         new_animals = super(Animal, cls).create(vlist)
+        animal_by_lot = {}
+        to_write = []
         for animal, vals in zip(new_animals, vlist):
             vals['id'] = animal.id
-            if vals.get('lot'):
-                lot = Lot(vals['lot'])
-                Lot.write([lot], cls._get_lot_values(vals, False))
-                animal.lot = lot
-                animal.save()
+            if vals['lot'] in new_lot_ids:
+                animal_by_lot[vals['lot']] = animal.id
             else:
-                new_lot, = Lot.create([cls._get_lot_values(vals, True)])
-                animal.lot = new_lot
-                animal.save()
+                to_write.extend(([Lot(vals['lot'])],
+                        cls._get_lot_values(vals, False)))
+        if animal_by_lot:
+            Lot.link_animals(animal_by_lot)
+        if to_write:
+            Lot.write(*to_write)
         if not context.get('no_create_stock_move'):
             cls._create_and_done_first_stock_move(new_animals)
         return new_animals
 
     @classmethod
     def _calc_number(cls, specie_id, farm_id, type):
+        return cls._calc_numbers(specie_id, farm_id, type, 1)[0]
+
+    @classmethod
+    def _calc_numbers(cls, specie_id, farm_id, type, count):
+        '''
+        Return a list of count new numbers for animals of type in the farm
+        '''
         pool = Pool()
         FarmLine = pool.get('farm.specie.farm_line')
         Location = pool.get('stock.location')
         Specie = pool.get('farm.specie')
 
         sequence_fieldname = '%s_sequence' % type
-        farm_lines = FarmLine.search([
-                ('specie', '=', specie_id),
-                ('farm', '=', farm_id),
-                ('has_' + type, '=', True),
-                ])
-        if not farm_lines:
+        farm_line = FarmLine.get_farm_line(specie_id, farm_id, type)
+        if not farm_line:
             raise UserError(gettext(
                     'farm.animal_no_farm_specie_farm_line_available',
                     farm=Location(farm_id).rec_name,
                     animal_type=type,
                     specie=Specie(specie_id).rec_name,
                     ))
-        farm_line, = farm_lines
         sequence = getattr(farm_line, sequence_fieldname, False)
         if not sequence:
             raise UserError(gettext('farm.no_sequence_in_farm_line',
                     sequence_field=getattr(FarmLine, sequence_fieldname).string,
                     farm_line=farm_line.rec_name,
                     ))
-        return sequence.get()
+        return farm_line.get_numbers(sequence_fieldname, count)
 
     @classmethod
     def _get_lot_values(cls, animal_vals, create):
@@ -476,7 +911,7 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
             'number': animal_vals['number'],
             'product': product.id,
             'animal_type': animal_vals['type'],
-            'animal': animal_vals['id']
+            'animal': animal_vals.get('id'),
             }
         return res
 
@@ -493,6 +928,176 @@ class Animal(ModelSQL, ModelView, AnimalMixin):
             Lot.delete(lots)
         return result
 
+    @classmethod
+    def _archive_models(cls):
+        "Models to archive sorted so the referring ones come first"
+        return ['farm.feed.move.allocation',
+            'farm.abort.event-farm.animal.female_cycle',
+            'farm.farrowing.event-farm.animal.female_cycle',
+            'farm.farrowing.event-farm.animal.group',
+            'farm.farrowing.event-farm.animal',
+            'farm.weaning.event-farm.animal.female_cycle',
+            'farm.weaning.event-farm.animal',
+            'farm.feed.event', 'farm.medication.event', 'farm.move.event',
+            'farm.removal.event', 'farm.reclassification.event',
+            'farm.foster.event', 'farm.abort.event', 'farm.farrowing.event',
+            'farm.weaning.event', 'farm.transformation.event',
+            'farm.pregnancy_diagnosis.event', 'farm.insemination.event',
+            'farm.animal.cycle.events', 'farm.animal.weight',
+            'farm.animal.group.weight', 'farm.animal.female_cycle']
+
+    @classmethod
+    def archive_removed(cls):
+        """
+        Moves the events, weights and cycles of the animals and groups
+        removed more than the configured number of years ago to the archive
+        tables
+        """
+        pool = Pool()
+        AnimalGroup = pool.get('farm.animal.group')
+        Date = pool.get('ir.date')
+        Lot = pool.get('stock.lot')
+
+        years = config.getint('farm', 'archive_years', default=0)
+        if not years:
+            return
+        today = Date.today()
+        try:
+            limit_date = today.replace(year=today.year - years)
+        except ValueError:
+            limit_date = today.replace(year=today.year - years, day=28)
+
+        animal = cls.__table__()
+        group = AnimalGroup.__table__()
+        animals = animal.select(animal.id,
+            where=(animal.active == False)
+            & (animal.removal_date <= limit_date))
+        groups = group.select(group.id,
+            where=(group.active == False)
+            & (group.removal_date <= limit_date))
+
+        models = cls._archive_models()
+        archived = {}
+        # The records that depend on another archived record are selected
+        # once the ids of the later are known
+        for name in sorted(models,
+                key=lambda n: bool(pool.get(n)._archive_parent)):
+            Model = pool.get(name)
+            archived[name] = Model._get_archive_ids(animals, groups,
+                archived)
+        cls._check_archive_references(archived)
+        for name in models:
+            if archived[name]:
+                pool.get(name)._archive(archived[name])
+        cls._clear_archive_references(archived)
+
+        records = cls.search([
+                ('active', '=', False),
+                ('removal_date', '<=', limit_date),
+                ])
+        records += AnimalGroup.search([
+                ('active', '=', False),
+                ('removal_date', '<=', limit_date),
+                ])
+        lots = [r.lot for r in records if r.lot and r.lot.active]
+        if lots:
+            Lot.write(lots, {'active': False})
+        if config.getboolean('farm', 'archive_close_period', default=False):
+            cls._close_archive_period(limit_date)
+
+    @classmethod
+    def _archive_references(cls, archived):
+        '''
+        Yields the model, table, field name and clauses of the Many2One and
+        Reference fields that can point to the archived rows
+        '''
+        pool = Pool()
+        for _, Model in pool.iterobject():
+            if (not issubclass(Model, ModelSQL)
+                    or not backend.TableHandler.table_exist(Model._table)):
+                continue
+            table = Table(Model._table)
+            for name, field in Model._fields.items():
+                column = Column(table, name)
+                if isinstance(field, fields.Function):
+                    continue
+                elif isinstance(field, fields.Many2One):
+                    clauses = [reduce_ids(column, sub_ids)
+                        for sub_ids in grouped_slice(
+                            archived.get(field.model_name, []))]
+                elif isinstance(field, fields.Reference):
+                    values = ['%s,%s' % (model, i)
+                        for model, ids in archived.items() for i in ids]
+                    clauses = [column.in_(list(sub_values))
+                        for sub_values in grouped_slice(values)]
+                else:
+                    continue
+                if clauses:
+                    yield Model, table, name, clauses
+
+    @classmethod
+    def _check_archive_references(cls, archived):
+        '''
+        Raises an error if a record that is not archived requires one of the
+        archived rows
+        '''
+        cursor = Transaction().connection.cursor()
+        for Model, table, name, clauses in cls._archive_references(archived):
+            field = Model._fields[name]
+            if not field.required:
+                continue
+            for clause in clauses:
+                where = clause
+                for sub_ids in grouped_slice(archived.get(Model.__name__, [])):
+                    where &= ~reduce_ids(table.id, sub_ids)
+                cursor.execute(*table.select(table.id, where=where, limit=1))
+                if cursor.fetchone():
+                    raise UserError(gettext('farm.archive_required_reference',
+                            model=Model.__name__, field=field.string))
+
+    @classmethod
+    def _clear_archive_references(cls, archived):
+        "Empty the optional references of the remaining rows to archived rows"
+        cursor = Transaction().connection.cursor()
+        for Model, table, name, clauses in cls._archive_references(archived):
+            if Model._fields[name].required:
+                continue
+            for clause in clauses:
+                cursor.execute(*table.update(
+                        [Column(table, name)], [Null], where=clause))
+        # The stock moves may have been updated
+        clear_quantity_memo()
+
+    @classmethod
+    def _close_archive_period(cls, date):
+        "Close a stock period at date to stop computing the archived moves"
+        pool = Pool()
+        Company = pool.get('company.company')
+        Move = pool.get('stock.move')
+        Period = pool.get('stock.period')
+
+        for company in Company.search([]):
+            if Period.search([
+                        ('company', '=', company.id),
+                        ('date', '>=', date),
+                        ('state', '=', 'closed'),
+                        ], limit=1):
+                continue
+            if Move.search([
+                        ('company', '=', company.id),
+                        ('state', 'not in', ['done', 'cancelled']),
+                        ['OR', [
+                                ('effective_date', '=', None),
+                                ('planned_date', '<=', date),
+                                ], [
+                                ('effective_date', '<=', date),
+                                ]],
+                        ], limit=1):
+                continue
+            period = Period(company=company, date=date)
+            period.save()
+            Period.close([period])
+
 
 class AnimalTag(ModelSQL):
     'Animal - Tag'
@@ -502,7 +1107,7 @@ class AnimalTag(ModelSQL):
     tag = fields.Many2One('farm.tag', 'Tag', ondelete='CASCADE', required=True)
 
 
-class AnimalWeight(ModelSQL, ModelView):
+class AnimalWeight(ArchiveMixin, ModelSQL, ModelView):
     'Farm Animal Weight Record'
     __name__ = 'farm.animal.weight'
     _order = [('timestamp', 'DESC')]
@@ -521,6 +1126,15 @@ class AnimalWeight(ModelSQL, ModelView):
         required=True,
         depends=['unit_digits'])
 
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.animal, Index.Equality()),
+                (t.timestamp, Index.Range())))
+
     @staticmethod
     def default_timestamp():
         return datetime.now()
@@ -533,8 +1147,14 @@ class AnimalWeight(ModelSQL, ModelView):
     def default_unit_digits():
         return 2
 
-    def get_rec_name(self, name):
-        return '%s %s (%s)' % (self.weight, self.uom.symbol, self.timestamp)
+    @classmethod
+    def get_rec_name(cls, weights, name):
+        Uom = Pool().get('product.uom')
+        symbols = {u.id: u.symbol
+            for u in Uom.browse(list({w.uom.id for w in weights}))}
+        return {w.id: '%s %s (%s)' % (w.weight, symbols[w.uom.id],
+                w.timestamp)
+            for w in weights}
 
     @classmethod
     def search_rec_name(cls, name, clause):
@@ -684,11 +1304,15 @@ class Female(metaclass=PoolMeta):
 
     # TODO: call in removal event, when cycle is added (but probably it's
     # called from cycle)
-    def update_state(self):
+    def update_state(self, state_date=None):
+        Census = Pool().get('farm.census')
+        old_state = self.state
         self.state = self.get_state()
         self.current_cycle_state = (self.current_cycle.state
             if self.current_cycle else None)
         self.save()
+        if self.state != old_state:
+            Census.add_state_change(self, old_state, self.state, state_date)
         return self.state
 
     def get_first_mating(self, name):
@@ -845,23 +1469,28 @@ class Female(metaclass=PoolMeta):
         Animal = pool.get('farm.animal')
         Location = pool.get('stock.location')
         vlist = [x.copy() for x in vlist]
+        locations = {l.id: l for l in Location.browse(list({
+                        v.get('initial_location') for v in vlist}))}
+        numbers_by_farm = defaultdict(set)
         for vals in vlist:
             if vals.get('type', '') == 'female' and not vals.get('state'):
                 vals['state'] = 'prospective'
-            number = vals.get('number')
-            initial_location = vals.get('initial_location')
-            location = Location(initial_location)
+            location = locations[vals.get('initial_location')]
             if not location.warehouse:
                 raise UserError(gettext('farm.location_without_warehouse',
                     location=location))
+            if vals.get('number'):
+                numbers_by_farm[location.warehouse_.id].add(vals['number'])
+
+        for farm_id, numbers in numbers_by_farm.items():
             duplicate = Animal.search([
-                    ('number', '=', number),
-                    ('farm', '=', location.warehouse_.id),
+                    ('number', 'in', list(numbers)),
+                    ('farm', '=', farm_id),
                     ('active', '=', True),
                     ], limit=1)
-
             if duplicate:
-                raise UserError(gettext('farm.duplicate_animal', number=number))
+                raise UserError(gettext('farm.duplicate_animal',
+                        number=duplicate[0].number))
         return super(Female, cls).create(vlist)
 
     @classmethod
@@ -899,7 +1528,7 @@ class Female(metaclass=PoolMeta):
         return super(Female, cls).copy(females, default)
 
 
-class FemaleCycle(ModelSQL, ModelView):
+class FemaleCycle(ArchiveMixin, ModelSQL, ModelView):
     'Farm Female Cycle'
     __name__ = 'farm.animal.female_cycle'
     _order = [
@@ -964,6 +1593,15 @@ class FemaleCycle(ModelSQL, ModelView):
         'get_lactating_days')
     observations = fields.Text('Observations')
 
+    @classmethod
+    def __setup__(cls):
+        super(FemaleCycle, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.animal, Index.Equality()),
+                (t.sequence, Index.Range())))
+
     @staticmethod
     def default_sequence(animal_id=None):
         '''
@@ -1007,9 +1645,11 @@ class FemaleCycle(ModelSQL, ModelView):
         if past_date > current_date:
             raise UserError(gettext('farm.cycle_invalid_date'))
 
-    def get_rec_name(self, name):
-        state_labels = dict(self.fields_get(['state'])['state']['selection'])
-        return "%s (%s)" % (self.sequence, state_labels[self.state])
+    @classmethod
+    def get_rec_name(cls, cycles, name):
+        state_labels = dict(cls.fields_get(['state'])['state']['selection'])
+        return {c.id: "%s (%s)" % (c.sequence, state_labels[c.state])
+            for c in cycles}
 
     # TODO: call in weaning, farrowing, abort, pregnancy_diagnosis and
     # insemination event (in 'valid()' and 'cancel()')
@@ -1050,7 +1690,8 @@ class FemaleCycle(ModelSQL, ModelView):
                     break
         self.state = state
         self.save()
-        self.animal.update_state()
+        self.animal.update_state(validated_event.timestamp.date()
+            if validated_event else None)
         return state
 
     def get_days_between_weaning_and_insemination(self, name):
@@ -1117,33 +1758,132 @@ class FemaleCycle(ModelSQL, ModelView):
         return super(FemaleCycle, cls).create(vlist)
 
 
-class EventUnion(UnionMixin, ModelSQL, ModelView):
-    'Union between female cycles and events'
+class EventJournal(KeysetPaginationMixin, ArchiveMixin, ModelSQL, ModelView):
+    'Animal Events Journal'
     __name__ = 'farm.animal.cycle.events'
+    _order = [
+        ('timestamp', 'ASC'),
+        ('id', 'ASC'),
+        ]
 
-    timestamp = fields.DateTime('Date & Time', required=True)
-    cycle = fields.Function(fields.Many2One('farm.animal.female_cycle',
-        'Cycle'), 'get_cycle')
-    event_type = fields.Function(fields.Char('Event Type'), 'get_event_type')
+    farm = fields.Many2One('stock.location', 'Farm', readonly=True)
+    specie = fields.Many2One('farm.specie', 'Specie', readonly=True)
+    animal = fields.Many2One('farm.animal', 'Animal', readonly=True,
+        ondelete='CASCADE')
+    animal_group = fields.Many2One('farm.animal.group', 'Group',
+        readonly=True, ondelete='CASCADE')
+    event_type = fields.Selection('get_fieldname', 'Event Type',
+        required=True, readonly=True)
+    event_id = fields.Integer('Event ID', required=True, readonly=True)
     event_link = fields.Function(fields.Reference('Event',
         selection='get_fieldname'), 'get_event')
-    animal = fields.Many2One('farm.animal', 'Animal')
+    timestamp = fields.DateTime('Date & Time', required=True, readonly=True)
+    cycle = fields.Many2One('farm.animal.female_cycle', 'Cycle',
+        readonly=True, ondelete='SET NULL')
+    state = fields.Selection(_EVENT_STATES, 'State', readonly=True)
+    _archive_parent = 'event_id'
 
     @classmethod
     def __setup__(cls):
-        super(EventUnion, cls).__setup__()
+        super(EventJournal, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('event_uniq', Unique(t, t.event_type, t.event_id),
+                'farm.animal_event_journal_unique'),
+            ]
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.animal, Index.Equality()),
+                    (t.timestamp, Index.Range()),
+                    where=t.animal != Null),
+                Index(t,
+                    (t.animal_group, Index.Equality()),
+                    (t.timestamp, Index.Range()),
+                    where=t.animal_group != Null),
+                })
         cls.__rpc__.update({
                'get_fieldname': RPC(),
                 })
-        cls._order.insert(0, ('timestamp', 'ASC'))
+
+    @classmethod
+    def __register__(cls, module_name):
+        fill = not backend.TableHandler.table_exist(cls._table)
+        super(EventJournal, cls).__register__(module_name)
+        if fill:
+            cls._fill_journal()
+
+    @classmethod
+    def _fill_journal(cls):
+        "Load the journal from the events already stored in the database"
+        pool = Pool()
+        TableHandler = backend.TableHandler
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        for model in cls._get_fieldname():
+            Event = pool.get(model)
+            if not TableHandler.table_exist(Event._table):
+                continue
+            event = Event.__table__()
+            from_item = event
+            cycle = Null
+            cycle_field = Event._fields.get('female_cycle')
+            if isinstance(cycle_field, fields.One2One):
+                Relation = pool.get(cycle_field.relation_name)
+                if TableHandler.table_exist(Relation._table):
+                    relation = Relation.__table__()
+                    from_item = event.join(relation, 'LEFT', condition=(
+                            Column(relation, cycle_field.origin) == event.id))
+                    cycle = Column(relation, cycle_field.target)
+            elif cycle_field:
+                cycle = event.female_cycle
+            cursor.execute(*table.insert(
+                    columns=[table.create_uid, table.create_date,
+                        table.farm, table.specie, table.animal,
+                        table.animal_group, table.event_type, table.event_id,
+                        table.timestamp, table.cycle, table.state],
+                    values=from_item.select(
+                        Literal(0), CurrentTimestamp(),
+                        event.farm, event.specie, event.animal,
+                        event.animal_group, Literal(model), event.id,
+                        event.timestamp, cycle, event.state)))
+
+    @classmethod
+    def _get_archive_ids(cls, animals, groups, archived):
+        "The lines of the journal are archived with their events"
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        ids = []
+        for model in cls._get_fieldname():
+            for sub_ids in grouped_slice(archived.get(model, [])):
+                cursor.execute(*table.select(table.id,
+                        where=(table.event_type == model)
+                        & reduce_ids(table.event_id, sub_ids)))
+                ids.extend(r for r, in cursor)
+        return ids
+
+    @classmethod
+    def create_event_partitions(cls):
+        '''
+        Create the partitions of the next periods of the event tables and move
+        the back-dated rows of their default partition to their periods
+        '''
+        pool = Pool()
+        interval = partition_interval()
+        if not interval:
+            return
+        for model in cls._get_fieldname():
+            Event = pool.get(model)
+            if is_partitioned(Event._table):
+                create_partitions(Event._table, interval)
+                split_default_partition(Event._table, 'timestamp', interval)
 
     @classmethod
     def _get_fieldname(cls):
-        return ['farm.abort.event', 'farm.event.order',
-            'farm.farrowing.event', 'farm.feed.event',
-            'farm.foster.event', 'farm.insemination.event',
-            'farm.medication.event', 'farm.move.event',
-            'farm.pregnancy_diagnosis.event', 'farm.removal.event',
+        return ['farm.abort.event', 'farm.farrowing.event',
+            'farm.feed.event', 'farm.foster.event',
+            'farm.insemination.event', 'farm.medication.event',
+            'farm.move.event', 'farm.pregnancy_diagnosis.event',
+            'farm.reclassification.event', 'farm.removal.event',
             'farm.semen_extraction.event', 'farm.transformation.event',
             'farm.weaning.event']
 
@@ -1151,45 +1891,76 @@ class EventUnion(UnionMixin, ModelSQL, ModelView):
     def get_fieldname(cls):
         pool = Pool()
         Model = pool.get('ir.model')
-        models = cls._get_fieldname()
-        models = Model.search([
-                ('name', 'in', models),
-                ])
-        return [('', '')] + [(m.name, m.string) for m in models]
+        return [('', '')] + [(m, Model.get_name(m))
+            for m in cls._get_fieldname()]
 
-    def _get_event(self):
-        cls = self.__class__
-        model = cls.union_unshard(self.id)
-        return model
+    @classmethod
+    def get_event(cls, records, name):
+        return {r.id: '%s,%s' % (r.event_type, r.event_id) for r in records}
 
-    def get_event_type(self, name=None):
-        pool = Pool()
-        Model = pool.get('ir.model')
-        model, = Model.search([
-                ('name', '=', self._get_event().__class__.__name__),
-                ], limit=1)
-        return model.name
+    @classmethod
+    def _get_event_values(cls, event):
+        cycle = getattr(event, 'female_cycle', None)
+        return {
+            'farm': event.farm.id,
+            'specie': event.specie.id,
+            'animal': event.animal.id if event.animal else None,
+            'animal_group': (event.animal_group.id
+                if event.animal_group else None),
+            'event_type': event.__name__,
+            'event_id': event.id,
+            'timestamp': event.timestamp,
+            'cycle': cycle.id if cycle else None,
+            'state': event.state,
+            }
 
-    def get_event(self, name=None):
-        return str(self._get_event())
+    @classmethod
+    def add_events(cls, events):
+        "Register the events in the journal"
+        HerdKpi = Pool().get('farm.herd.kpi')
+        if not events:
+            return
+        values = [cls._get_event_values(e) for e in events]
+        with Transaction().set_context(_check_access=False):
+            cls.create(values)
+        HerdKpi.invalidate(values)
 
-    def get_cycle(self, name=None):
-        model = self._get_event()
-        if hasattr(model, 'female_cycle') and model.female_cycle:
-            return model.female_cycle.id
-        return None
+    @classmethod
+    def remove_events(cls, events):
+        '''
+        Remove the events from the journal. The KPIs of their previous dates
+        are invalidated.
+        '''
+        HerdKpi = Pool().get('farm.herd.kpi')
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+        ids_by_model = defaultdict(list)
+        for event in events:
+            ids_by_model[event.__name__].append(event.id)
+        values = []
+        for model, ids in ids_by_model.items():
+            for sub_ids in grouped_slice(ids):
+                where = ((table.event_type == model)
+                    & reduce_ids(table.event_id, sub_ids))
+                cursor.execute(*table.select(table.farm, table.specie,
+                        table.event_type, table.timestamp, where=where))
+                values.extend({
+                        'farm': farm_id,
+                        'specie': specie_id,
+                        'event_type': event_type,
+                        'timestamp': timestamp,
+                        } for farm_id, specie_id, event_type, timestamp
+                    in cursor)
+                cursor.execute(*table.delete(where=where))
+        HerdKpi.invalidate(values)
 
-    @staticmethod
-    def union_models():
-        res = super(EventUnion, EventUnion).union_models()
-        models = ['farm.abort.event', 'farm.event.order',
-            'farm.farrowing.event', 'farm.feed.event',
-            'farm.foster.event', 'farm.insemination.event',
-            'farm.medication.event', 'farm.move.event',
-            'farm.pregnancy_diagnosis.event', 'farm.removal.event',
-            'farm.semen_extraction.event', 'farm.transformation.event',
-            'farm.weaning.event']
-        return res + models
+    @classmethod
+    def update_events(cls, events):
+        "Refresh the journal lines of the events"
+        if not events:
+            return
+        cls.remove_events(events)
+        cls.add_events(events)
 
 
 class ChangeCycleObservationStart(ModelView):
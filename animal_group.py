@@ -1,22 +1,30 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
-from datetime import date, datetime
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 
-from trytond.model import ModelView, ModelSQL, fields
+from trytond.model import ModelView, ModelSQL, fields, Index, Unique
 from trytond.pyson import Equal, Eval, Greater, Id, Not
 from trytond.transaction import Transaction
 from trytond.pool import Pool
+from trytond.rpc import RPC
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
+from trytond.tools import grouped_slice, reduce_ids
+from sql import Column
 
-from .animal import AnimalMixin
-
+from .animal import AnimalMixin, _week_start
 
 
 class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
     'Group of Farm Animals'
     __name__ = 'farm.animal.group'
+    _feed_event_field = 'animal_group'
+    _consumed_feed_per_animal = True
+    _weight_model = 'farm.animal.group.weight'
+    _weight_field = 'group'
+    _performance_week_field = 'group'
 
     specie = fields.Many2One('farm.specie', 'Specie', required=True,
         states={
@@ -74,7 +82,7 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
         'Weight Records', readonly=False, order=[('timestamp', 'DESC')])
     current_weight = fields.Function(fields.Many2One(
             'farm.animal.group.weight', 'Current Weight'),
-        'on_change_with_current_weight')
+        'get_current_weight')
     tags = fields.Many2Many('farm.animal.group-farm.tag', 'group', 'tag',
         'Tags')
     notes = fields.Text('Notes')
@@ -85,7 +93,15 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
         fields.Numeric('Consumed Feed per Animal (Kg)',
             digits=(16, Eval('feed_unit_digits', 2)),
             depends=['feed_unit_digits']),
-        'get_consumed_feed')
+        'get_consumed_feed', searcher='search_consumed_feed')
+    adg = fields.Function(fields.Float('Average Daily Gain (Kg)',
+            digits=(16, 3)),
+        'get_performance')
+    fcr = fields.Function(fields.Float('Feed Conversion Ratio',
+            digits=(16, 3)),
+        'get_performance')
+    mortality = fields.Function(fields.Float('Mortality (%)', digits=(16, 2)),
+        'get_performance')
     current_location = fields.Function(fields.Many2One('stock.location',
         'Current Location'), 'get_current_location')
 #    # TODO: Extra
@@ -103,6 +119,9 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
             #    'In Groups, the initial quantity must be positive (greater or '
             #    'equals 1)'),
             ]
+        cls.__rpc__.update({
+                'get_weight_series': RPC(),
+                })
 
     @staticmethod
     def default_specie():
@@ -130,11 +149,27 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
     def default_active():
         return True
 
-    def get_rec_name(self, name):
-        name = self.lot.number
-        if not self.active:
-            name += ' (*)'
-        return name
+    @classmethod
+    def get_rec_name(cls, groups, name):
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        LotGroup = pool.get('stock.lot-farm.animal.group')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        lot_group = LotGroup.__table__()
+        lot = Lot.__table__()
+
+        names = dict.fromkeys([g.id for g in groups])
+        for sub_ids in grouped_slice(list(names)):
+            cursor.execute(*table.join(lot_group,
+                    condition=lot_group.animal_group == table.id
+                    ).join(lot, condition=lot_group.lot == lot.id
+                    ).select(table.id, lot.number, table.active,
+                    where=reduce_ids(table.id, sub_ids)))
+            for group_id, number, active in cursor:
+                names[group_id] = (number or '') + (
+                    '' if active else ' (*)')
+        return names
 
     def get_current_location(self, name):
         if not self.locations:
@@ -305,44 +340,92 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
         return [('lot', ) + tuple(t[1:]) if t[0] == 'id'
             else ('lot.' + t[0], ) + tuple(t[1:]) for t in lot_domain]
 
+    @classmethod
+    def get_performance(cls, groups, names):
+        result = super(AnimalGroup, cls).get_performance(groups, names)
+        if 'mortality' in names:
+            ranges = cls._get_performance_ranges(groups)
+            group_ids = list(ranges)
+            deaths = cls._get_period_values('deaths',
+                [(g,) + ranges[g] for g in group_ids])
+            quantities = cls._get_start_quantities(groups, ranges)
+            for group_id, dead in zip(group_ids, deaths):
+                if quantities.get(group_id):
+                    result['mortality'][group_id] = (
+                        dead * 100 / quantities[group_id])
+        return result
+
+    @classmethod
+    def _get_deaths(cls, segments):
+        "Returns the number of animals removed dead in each segment"
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        RemovalEvent = pool.get('farm.removal.event')
+        cursor = Transaction().connection.cursor()
+        event = RemovalEvent.__table__()
+
+        values = [0] * len(segments)
+        if not segments:
+            return values
+        death = ModelData.get_id('farm', 'removal_type_death_on_farm')
+        by_group = defaultdict(list)
+        for i, (group_id, start, end) in enumerate(segments):
+            by_group[group_id].append((i, start, end))
+        where = ((event.state == 'validated')
+            & (event.removal_type == death)
+            & (event.timestamp >= datetime.combine(
+                    min(s for _, s, _ in segments), time.min))
+            & (event.timestamp <= datetime.combine(
+                    max(e for _, _, e in segments), time.max)))
+        for sub_ids in grouped_slice(list(by_group)):
+            cursor.execute(*event.select(event.animal_group, event.timestamp,
+                    event.quantity,
+                    where=where & reduce_ids(event.animal_group, sub_ids)))
+            for group_id, timestamp, quantity in cursor:
+                for i, start, end in by_group[group_id]:
+                    if start <= timestamp.date() <= end:
+                        values[i] += quantity or 0
+        return values
+
+    @classmethod
+    def _get_start_quantities(cls, groups, ranges):
+        "Returns the number of animals of each group at the start of its range"
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+
+        result = {}
+        groups_by_date = defaultdict(list)
+        for group in groups:
+            start = ranges[group.id][0]
+            if not group.arrival_date or start <= group.arrival_date:
+                result[group.id] = group.initial_quantity
+            elif group.lot:
+                groups_by_date[start].append(group)
+        if not groups_by_date:
+            return result
+
+        with Transaction().set_context(_check_access=False,
+                restrict_by_specie_animal_type=False):
+            warehouse_ids = [w.id for w in Location.search([
+                        ('type', '=', 'warehouse'),
+                        ])]
+        for start, start_groups in groups_by_date.items():
+            with Transaction().set_context(
+                    stock_date_end=start - timedelta(days=1)):
+                quantities = Lot.quantity_by_location(
+                    [g.lot for g in start_groups], warehouse_ids,
+                    with_childs=True)
+            for group in start_groups:
+                result[group.id] = sum(
+                    quantities.get(group.lot.id, {}).values())
+        return result
+
     @fields.depends('weights')
     def on_change_with_current_weight(self, name=None):
         if self.weights:
             return self.weights[0].id
 
-    def get_consumed_feed(self, name):
-        pool = Pool()
-        FeedEvent = pool.get('farm.feed.event')
-        Uom = pool.get('product.uom')
-
-        now = datetime.now()
-        feed_events = FeedEvent.search([
-                ('animal_type', '=', 'group'),
-                ('animal_group', '=', self.id),
-                ('state', 'in', ['provisional', 'validated']),
-                ['OR', [
-                    ('start_date', '=', None),
-                    ('timestamp', '<=', now),
-                    ], [
-                    ('start_date', '<=', now.date()),
-                    ]],
-                ])
-
-        kg, = Uom.search([('symbol', '=', 'kg')], limit=1)
-        consumed_feed = Decimal(0)
-        for event in feed_events:
-            if event.start_date and event.timestamp > now:
-                event_feed_quantity = (event.feed_quantity_animal_day *
-                    (now.date() - event.start_date).days)
-            else:
-                event_feed_quantity = event.feed_quantity / event.quantity
-            # TODO: it uses compute_price() because quantity is a Decimal
-            # quantity in feed_product default uom. The method is not for
-            # this purpose but it works
-            consumed_feed = Uom.compute_price(kg, event_feed_quantity,
-                event.uom)
-        return consumed_feed
-
     def check_in_location(self, location, timestamp, quantity=1):
         Lot = Pool().get('stock.lot')
         with Transaction().set_context(
@@ -386,19 +469,35 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
 
         context = Transaction().context
         vlist = [x.copy() for x in vlist]
+        locations = {l.id: l for l in Location.browse(list({
+                        v['initial_location'] for v in vlist
+                        if not v.get('number')}))}
+        to_number = defaultdict(list)
         for vals in vlist:
             if not vals.get('specie'):
                 vals['specie'] = context.get('specie')
             if not vals.get('number'):
-                location = Location(vals['initial_location'])
-                vals['number'] = cls._calc_number(vals['specie'],
-                        location.warehouse.id, vals)
+                location = locations[vals['initial_location']]
+                to_number[(vals['specie'], location.warehouse.id)].append(
+                    vals)
+        for (specie_id, farm_id), to_number_vlist in to_number.items():
+            numbers = cls._calc_numbers(specie_id, farm_id,
+                len(to_number_vlist))
+            for vals, number in zip(to_number_vlist, numbers):
+                vals['number'] = number
+
+        to_write = []
+        for vals in vlist:
             if vals.get('lot'):
-                lot = Lot(vals['lot'])
-                Lot.write([lot], cls._get_lot_values(vals, False))
-            else:
-                new_lot, = Lot.create([cls._get_lot_values(vals, True)])
-                vals['lot'] = new_lot.id
+                to_write.extend(([Lot(vals['lot'])],
+                        cls._get_lot_values(vals, False)))
+        if to_write:
+            Lot.write(*to_write)
+        to_create = [vals for vals in vlist if not vals.get('lot')]
+        new_lots = Lot.create([cls._get_lot_values(vals, True)
+                for vals in to_create])
+        for vals, lot in zip(to_create, new_lots):
+            vals['lot'] = lot.id
         new_groups = super(AnimalGroup, cls).create(vlist)
         if not context.get('no_create_stock_move'):
             cls._create_and_done_first_stock_move(new_groups)
@@ -406,24 +505,28 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
 
     @classmethod
     def _calc_number(cls, specie_id, farm_id, vals):
+        return cls._calc_numbers(specie_id, farm_id, 1)[0]
+
+    @classmethod
+    def _calc_numbers(cls, specie_id, farm_id, count):
+        '''
+        Return a list of count new numbers for groups in the farm
+        '''
         pool = Pool()
         FarmLine = pool.get('farm.specie.farm_line')
         Location = pool.get('stock.location')
         Specie = pool.get('farm.specie')
 
-        farm_lines = FarmLine.search([
-                ('specie', '=', specie_id),
-                ('farm', '=', farm_id),
-                ('has_group', '=', True),
-                ])
-        if not farm_lines:
+        farm_line = FarmLine.get_farm_line(specie_id, farm_id, 'group')
+        if not farm_line:
             raise UserError(gettext(
                     'farm.group_no_farm_specie_farm_line_available',
                     farm=Location(farm_id).rec_name if farm_id else '',
                     specie=Specie(specie_id).rec_name if specie_id else '-',
                     ))
-        sequence = farm_lines[0].group_sequence
-        return sequence and sequence.get() or ''
+        if not farm_line.group_sequence:
+            return [''] * count
+        return farm_line.get_numbers('group_sequence', count)
 
     @classmethod
     def _get_lot_values(cls, group_vals, create):
@@ -461,6 +564,133 @@ class AnimalGroup(ModelSQL, ModelView, AnimalMixin):
         return result
 
 
+class AnimalGroupPerformanceWeek(ModelSQL):
+    "Animal Group Performance Week"
+    __name__ = 'farm.animal.group.performance.week'
+
+    group = fields.Many2One('farm.animal.group', 'Group',
+        ondelete='CASCADE')
+    animal = fields.Many2One('farm.animal', 'Animal', ondelete='CASCADE')
+    week = fields.Date('Week', required=True,
+        help="The Monday of the week.")
+    feed = fields.Float('Feed per Animal (Kg)', required=True)
+    deaths = fields.Integer('Deaths', required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('group_week_uniq', Unique(t, Column(t, 'group'), t.week),
+                'farm.group_performance_week_unique'),
+            ('animal_week_uniq', Unique(t, t.animal, t.week),
+                'farm.animal_performance_week_unique'),
+            ]
+
+    @classmethod
+    def get_values(cls, Model, name, keys):
+        """
+        Returns the value of name for each (record id, week) of keys of the
+        groups or animals of Model. The weeks not stored yet are computed.
+        """
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        record = Column(table, Model._performance_week_field)
+
+        keys = set(keys)
+        values = {}
+        for sub_ids in grouped_slice(list({r for r, _ in keys})):
+            cursor.execute(*table.select(record, table.week,
+                    Column(table, name),
+                    where=reduce_ids(record, sub_ids)))
+            for record_id, week, value in cursor:
+                if (record_id, week) in keys:
+                    values[(record_id, week)] = value
+
+        missing = sorted(keys - set(values))
+        for key, value in zip(missing,
+                cls._compute_values(Model, missing)[name]):
+            values[key] = value
+        return values
+
+    @classmethod
+    def _compute_values(cls, Model, keys):
+        "Returns the list of values of each (record id, week) of keys by name"
+        segments = [(r, w, w + timedelta(days=6)) for r, w in keys]
+        return {
+            'feed': Model._compute_period_values('feed', segments),
+            'deaths': Model._compute_period_values('deaths', segments),
+            }
+
+    @classmethod
+    def update_weeks(cls):
+        """
+        Stores the closed weeks of the active groups and animals. The weeks
+        are only stored here so the readers never write the cache.
+        """
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        AnimalGroup = pool.get('farm.animal.group')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        today = date.today()
+        current_week = _week_start(today)
+
+        for Model in [AnimalGroup, Animal]:
+            field = Model._performance_week_field
+            record = Column(table, field)
+            records = Model.search([
+                    ('arrival_date', '<', current_week),
+                    ])
+            for sub_records in grouped_slice(records):
+                sub_records = list(sub_records)
+                cursor.execute(*table.select(record, table.week,
+                        where=reduce_ids(record,
+                            [r.id for r in sub_records])))
+                stored = set(cursor)
+                keys = []
+                for sub_record in sub_records:
+                    week = _week_start(sub_record.arrival_date)
+                    while week < current_week:
+                        if (sub_record.id, week) not in stored:
+                            keys.append((sub_record.id, week))
+                        week += timedelta(days=7)
+                if not keys:
+                    continue
+                values = cls._compute_values(Model, keys)
+                cls.create([{
+                            field: r,
+                            'week': w,
+                            'feed': f,
+                            'deaths': d,
+                            } for (r, w), f, d in zip(
+                            keys, values['feed'], values['deaths'])])
+
+    @classmethod
+    def invalidate(cls, events):
+        "Removes the weeks of the records of the events from the event dates"
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        dates = {}
+        for event in events:
+            if event.animal_type == 'group':
+                if not event.animal_group:
+                    continue
+                key = ('group', event.animal_group.id)
+            elif event.animal:
+                key = ('animal', event.animal.id)
+            else:
+                continue
+            event_date = (getattr(event, 'start_date', None)
+                or event.timestamp.date())
+            dates[key] = min(dates.get(key, event_date), event_date)
+        for (field, record_id), event_date in dates.items():
+            cursor.execute(*table.delete(
+                    where=(Column(table, field) == record_id)
+                    & (table.week > event_date - timedelta(days=7))))
+
+
 class AnimalGroupTag(ModelSQL):
     'Animal Group - Tag'
     __name__ = 'farm.animal.group-farm.tag'
@@ -469,7 +699,7 @@ class AnimalGroupTag(ModelSQL):
     tag = fields.Many2One('farm.tag', 'Tag', ondelete='CASCADE', required=True)
 
 
-class AnimalGroupWeight(ModelSQL, ModelView):
+class AnimalGroupWeight(ArchiveMixin, ModelSQL, ModelView):
     'Farm Animal Group Weight Record'
     __name__ = 'farm.animal.group.weight'
     _order = ('timestamp', 'DESC')
@@ -486,6 +716,18 @@ class AnimalGroupWeight(ModelSQL, ModelView):
         digits=(16, Eval('unit_digits', 2)),
         required=True,
         depends=['unit_digits'])
+    cv = fields.Float('Coefficient of Variation (%)', digits=(16, 2),
+        readonly=True,
+        help='Uniformity of the weights of the individuals of the group.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (Column(t, 'group'), Index.Equality()),
+                (t.timestamp, Index.Range())))
 
     @staticmethod
     def default_timestamp():
@@ -499,8 +741,14 @@ class AnimalGroupWeight(ModelSQL, ModelView):
     def default_unit_digits():
         return 2
 
-    def get_rec_name(self, name):
-        return '%s %s (%s)' % (self.weight, self.uom.symbol, self.timestamp)
+    @classmethod
+    def get_rec_name(cls, weights, name):
+        Uom = Pool().get('product.uom')
+        symbols = {u.id: u.symbol
+            for u in Uom.browse(list({w.uom.id for w in weights}))}
+        return {w.id: '%s %s (%s)' % (w.weight, symbols[w.uom.id],
+                w.timestamp)
+            for w in weights}
 
     @classmethod
     def search_rec_name(cls, name, clause):
@@ -0,0 +1,160 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from sql import Column, Null, Table
+
+from trytond import backend
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model import fields
+from trytond.pool import Pool
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['ArchiveMixin']
+
+
+def _table_columns(table_name):
+    cursor = Transaction().connection.cursor()
+    if backend.name == 'postgresql':
+        cursor.execute('SELECT column_name FROM information_schema.columns '
+            'WHERE table_name = %s', (table_name,))
+        return {r for r, in cursor}
+    cursor.execute('PRAGMA table_info("%s")' % table_name)
+    return {r[1] for r in cursor}
+
+
+class ArchiveMixin:
+    """
+    Keeps an archive table with the same columns than the table of the model
+    where the records of old removed animals and groups are moved. The
+    archived records can be read setting farm_archive in the context.
+    """
+    __slots__ = ()
+    # Name of the Many2One or Reference field that decides if the record is
+    # archived instead of the animal or group of the record
+    _archive_parent = None
+
+    @classmethod
+    def __register__(cls, module_name):
+        super().__register__(module_name)
+        cursor = Transaction().connection.cursor()
+        archive_table = cls._archive_table()
+        if not backend.TableHandler.table_exist(archive_table):
+            cursor.execute('CREATE TABLE "%s" AS SELECT * FROM "%s" '
+                'WHERE 1 = 0' % (archive_table, cls._table))
+            cursor.execute('CREATE INDEX "%s_id_index" ON "%s" (id)'
+                % (archive_table, archive_table))
+            return
+        archive_columns = _table_columns(archive_table)
+        for name in cls._archive_columns():
+            if name not in archive_columns:
+                cursor.execute('ALTER TABLE "%s" ADD COLUMN "%s" %s' % (
+                        archive_table, name,
+                        cls._fields[name].sql_type().base))
+
+    @classmethod
+    def __table__(cls):
+        if Transaction().context.get('farm_archive'):
+            return Table(cls._archive_table())
+        return super().__table__()
+
+    @classmethod
+    def _archive_table(cls):
+        return '%s__archive' % cls._table
+
+    @classmethod
+    def _archive_columns(cls):
+        return [n for n, f in cls._fields.items()
+            if not isinstance(f, fields.Function)
+            and getattr(f, '_sql_type', None)]
+
+    @classmethod
+    def _check_archive(cls):
+        if Transaction().context.get('farm_archive'):
+            raise UserError(gettext('farm.archive_readonly'))
+
+    @classmethod
+    def create(cls, vlist):
+        cls._check_archive()
+        return super().create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        cls._check_archive()
+        super().write(*args)
+
+    @classmethod
+    def delete(cls, records):
+        cls._check_archive()
+        super().delete(records)
+
+    @classmethod
+    def _get_archive_ids(cls, animals, groups, archived):
+        """
+        Returns the ids of the records to archive for the animals and groups
+        queries. archived contains the ids already selected by model.
+        """
+        cursor = Transaction().connection.cursor()
+        table = Table(cls._table)
+        if cls._archive_parent:
+            field = cls._fields[cls._archive_parent]
+            if isinstance(field, fields.Reference):
+                column = Column(table, cls._archive_parent)
+                values = ['%s,%s' % (model, i)
+                    for model, _ in field.selection
+                    for i in archived.get(model, [])]
+                ids = []
+                for sub_values in grouped_slice(values):
+                    cursor.execute(*table.select(table.id,
+                            where=column.in_(list(sub_values))))
+                    ids.extend(r for r, in cursor)
+                return ids
+            Parent = Pool().get(field.model_name)
+            parent_ids = archived.get(Parent.__name__)
+            if not parent_ids:
+                return []
+            ids = []
+            for sub_ids in grouped_slice(parent_ids):
+                cursor.execute(*table.select(table.id,
+                        where=reduce_ids(
+                            Column(table, cls._archive_parent), sub_ids)))
+                ids.extend(r for r, in cursor)
+            return ids
+        condition = None
+        for name, query in [
+                ('animal', animals),
+                ('animal_group', groups),
+                ('group', groups),
+                ]:
+            if not isinstance(cls._fields.get(name), fields.Many2One):
+                continue
+            clause = Column(table, name).in_(query)
+            condition = clause if condition is None else condition | clause
+        if condition is None:
+            return []
+        # The records of a destination that is not archived keep their
+        # history
+        for name, query in [
+                ('to_animal', animals),
+                ('to_animal_group', groups),
+                ]:
+            if isinstance(cls._fields.get(name), fields.Many2One):
+                column = Column(table, name)
+                condition &= (column == Null) | column.in_(query)
+        cursor.execute(*table.select(table.id, where=condition))
+        return [r for r, in cursor]
+
+    @classmethod
+    def _archive(cls, ids):
+        "Moves the rows of ids to the archive table"
+        cursor = Transaction().connection.cursor()
+        table = Table(cls._table)
+        archive = Table(cls._archive_table())
+        columns = cls._archive_columns()
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*archive.insert(
+                    columns=[Column(archive, c) for c in columns],
+                    values=table.select(*[Column(table, c) for c in columns],
+                        where=reduce_ids(table.id, sub_ids))))
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.id, sub_ids)))
@@ -0,0 +1,254 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from collections import defaultdict
+from datetime import date, timedelta
+
+from sql import Cast, Column, Literal, Null
+from sql.aggregate import Sum
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+
+from trytond import backend
+from trytond.model import ModelSQL, fields, Index
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.transaction import Transaction
+
+__all__ = ['Census']
+
+_CENSUS_KEYS = ['farm', 'location', 'specie', 'animal_type', 'state']
+
+
+class Census(ModelSQL):
+    '''
+    Farm Census
+
+    Each record is a change in the number of heads of a farm location. The
+    headcount at a date is the sum of the changes up to that date.
+    '''
+    __name__ = 'farm.census'
+
+    date = fields.Date('Date', required=True)
+    farm = fields.Many2One('stock.location', 'Farm', required=True,
+        ondelete='CASCADE')
+    location = fields.Many2One('stock.location', 'Location', required=True,
+        ondelete='CASCADE')
+    specie = fields.Many2One('farm.specie', 'Specie', required=True,
+        ondelete='CASCADE')
+    animal_type = fields.Selection([
+            ('male', 'Male'),
+            ('female', 'Female'),
+            ('individual', 'Individual'),
+            ('group', 'Group'),
+            ], 'Animal Type', required=True)
+    state = fields.Char('Female State')
+    heads = fields.Integer('Heads', required=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.farm, Index.Equality()),
+                    (t.date, Index.Range())),
+                Index(t, (t.date, Index.Range())),
+                })
+        cls.__rpc__.update({
+                'get_series': RPC(),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        fill = not backend.TableHandler.table_exist(cls._table)
+        super().__register__(module_name)
+        if fill:
+            cls.backfill()
+
+    @classmethod
+    def _get_record(cls, lot):
+        "Returns the animal or group of the lot"
+        if lot.animal_type == 'group':
+            return lot.animal_group
+        return lot.animal
+
+    @classmethod
+    def add_moves(cls, moves):
+        "Records the heads moved by the done moves of animal lots"
+        cls._create_moves(moves, 1)
+
+    @classmethod
+    def remove_moves(cls, moves):
+        "Reverses the heads moved by the done moves of animal lots"
+        cls._create_moves(moves, -1)
+
+    @classmethod
+    def _create_moves(cls, moves, sign):
+        to_create = []
+        for move in moves:
+            lot = move.lot
+            if move.state != 'done' or not lot or not lot.animal_type:
+                continue
+            record = cls._get_record(lot)
+            if not record:
+                continue
+            state = getattr(record, 'state', None)
+            for location, location_sign in [
+                    (move.from_location, -1),
+                    (move.to_location, 1),
+                    ]:
+                if not location.warehouse:
+                    continue
+                to_create.append({
+                        'date': move.effective_date or date.today(),
+                        'farm': location.warehouse.id,
+                        'location': location.id,
+                        'specie': record.specie.id,
+                        'animal_type': lot.animal_type,
+                        'state': state,
+                        'heads': sign * location_sign * int(move.quantity),
+                        })
+        if to_create:
+            with Transaction().set_context(_check_access=False):
+                cls.create(to_create)
+
+    @classmethod
+    def add_state_change(cls, female, old_state, new_state, state_date=None):
+        '''
+        Records the change of state of the female in its location at
+        state_date. The moves of the female done after state_date were
+        recorded with the old state, so they are changed to the new one.
+        '''
+        Move = Pool().get('stock.move')
+        state_date = state_date or date.today()
+        moves = []
+        if female.lot:
+            moves = Move.search([
+                    ('lot', '=', female.lot.id),
+                    ('state', '=', 'done'),
+                    ('effective_date', '>', state_date),
+                    ], order=[('effective_date', 'ASC'), ('id', 'ASC')])
+        location = moves[0].from_location if moves else female.location
+        changes = [(state_date, location, 1)]
+        for move in moves:
+            changes.append((move.effective_date, move.from_location, -1))
+            changes.append((move.effective_date, move.to_location, 1))
+        to_create = []
+        for day, location, sign in changes:
+            if not location or not location.warehouse:
+                continue
+            values = {
+                'date': day,
+                'farm': location.warehouse.id,
+                'location': location.id,
+                'specie': female.specie.id,
+                'animal_type': 'female',
+                }
+            to_create.append(dict(values, state=old_state, heads=-sign))
+            to_create.append(dict(values, state=new_state, heads=sign))
+        if to_create:
+            with Transaction().set_context(_check_access=False):
+                cls.create(to_create)
+
+    @classmethod
+    def backfill(cls):
+        '''
+        Rebuilds the census from the done moves of the animal lots. The
+        history of the states of the females is unknown, so their moves are
+        recorded with their current state.
+        '''
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        AnimalGroup = pool.get('farm.animal.group')
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+        LotGroup = pool.get('stock.lot-farm.animal.group')
+        Move = pool.get('stock.move')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        cursor.execute(*table.delete())
+        for field, sign in [('from_location', -1), ('to_location', 1)]:
+            move = Move.__table__()
+            lot = Lot.__table__()
+            location = Location.__table__()
+            warehouse = Location.__table__()
+            animal = Animal.__table__()
+            lot_group = LotGroup.__table__()
+            group = AnimalGroup.__table__()
+            location_column = Column(move, field)
+            query = move.join(lot, condition=move.lot == lot.id
+                ).join(location, condition=location_column == location.id
+                ).join(warehouse, condition=(warehouse.type == 'warehouse')
+                    & (warehouse.left <= location.left)
+                    & (warehouse.right >= location.right)
+                ).join(animal, 'LEFT', condition=lot.animal == animal.id
+                ).join(lot_group, 'LEFT', condition=lot_group.lot == lot.id
+                ).join(group, 'LEFT',
+                    condition=lot_group.animal_group == group.id
+                ).select(
+                    Literal(0), CurrentTimestamp(), move.effective_date,
+                    warehouse.id, location.id,
+                    Coalesce(animal.specie, group.specie), lot.animal_type,
+                    animal.state,
+                    Cast(Sum(move.quantity) * sign, 'INTEGER'),
+                    where=(move.state == 'done')
+                    & (move.effective_date != Null)
+                    & (lot.animal_type != Null) & (lot.animal_type != '')
+                    & ((animal.id != Null) | (group.id != Null)),
+                    group_by=[move.effective_date, warehouse.id,
+                        location.id, Coalesce(animal.specie, group.specie),
+                        lot.animal_type, animal.state])
+            cursor.execute(*table.insert(
+                    columns=[table.create_uid, table.create_date, table.date,
+                        table.farm, table.location, table.specie,
+                        table.animal_type, table.state, table.heads],
+                    values=query))
+
+    @classmethod
+    def get_series(cls, start_date, end_date, grouping=None, farm=None,
+            specie=None, animal_type=None):
+        '''
+        Returns the headcount of each day from start_date to end_date grouped
+        by the census keys of grouping (farm, specie, animal_type and state by
+        default) as a list of dictionaries.
+        '''
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        if grouping is None:
+            grouping = ['farm', 'specie', 'animal_type', 'state']
+        grouping = [g for g in _CENSUS_KEYS if g in grouping]
+        columns = [Column(table, g) for g in grouping]
+        where = table.date <= end_date
+        if farm:
+            where &= table.farm == farm
+        if specie:
+            where &= table.specie == specie
+        if animal_type:
+            where &= table.animal_type == animal_type
+        cursor.execute(*table.select(table.date, *columns, Sum(table.heads),
+                where=where,
+                group_by=[table.date] + columns,
+                order_by=[table.date.asc]))
+
+        heads = defaultdict(int)
+        changes = defaultdict(list)
+        for row in cursor:
+            day, key, value = row[0], tuple(row[1:-1]), row[-1]
+            if day < start_date:
+                heads[key] += value
+            else:
+                changes[day].append((key, value))
+        series = []
+        day = start_date
+        while day <= end_date:
+            for key, value in changes.get(day, []):
+                heads[key] += value
+            for key, value in sorted(heads.items(),
+                    key=lambda x: tuple(str(v) for v in x[0])):
+                if value:
+                    series.append(dict(zip(grouping, key),
+                            date=day, heads=value))
+            day += timedelta(days=1)
+        return series
@@ -3,6 +3,7 @@
 from . import abstract_event
 
 from . import move_event
+from . import feed_abstract_event
 from . import feed_event
 from . import feed_inventory
 from . import medication_event
@@ -19,8 +20,9 @@ from . import reclassification_event
 
 from . import event_order
 
-__all__ = ['abstract_event', 'move_event', 'feed_event', 'feed_inventory',
-    'medication_event', 'transformation_event', 'removal_event',
-    'semen_extraction_event', 'insemination_event',
-    'pregnancy_diagnosis_event', 'abort_event', 'farrowing_event',
-    'foster_event', 'weaning_event', 'reclassification_event', 'event_order']
+__all__ = ['abstract_event', 'move_event', 'feed_abstract_event',
+    'feed_event', 'feed_inventory', 'medication_event',
+    'transformation_event', 'removal_event', 'semen_extraction_event',
+    'insemination_event', 'pregnancy_diagnosis_event', 'abort_event',
+    'farrowing_event', 'foster_event', 'weaning_event',
+    'reclassification_event', 'event_order']
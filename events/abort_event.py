@@ -3,6 +3,7 @@
 from trytond.model import fields, ModelView, ModelSQL, Workflow, Unique
 from trytond.pyson import Equal, Eval, If
 
+from ..archive import ArchiveMixin
 from .abstract_event import AbstractEvent, ImportedEventMixin, \
     _STATES_VALIDATED
 
@@ -40,15 +41,6 @@ class AbortEvent(AbstractEvent, ImportedEventMixin):
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(AbortEvent, self).get_rec_name(name)
-
     @classmethod
     @ModelView.button
     @Workflow.transition('validated')
@@ -73,9 +65,10 @@ class AbortEvent(AbstractEvent, ImportedEventMixin):
         return super(AbortEvent, cls).copy(records, default=default)
 
 
-class AbortEventFemaleCycle(ModelSQL):
+class AbortEventFemaleCycle(ArchiveMixin, ModelSQL):
     "Abort Event - Female Cycle"
     __name__ = 'farm.abort.event-farm.animal.female_cycle'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.abort.event', 'Abort Event', required=True,
         ondelete='RESTRICT')
@@ -1,14 +1,19 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 from datetime import datetime, date
+from sql import Null
 
-from trytond.model import fields, ModelSQL, ModelView, Workflow
+from trytond.model import fields, ModelSQL, ModelView, Workflow, Index
 from trytond.pyson import Equal, Eval, Id, Not
+from trytond.rpc import RPC
 from trytond.transaction import Transaction
 from trytond.pool import Pool
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
+from ..archive import ArchiveMixin
+from ..partition import partition_interval, partition_table
+
 _EVENT_STATES = [
     ('draft', 'Draft'),
     ('validated', 'Validated'),
@@ -31,7 +36,72 @@ _STATES_VALIDATED_ADMIN = {
     }
 
 
-class AbstractEvent(ModelSQL, ModelView, Workflow):
+class KeysetPaginationMixin:
+    """Seek pagination on (timestamp, id) for models with a timestamp, farm
+    and specie"""
+    __slots__ = ()
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.timestamp, Index.Range(order='ASC')),
+                    (t.id, Index.Range(order=cls._keyset_id_order()))),
+                Index(t,
+                    (t.farm, Index.Equality()),
+                    (t.specie, Index.Equality()),
+                    (t.timestamp, Index.Range(order='ASC')),
+                    (t.id, Index.Range(order=cls._keyset_id_order()))),
+                })
+        cls.__rpc__.update({
+                'search_keyset': RPC(),
+                })
+
+    @classmethod
+    def _keyset_id_order(cls):
+        for name, order in cls._order:
+            if name == 'id':
+                return order or 'ASC'
+        return 'ASC'
+
+    @classmethod
+    def search_keyset(cls, domain=None, after=None, limit=None, farm=None,
+            specie=None):
+        """
+        Returns the ids of the records that follow the (timestamp, id) of
+        the last record of the previous page and the cursor of the next page,
+        which is None when there are no more records.
+        """
+        id_order = cls._keyset_id_order()
+        domain = [domain or []]
+        if farm:
+            domain.append(('farm', '=', farm))
+        if specie:
+            domain.append(('specie', '=', specie))
+        if after:
+            timestamp, last_id = after
+            domain.append(['OR',
+                    ('timestamp', '>', timestamp),
+                    [
+                        ('timestamp', '=', timestamp),
+                        ('id', '<' if id_order == 'DESC' else '>', last_id),
+                        ],
+                    ])
+        records = cls.search(domain, limit=limit,
+            order=[('timestamp', 'ASC'), ('id', id_order)])
+        cursor = None
+        if records and limit and len(records) == limit:
+            cursor = [records[-1].timestamp, records[-1].id]
+        return {
+            'ids': [r.id for r in records],
+            'next': cursor,
+            }
+
+
+class AbstractEvent(KeysetPaginationMixin, ArchiveMixin, ModelSQL, ModelView,
+        Workflow):
     'Event'
     __name__ = 'farm.event'
     _order = [
@@ -93,6 +163,11 @@ class AbstractEvent(ModelSQL, ModelView, Workflow):
     notes = fields.Text('Notes')
     state = fields.Selection(_EVENT_STATES, 'State', required=True,
         readonly=True)
+    # Events used by the weekly performance of the groups
+    _performance_event = False
+    # Changes on these fields are replicated in the events journal
+    _journal_fields = {'farm', 'specie', 'animal', 'animal_group',
+        'timestamp', 'state', 'female_cycle'}
 
     @classmethod
     def __setup__(cls):
@@ -114,6 +189,48 @@ class AbstractEvent(ModelSQL, ModelView, Workflow):
                 # ('validated', 'cancelled'),
                 # ('cancelled', 'draft'),
                 ))
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.animal, Index.Equality()),
+                    (t.state, Index.Equality()),
+                    (t.timestamp, Index.Range(order='DESC')),
+                    where=t.animal != Null),
+                Index(t,
+                    (t.animal_group, Index.Equality()),
+                    (t.state, Index.Equality()),
+                    (t.timestamp, Index.Range(order='DESC')),
+                    where=t.animal_group != Null),
+                })
+
+    @classmethod
+    def __register__(cls, module_name):
+        super(AbstractEvent, cls).__register__(module_name)
+        interval = partition_interval()
+        if interval and partition_table(cls._table, 'timestamp', interval,
+                referenced=cls._is_referenced()):
+            # Restore the foreign keys and indexes on the converted table
+            super(AbstractEvent, cls).__register__(module_name)
+
+    @classmethod
+    def _is_referenced(cls):
+        '''
+        Returns if the table is referenced by a Many2One of any model, even
+        if its table is not created yet
+        '''
+        pool = Pool()
+        for _, Model in pool.iterobject():
+            if not issubclass(Model, ModelSQL):
+                continue
+            table_query = getattr(Model, 'table_query', None)
+            if callable(table_query) and table_query():
+                continue
+            for field in Model._fields.values():
+                if (field._type == 'many2one'
+                        and not isinstance(field, fields.Function)
+                        and field.model_name == cls.__name__):
+                    return True
+        return False
 
     @staticmethod
     def default_specie():
@@ -143,11 +260,62 @@ class AbstractEvent(ModelSQL, ModelView, Workflow):
     def default_state():
         return 'draft'
 
-    def get_rec_name(self, name):
-        if self.animal_type == 'group':
-            return "%s %s" % (self.animal_group.rec_name, self.timestamp)
-        else:
-            return "%s %s" % (self.animal.rec_name, self.timestamp)
+    @classmethod
+    def get_rec_name(cls, events, name):
+        animal_names = cls._get_animal_rec_names(events)
+        cycles = {}
+        if 'female_cycle' in cls._fields:
+            cycles = cls._get_cycle_sequences(events)
+        names = {}
+        for event in events:
+            if cycles.get(event.id):
+                names[event.id] = "%s on cycle %s %s" % (
+                    animal_names[event.id], cycles[event.id],
+                    event.timestamp)
+            else:
+                names[event.id] = "%s %s" % (animal_names[event.id],
+                    event.timestamp)
+        return names
+
+    @classmethod
+    def _get_animal_rec_names(cls, events):
+        "Returns the rec_name of the animal or group of each event"
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        AnimalGroup = pool.get('farm.animal.group')
+
+        animals, groups = {}, {}
+        for event in events:
+            if event.animal_type == 'group':
+                if event.animal_group:
+                    groups[event.id] = event.animal_group.id
+            elif event.animal:
+                animals[event.id] = event.animal.id
+        animal_names = Animal.get_rec_name(
+            Animal.browse(list(set(animals.values()))), 'rec_name')
+        group_names = AnimalGroup.get_rec_name(
+            AnimalGroup.browse(list(set(groups.values()))), 'rec_name')
+        names = dict.fromkeys([e.id for e in events], '')
+        names.update((e, animal_names[a]) for e, a in animals.items())
+        names.update((e, group_names[g]) for e, g in groups.items())
+        return names
+
+    @classmethod
+    def _get_cycle_sequences(cls, events):
+        '''
+        Returns the sequence of the cycle of each female event, or of the
+        current cycle of the female if the event has no cycle
+        '''
+        FemaleCycle = Pool().get('farm.animal.female_cycle')
+        cycle_ids = {}
+        for event in events:
+            cycle = event.female_cycle or (
+                event.animal and event.animal.current_cycle)
+            if cycle:
+                cycle_ids[event.id] = cycle.id
+        sequences = {c.id: c.sequence
+            for c in FemaleCycle.browse(list(set(cycle_ids.values())))}
+        return {e: sequences[c] for e, c in cycle_ids.items()}
 
     def get_lot(self, name):
         if self.animal_type == 'group':
@@ -186,6 +354,39 @@ class AbstractEvent(ModelSQL, ModelView, Workflow):
             return
         self.farm = self.animal_group.farms[0]
 
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        Journal = pool.get('farm.animal.cycle.events')
+        Week = pool.get('farm.animal.group.performance.week')
+        events = super(AbstractEvent, cls).create(vlist)
+        Journal.add_events(events)
+        if cls._performance_event:
+            Week.invalidate(events)
+        return events
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        Journal = pool.get('farm.animal.cycle.events')
+        Week = pool.get('farm.animal.group.performance.week')
+        events = []
+        for records in args[::2]:
+            events.extend(records)
+        if cls._performance_event:
+            # The weeks of the previous dates and records change too
+            Week.invalidate(cls.browse(events))
+        super(AbstractEvent, cls).write(*args)
+        actions = iter(args)
+        to_update = []
+        for records, values in zip(actions, actions):
+            if cls._journal_fields & set(values):
+                to_update.extend(e.id for e in records)
+        if to_update:
+            Journal.update_events(cls.browse(list(set(to_update))))
+        if cls._performance_event:
+            Week.invalidate(cls.browse(events))
+
     @classmethod
     def copy(cls, events, default=None):
         if default is None:
@@ -195,10 +396,13 @@ class AbstractEvent(ModelSQL, ModelView, Workflow):
 
     @classmethod
     def delete(cls, events):
+        pool = Pool()
+        Journal = pool.get('farm.animal.cycle.events')
         for event in events:
             if event.state != 'draft':
                 raise UserError(gettext('farm.invalid_state_to_delete',
                     event=event.rec_name))
+        Journal.remove_events(events)
         return super(AbstractEvent, cls).delete(events)
 
     @classmethod
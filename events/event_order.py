@@ -250,19 +250,14 @@ class EventOrder(ModelSQL, ModelView):
         if not specie_id or not farm_id or not animal_type:
             return
 
-        farm_lines = FarmLine.search([
-                ('specie', '=', specie_id),
-                ('farm', '=', farm_id),
-                ('has_' + animal_type, '=', True),
-                ])
-        if not farm_lines:
+        farm_line = FarmLine.get_farm_line(specie_id, farm_id, animal_type)
+        if not farm_line:
             raise UserError(gettext('farm.no_farm_specie_farm_line_available',
                     farm=Location(farm_id).rec_name,
                     animal_type=animal_type,
                     specie=Specie(specie_id).rec_name,
                     ))
-        farm_line, = farm_lines
-        return farm_line.event_order_sequence.get()
+        return farm_line.get_numbers('event_order_sequence')[0]
 
     @classmethod
     @ModelView.button
@@ -1,5 +1,7 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from collections import defaultdict
+
 from trytond.model import fields, ModelView, ModelSQL, Workflow, Check, Unique
 from trytond.pyson import And, Bool, Equal, Eval, Id, If, Not, Or
 from trytond.pool import Pool
@@ -7,6 +9,7 @@ from trytond.transaction import Transaction
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
+from ..archive import ArchiveMixin
 from .abstract_event import AbstractEvent, ImportedEventMixin, \
     _STATES_WRITE_DRAFT, _STATES_VALIDATED
 
@@ -123,15 +126,6 @@ class FarrowingEvent(AbstractEvent, ImportedEventMixin, ModelSQL, ModelView, Wor
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(FarrowingEvent, self).get_rec_name(name)
-
     @fields.depends('stillborn', 'mummified')
     def on_change_with_dead(self, name=None):
         return (self.stillborn or 0) + (self.mummified or 0)
@@ -154,33 +148,21 @@ class FarrowingEvent(AbstractEvent, ImportedEventMixin, ModelSQL, ModelView, Wor
     @ModelView.button
     @Workflow.transition('validated')
     def validate_event(cls, events):
-        pool = Pool()
-        Move = pool.get('stock.move')
-        EventAnimal = pool.get('farm.farrowing.event-farm.animal')
-        todo_moves = []
+        Move = Pool().get('stock.move')
         for farrowing_event in events:
             if not farrowing_event.dead and not farrowing_event.live:
                 raise UserError(gettext('farm.event_without_dead_nor_live',
                     event=farrowing_event.rec_name))
+
+        todo_moves = cls._create_produced_animals([e for e in events
+                if e.live and e.produced_animal_type == 'individual'])
+        for farrowing_event in events:
             current_cycle = farrowing_event.animal.current_cycle
             farrowing_event.female_cycle = current_cycle
 
             if farrowing_event.live != 0:
                 with Transaction().set_context(no_create_stock_move=True):
-                    if farrowing_event.produced_animal_type == 'individual':
-                        for i in range(farrowing_event.live):
-                            produced_animal = farrowing_event._get_produced_animal()
-                            produced_animal.save()
-                            move = farrowing_event._get_event_move(
-                                produced_animal)
-                            move.save()
-                            todo_moves.append(move)
-                            eventAnimal = EventAnimal()
-                            eventAnimal.animal = produced_animal
-                            eventAnimal.event = farrowing_event
-                            eventAnimal.move = move
-                            eventAnimal.save()
-                    else:
+                    if farrowing_event.produced_animal_type != 'individual':
                         produced_group = farrowing_event._get_produced_group()
                         produced_group.save()
                         farrowing_event.produced_group = produced_group
@@ -194,6 +176,46 @@ class FarrowingEvent(AbstractEvent, ImportedEventMixin, ModelSQL, ModelView, Wor
         Move.assign(todo_moves)
         Move.do(todo_moves)
 
+    @classmethod
+    def _create_produced_animals(cls, events):
+        '''
+        Create the individuals produced in the farrowing events with their
+        lots, stock moves and links to the events. The numbers are reserved
+        at once for every farm and each kind of record is created with a
+        single call.
+
+        Returns the list of stock moves to be done.
+        '''
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        Move = pool.get('stock.move')
+        EventAnimal = pool.get('farm.farrowing.event-farm.animal')
+
+        produced = []
+        to_number = defaultdict(list)
+        for farrowing_event in events:
+            farm = farrowing_event.animal.location.warehouse
+            for _ in range(farrowing_event.live):
+                produced_animal = farrowing_event._get_produced_animal()
+                produced.append((farrowing_event, produced_animal))
+                to_number[(farrowing_event.specie.id, farm.id)].append(
+                    produced_animal)
+        if not produced:
+            return []
+        for (specie_id, farm_id), animals in to_number.items():
+            numbers = Animal._calc_numbers(specie_id, farm_id, 'individual',
+                len(animals))
+            for produced_animal, number in zip(animals, numbers):
+                produced_animal.number = number
+
+        with Transaction().set_context(no_create_stock_move=True):
+            Animal.save([a for _, a in produced])
+        moves = [e._get_event_move(a) for e, a in produced]
+        Move.save(moves)
+        EventAnimal.save([EventAnimal(event=e, animal=a, move=m)
+                for (e, a), m in zip(produced, moves)])
+        return moves
+
     def _get_produced_animal(self):
         """
         Prepare values to create the produced animal in female's farrowing
@@ -263,9 +285,10 @@ class FarrowingEvent(AbstractEvent, ImportedEventMixin, ModelSQL, ModelView, Wor
         return super(FarrowingEvent, cls).copy(records, default=default)
 
 
-class FarrowingEventFemaleCycle(ModelSQL):
+class FarrowingEventFemaleCycle(ArchiveMixin, ModelSQL):
     "Farrowing Event - Female Cycle"
     __name__ = 'farm.farrowing.event-farm.animal.female_cycle'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.farrowing.event', 'Farrowing Event',
         required=True, ondelete='RESTRICT')
@@ -284,9 +307,10 @@ class FarrowingEventFemaleCycle(ModelSQL):
             ]
 
 
-class FarrowingEventAnimalGroup(ModelSQL):
+class FarrowingEventAnimalGroup(ArchiveMixin, ModelSQL):
     "Farrowing Event - AnimalGroup"
     __name__ = 'farm.farrowing.event-farm.animal.group'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.farrowing.event', 'Farrowing Event',
         required=True, ondelete='RESTRICT')
@@ -305,9 +329,10 @@ class FarrowingEventAnimalGroup(ModelSQL):
             ]
 
 
-class FarmFarrowingEventAnimal(ModelSQL, ModelView):
+class FarmFarrowingEventAnimal(ArchiveMixin, ModelSQL, ModelView):
     'Farrowing Event - Animal'
     __name__ = 'farm.farrowing.event-farm.animal'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.farrowing.event', 'Farrowing Event',
         required=True, ondelete='RESTRICT')
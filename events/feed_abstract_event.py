@@ -1,14 +1,16 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from collections import defaultdict
 from datetime import datetime, date
 
-from trytond.model import fields, ModelView, Workflow, Check
+from trytond.model import fields, ModelSQL, ModelView, Workflow, Check, Index
 from trytond.pyson import Bool, Equal, Eval, Not, If, Or
 from trytond.pool import Pool
 from trytond.transaction import Transaction
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
+from ..archive import ArchiveMixin
 from .abstract_event import AbstractEvent, _STATES_WRITE_DRAFT, \
     _STATES_WRITE_DRAFT_VALIDATED, _STATES_VALIDATED_ADMIN
 
@@ -112,12 +114,21 @@ class FeedEventMixin(AbstractEvent):
     def valid_animal_types():
         return ['male', 'female', 'individual', 'group']
 
-    def get_rec_name(self, name):
-        animal_name = (self.animal.rec_name if self.animal
-            else self.animal_group.rec_name)
-        return "%s %s to %s in %s at %s" % (self.feed_quantity,
-            self.uom.symbol, animal_name,
-            self.location.rec_name, self.timestamp)
+    @classmethod
+    def get_rec_name(cls, events, name):
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Uom = pool.get('product.uom')
+
+        animal_names = cls._get_animal_rec_names(events)
+        symbols = {u.id: u.symbol
+            for u in Uom.browse(list({e.uom.id for e in events}))}
+        location_names = {l.id: l.rec_name
+            for l in Location.browse(list({e.location.id for e in events}))}
+        return {e.id: "%s %s to %s in %s at %s" % (e.feed_quantity,
+                symbols[e.uom.id], animal_names[e.id],
+                location_names[e.location.id], e.timestamp)
+            for e in events}
 
     def on_change_animal(self):
         super(FeedEventMixin, self).on_change_animal()
@@ -162,11 +173,14 @@ class FeedEventMixin(AbstractEvent):
     @Workflow.transition('validated')
     def validate_event(cls, events, check_feed_available=True):
         """
-        Create an stock move
+        Create an stock move, or add the event to an aggregated move if the
+        specie aggregates the feed moves
         """
         pool = Pool()
         Move = pool.get('stock.move')
+        Allocation = pool.get('farm.feed.move.allocation')
         todo_moves = []
+        to_aggregate = defaultdict(list)
         for feed_event in events:
             assert not feed_event.move, ('%s "%s" already has a related stock '
                 'move: "%s"' % (type(feed_event), feed_event.id,
@@ -176,6 +190,11 @@ class FeedEventMixin(AbstractEvent):
             if check_feed_available:
                 feed_event.check_feed_available()
 
+            key = feed_event._get_aggregation_key()
+            if key:
+                to_aggregate[key].append(feed_event)
+                continue
+
             new_move = feed_event._get_event_move()
             new_move.save()
             todo_moves.append(new_move)
@@ -183,9 +202,60 @@ class FeedEventMixin(AbstractEvent):
             feed_event.move = new_move
             feed_event._validated_hook()
             feed_event.save()
+
+        if to_aggregate:
+            groups = list(to_aggregate.values())
+            moves = [cls._get_aggregated_move(g) for g in groups]
+            Move.save(moves)
+            todo_moves.extend(moves)
+            allocations, aggregated = [], []
+            for group, move in zip(groups, moves):
+                for feed_event in group:
+                    feed_event.move = move
+                    feed_event._validated_hook()
+                    allocations.append(Allocation(move=move,
+                            event=feed_event,
+                            quantity=float(feed_event.feed_quantity)))
+                    aggregated.append(feed_event)
+            cls.save(aggregated)
+            Allocation.save(allocations)
         Move.assign(todo_moves)
         Move.do(todo_moves)
 
+    def _get_aggregation_key(self):
+        """
+        Returns the key of the aggregated move of the event or None if the
+        specie does not aggregate the feed moves
+        """
+        mode = self.specie.feed_move_aggregation
+        if not mode or not self.feed_product:
+            return
+        key = (self.farm.id, self.feed_location.id, self.feed_product.id,
+            self.feed_lot.id if self.feed_lot else None, self.uom.id)
+        inventory = getattr(self, 'feed_inventory', None)
+        if mode == 'inventory' and inventory:
+            return key + (str(inventory),)
+        return key + (self.timestamp.date(),)
+
+    @classmethod
+    def _get_aggregated_move(cls, events):
+        '''
+        Returns the stock move of the consumption of all the events. Its
+        origin is the feed inventory of the events if they share one or the
+        first event.
+        '''
+        Move = Pool().get('stock.move')
+        move = events[0]._get_event_move()
+        move.quantity = sum(float(e.feed_quantity) for e in events)
+        move.planned_date = move.effective_date = max(
+            e.timestamp.date() for e in events)
+        inventories = {getattr(e, 'feed_inventory', None) for e in events}
+        if len(inventories) == 1:
+            inventory, = inventories
+            if inventory and inventory.__name__ in Move._get_origin():
+                move.origin = inventory
+        return move
+
     def check_animals_available(self):
         if self.animal_type != 'group':
             if not self.animal.check_in_location(self.location,
@@ -283,6 +353,36 @@ class FeedEventMixin(AbstractEvent):
     def _validated_hook(self):
         pass
 
+    @classmethod
+    def delete(cls, events):
+        pool = Pool()
+        Allocation = pool.get('farm.feed.move.allocation')
+        Move = pool.get('stock.move')
+        allocations = Allocation.search([
+                ('event', 'in', [str(e) for e in events]),
+                ])
+        if allocations:
+            deleted = set(events)
+            moves = [m for m in {a.move for a in allocations}
+                if m.origin in deleted]
+            Allocation.delete(allocations)
+            # The aggregated moves originated by a deleted event take the
+            # next event allocated
+            origins = {}
+            for allocation in Allocation.search([
+                        ('move', 'in', [m.id for m in moves]),
+                        ], order=[('id', 'ASC')]):
+                origins.setdefault(allocation.move.id, allocation.event)
+            to_write = []
+            for move in moves:
+                origin = origins.get(move.id)
+                to_write.extend(([move], {
+                            'origin': str(origin) if origin else None,
+                            }))
+            if to_write:
+                Move.write(*to_write)
+        super(FeedEventMixin, cls).delete(events)
+
     @classmethod
     def copy(cls, records, default=None):
         if default is None:
@@ -291,3 +391,28 @@ class FeedEventMixin(AbstractEvent):
             default = default.copy()
         default['move'] = None
         return super(FeedEventMixin, cls).copy(records, default=default)
+
+
+class FeedMoveAllocation(ArchiveMixin, ModelSQL, ModelView):
+    'Feed Move Allocation'
+    __name__ = 'farm.feed.move.allocation'
+    _archive_parent = 'event'
+
+    move = fields.Many2One('stock.move', 'Stock Move', required=True,
+        readonly=True, ondelete='CASCADE')
+    event = fields.Reference('Event', selection=[
+            ('farm.feed.event', 'Feed Event'),
+            ('farm.medication.event', 'Medication Event'),
+            ], required=True, readonly=True)
+    quantity = fields.Float('Quantity', digits=(16, 4), required=True,
+        readonly=True, help='The quantity of the move consumed by the event, '
+        'in the unit of the move.')
+
+    @classmethod
+    def __setup__(cls):
+        super(FeedMoveAllocation, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.move, Index.Equality())),
+                Index(t, (t.event, Index.Equality())),
+                })
@@ -2,7 +2,7 @@
 # copyright notices and license terms.
 from decimal import Decimal
 
-from trytond.model import fields, ModelSQL, ModelView, Workflow, Check
+from trytond.model import fields, ModelSQL, ModelView, Workflow, Check, Index
 from trytond.pool import Pool
 from trytond.pyson import Eval, Id
 
@@ -13,6 +13,7 @@ class FeedEvent(FeedEventMixin, ModelSQL, ModelView, Workflow):
     'Feed Event'
     __name__ = 'farm.feed.event'
     _table = 'farm_feed_event'
+    _performance_event = True
 
     feed_quantity_animal_day = fields.Numeric('Qty. per Animal-Day',
         digits=(16, 4), readonly=True,
@@ -50,6 +51,11 @@ class FeedEvent(FeedEventMixin, ModelSQL, ModelView, Workflow):
         cls.feed_location.depends.add('location')
 
         t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.animal_type, Index.Equality()),
+                (t.state, Index.Equality()),
+                (t.timestamp, Index.Range())))
         cls._sql_constraints += [
             ('quantity_positive', Check(t, t.quantity != 0),
                 'farm.check_feed_quantity_non_zero'),
@@ -67,11 +73,9 @@ class FeedEvent(FeedEventMixin, ModelSQL, ModelView, Workflow):
     @classmethod
     def get_inventory(cls):
         IrModel = Pool().get('ir.model')
-        models = IrModel.search([
-                ('name', 'in', ['farm.feed.inventory',
-                        'farm.feed.provisional_inventory']),
-                ])
-        return [('', '')] + [(m.name, m.string) for m in models]
+        return [('', '')] + [(m, IrModel.get_name(m))
+            for m in ['farm.feed.inventory',
+                'farm.feed.provisional_inventory']]
 
     @fields.depends('feed_location')
     def on_change_feed_location(self):
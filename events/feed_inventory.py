@@ -8,7 +8,7 @@ from sql.aggregate import Avg, Count, Max, Sum
 from sql.conditionals import Coalesce
 from sql.functions import Extract, Now
 
-from trytond.model import fields, ModelSQL, ModelView, Workflow
+from trytond.model import fields, ModelSQL, ModelView, Workflow, Index
 from trytond.pyson import Equal, Eval, Id, Not
 from trytond.pool import Pool
 from trytond.transaction import Transaction
@@ -516,14 +516,19 @@ class FeedInventoryLocation(ModelSQL):
         required=True)
     location = fields.Many2One('stock.location', 'Location', required=True)
 
+    @classmethod
+    def __setup__(cls):
+        super(FeedInventoryLocation, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t, (t.inventory, Index.Equality())))
+
     @classmethod
     def get_inventory(cls):
         IrModel = Pool().get('ir.model')
-        models = IrModel.search([
-                ('name', 'in', ['farm.feed.inventory',
-                        'farm.feed.provisional_inventory']),
-                ])
-        return [(m.name, m.string) for m in models]
+        return [(m, IrModel.get_name(m))
+            for m in ['farm.feed.inventory',
+                'farm.feed.provisional_inventory']]
 
 
 class FeedInventory(FeedInventoryMixin, ModelSQL, ModelView, Workflow):
@@ -570,6 +575,7 @@ class FeedInventory(FeedInventoryMixin, ModelSQL, ModelView, Workflow):
         FeedEvent = pool.get('farm.feed.event')
         ProvisionalInventory = pool.get('farm.feed.provisional_inventory')
 
+        periods = []
         for inventory in inventories:
             assert not inventory.feed_events, ('Feed Inventory "%s" already '
                 'has related feed events.' % inventory.rec_name)
@@ -638,10 +644,19 @@ class FeedInventory(FeedInventoryMixin, ModelSQL, ModelView, Workflow):
 
             inventory.prev_inventory = prev_inventory.id
             inventory.save()
+            periods.append((start_date, inventory.timestamp.date()))
 
-        # Validate the created Feed Events
+        # Validate the created Feed Events, which are in the periods of the
+        # inventories so only their partitions are scanned
+        if not periods:
+            return
         inventories_events = FeedEvent.search([
                 ('feed_inventory', 'in', [str(i) for i in inventories]),
+                ('timestamp', '>=', datetime.combine(
+                        min(p[0] for p in periods), time.min)),
+                ('timestamp', '<', datetime.combine(
+                        max(p[1] for p in periods) + timedelta(days=1),
+                        time.min)),
                 ])
         # The specific lot consumption is an aproximation. It could calculate
         # that a lot is consumed a bit before it is available in silo
@@ -995,6 +1010,7 @@ class FeedAnimalLocationDate(ModelSQL, ModelView):
             Max(feed_event_tmp.create_date).as_('create_date'),
             Max(feed_event_tmp.write_uid).as_('write_uid'),
             Max(feed_event_tmp.write_date).as_('write_date'),
+            where=feed_event_tmp.timestamp >= Cast(Now(), Date) - n_days,
             group_by=(feed_event_tmp.animal_type, feed_event_tmp.animal,
                 feed_event_tmp.animal_group))
 
@@ -1018,7 +1034,8 @@ class FeedAnimalLocationDate(ModelSQL, ModelView):
             feed_event.feed_quantity_animal_day,
             (feed_event.feed_quantity_animal_day *
                 feed_event.quantity).as_('daily_consumed_qty'),
-            feed_event.feed_inventory)
+            feed_event.feed_inventory,
+            where=feed_event.timestamp >= Cast(Now(), Date) - n_days)
 
         query = animals.join(days_q, condition=Literal(True)).join(
             feed_event,
@@ -76,15 +76,6 @@ class FosterEvent(AbstractEvent, ImportedEventMixin):
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(FosterEvent, self).get_rec_name(name)
-
     def get_farrowing_group(self, name):
         '''
         Return the farm.animal.group produced on Farrowing Event of this event
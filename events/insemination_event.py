@@ -67,15 +67,6 @@ class InseminationEvent(AbstractEvent, ImportedEventMixin):
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(InseminationEvent, self).get_rec_name(name)
-
     @fields.depends('animal_type', 'animal')
     def on_change_animal(self):
         if not self.animal:
@@ -1,16 +1,20 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from datetime import datetime
+
 from trytond.model import fields, ModelView, Workflow, Check
-from trytond.pyson import Bool, Equal, Eval, Id, If, Not, Or
+from trytond.pyson import Bool, Equal, Eval, Id, If, Not, Or, PYSONEncoder
 from trytond.pool import Pool
+from trytond.rpc import RPC
 from trytond.transaction import Transaction
+from trytond.wizard import Wizard, StateView, StateAction, Button
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
 from .abstract_event import AbstractEvent, _STATES_WRITE_DRAFT, \
     _STATES_VALIDATED_ADMIN
 
-__all__ = ['MoveEvent']
+__all__ = ['MoveEvent', 'MoveLocationContentsStart', 'MoveLocationContents']
 
 
 class MoveEvent(AbstractEvent):
@@ -109,6 +113,10 @@ class MoveEvent(AbstractEvent):
             ('weight_0_or_positive', Check(t, t.weight >= 0.0),
                 'farm.check_move_weight_positive'),
             ]
+        cls.__rpc__.update({
+                'move_location_contents': RPC(readonly=False,
+                    result=lambda r: list(map(int, r))),
+                })
 
     @staticmethod
     def default_quantity():
@@ -229,6 +237,144 @@ class MoveEvent(AbstractEvent):
         if to_validate:
             cls.validate_event(to_validate)
 
+    @classmethod
+    def move_location_contents(cls, specie, from_location, to_location,
+            timestamp, create_shipment=False):
+        """
+        Move all the animals and groups of the specie that are in
+        from_location at timestamp to to_location.
+
+        The contents of the location are computed with a single stock query
+        and the events, their stock moves and weight records are created in
+        bulk. Lactating females and their farrowing groups are moved in the
+        same operation because both are in the location. If create_shipment
+        is set and the destination is in another farm, the stock moves are
+        grouped in an internal shipment.
+
+        Returns the list of validated move events.
+        """
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+
+        specie_id = int(specie)
+        from_location = Location(int(from_location))
+        to_location = Location(int(to_location))
+        if not from_location.warehouse:
+            raise UserError(gettext('farm.location_without_warehouse',
+                    location=from_location.rec_name))
+
+        with Transaction().set_context(stock_date_end=timestamp.date()):
+            quantities = Lot.quantity_by_location(None, [from_location.id],
+                quantity_domain=('quantity', '>', 0.0))
+        lots = Lot.browse([l for l in quantities
+                if quantities[l].get(from_location.id, 0.0) > 0.0])
+
+        vlist = []
+        for lot in lots:
+            if lot.animal_type == 'group':
+                record = lot.animal_group
+            elif lot.animal_type:
+                record = lot.animal
+            else:
+                continue
+            if not record or record.specie.id != specie_id:
+                continue
+            vlist.append({
+                    'animal_type': lot.animal_type,
+                    'specie': specie_id,
+                    'farm': from_location.warehouse.id,
+                    'animal': (record.id if lot.animal_type != 'group'
+                        else None),
+                    'animal_group': (record.id if lot.animal_type == 'group'
+                        else None),
+                    'timestamp': timestamp,
+                    'from_location': from_location.id,
+                    'to_location': to_location.id,
+                    'quantity': int(quantities[lot.id][from_location.id]),
+                    'unit_price': lot.product.cost_price,
+                    })
+        if not vlist:
+            raise UserError(gettext('farm.location_without_animals',
+                    location=from_location.rec_name,
+                    timestamp=timestamp))
+        events = cls.create(vlist)
+        cls.validate_location_contents(events,
+            create_shipment=create_shipment)
+        return events
+
+    @classmethod
+    @Workflow.transition('validated')
+    def validate_location_contents(cls, events, create_shipment=False):
+        """
+        Validate move events whose animals and groups are known to be in
+        their origin location, creating all the stock moves and weight records
+        at once.
+        """
+        pool = Pool()
+        Move = pool.get('stock.move')
+        Shipment = pool.get('stock.shipment.internal')
+        AnimalWeight = pool.get('farm.animal.weight')
+        AnimalGroupWeight = pool.get('farm.animal.group.weight')
+
+        for move_event in events:
+            assert not move_event.move, ('Move Event "%s" already has a '
+                'related stock move: "%s"' % (move_event.id,
+                    move_event.move.id))
+            record = (move_event.animal_group
+                if move_event.animal_type == 'group' else move_event.animal)
+            record.check_allowed_location(move_event.to_location,
+                move_event.rec_name)
+
+        moves = [e._get_event_move() for e in events]
+        Move.save(moves)
+        weights = {
+            'farm.animal.weight': [],
+            'farm.animal.group.weight': [],
+            }
+        for move_event, move in zip(events, moves):
+            move_event.move = move
+            if move_event.weight:
+                weight_record = move_event._get_weight_record()
+                weights[weight_record.__name__].append(weight_record)
+                move_event.weight_record = weight_record
+        AnimalWeight.save(weights['farm.animal.weight'])
+        AnimalGroupWeight.save(weights['farm.animal.group.weight'])
+        cls.save(events)
+
+        shipments = []
+        if create_shipment:
+            by_locations = {}
+            for move_event, move in zip(events, moves):
+                if (move_event.from_location.warehouse
+                        == move_event.to_location.warehouse):
+                    continue
+                key = (move_event.from_location, move_event.to_location,
+                    move.effective_date)
+                by_locations.setdefault(key, []).append(move)
+            for (from_location, to_location, date), shipment_moves in (
+                    by_locations.items()):
+                shipments.append(Shipment(
+                        company=shipment_moves[0].company,
+                        from_location=from_location,
+                        to_location=to_location,
+                        planned_date=date,
+                        effective_date=date,
+                        moves=shipment_moves,
+                        ))
+            Shipment.save(shipments)
+        shipped_moves = set(m for s in shipments for m in s.moves)
+        todo_moves = [m for m in moves if m not in shipped_moves]
+        Move.assign(todo_moves)
+        Move.do(todo_moves)
+        if shipments:
+            Shipment.wait(shipments)
+            Shipment.assign_force(shipments)
+            to_ship = [s for s in shipments if s.transit_location]
+            if to_ship:
+                Shipment.ship(to_ship)
+            Shipment.do(shipments)
+
     def _get_event_move(self):
         pool = Pool()
         Move = pool.get('stock.move')
@@ -284,3 +430,68 @@ class MoveEvent(AbstractEvent):
         default.setdefault('move', None)
         default.setdefault('weight_record', None)
         return super(MoveEvent, cls).copy(records, default=default)
+
+
+class MoveLocationContentsStart(ModelView):
+    'Move Location Contents Start'
+    __name__ = 'farm.move.location_contents.start'
+
+    specie = fields.Many2One('farm.specie', 'Specie', required=True,
+        readonly=True)
+    from_location = fields.Many2One('stock.location', 'Origin',
+        required=True, domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ],
+        context={
+            'restrict_by_specie_animal_type': True,
+            })
+    to_location = fields.Many2One('stock.location', 'Destination',
+        required=True, domain=[
+            ('type', 'in', ['storage', 'customer']),
+            ('silo', '=', False),
+            ('id', '!=', Eval('from_location', -1)),
+            ],
+        context={
+            'restrict_by_specie_animal_type': True,
+            })
+    timestamp = fields.DateTime('Date & Time', required=True)
+    create_shipment = fields.Boolean('Create Internal Shipment',
+        help='If the destination is in another farm, the stock moves are '
+        'grouped in an internal shipment.')
+
+    @staticmethod
+    def default_specie():
+        context = Transaction().context
+        if context.get('active_model') == 'ir.ui.menu':
+            pool = Pool()
+            Menu = pool.get('ir.ui.menu')
+            return Menu(context.get('active_id')).specie.id
+        return context.get('specie')
+
+    @staticmethod
+    def default_timestamp():
+        return datetime.now()
+
+
+class MoveLocationContents(Wizard):
+    'Move Location Contents'
+    __name__ = 'farm.move.location_contents'
+
+    start = StateView('farm.move.location_contents.start',
+        'farm.farm_move_location_contents_start_view', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Move', 'move', 'tryton-ok', default=True),
+            ])
+    move = StateAction('farm.act_farm_move_event')
+
+    def do_move(self, action):
+        MoveEvent = Pool().get('farm.move.event')
+        events = MoveEvent.move_location_contents(self.start.specie,
+            self.start.from_location, self.start.to_location,
+            self.start.timestamp,
+            create_shipment=self.start.create_shipment)
+        action['pyson_domain'] = PYSONEncoder().encode([
+                ('id', 'in', [e.id for e in events]),
+                ])
+        return action, {}
@@ -48,15 +48,6 @@ class PregnancyDiagnosisEvent(AbstractEvent):
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(PregnancyDiagnosisEvent, self).get_rec_name(name)
-
     @classmethod
     @ModelView.button
     @Workflow.transition('validated')
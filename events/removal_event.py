@@ -31,6 +31,7 @@ class RemovalEvent(AbstractEvent):
     '''Farm Removal Event'''
     __name__ = 'farm.removal.event'
     _table = 'farm_removal_event'
+    _performance_event = True
 
     from_location = fields.Many2One('stock.location', 'Origin',
         required=True, domain=[
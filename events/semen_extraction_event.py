@@ -392,13 +392,16 @@ class SemenExtractionEvent(AbstractEvent):
         FarmLine = pool.get('farm.specie.farm_line')
         Lot = pool.get('stock.lot')
 
-        farm_line, = FarmLine.search([
-                ('specie', '=', self.specie.id),
-                ('farm', '=', self.farm.id),
-                ('has_male', '=', True),
-                ])
+        farm_line = FarmLine.get_farm_line(self.specie.id, self.farm.id,
+            'male')
+        if not farm_line:
+            raise UserError(gettext('farm.no_farm_specie_farm_line_available',
+                    farm=self.farm.rec_name,
+                    animal_type='male',
+                    specie=self.specie.rec_name,
+                    ))
         return Lot(
-            number=farm_line.semen_lot_sequence.get(),
+            number=farm_line.get_numbers('semen_lot_sequence')[0],
             product=self.specie.semen_product.id)
 
     @classmethod
@@ -418,16 +421,15 @@ class SemenExtractionEvent(AbstractEvent):
                 specie = Specie(specie_id)
                 semen_prod_ref = 'product.product,%d' % specie.semen_product.id
                 # Configure the test in specie?
-                templates = QualityTemplate.search([
-                        ('document', '=', semen_prod_ref),
-                        ])
-                if not templates:
+                template = QualityTemplate.get_document_template(
+                    semen_prod_ref)
+                if not template:
                     raise UserError(gettext(
                             'farm.missing_quality_template_for_semen',
                             product=specie.semen_product.rec_name))
                 test = QualityTest(
                     test_date=values.get('timestamp') or datetime.today(),
-                    templates=[templates[0]],
+                    templates=[template],
                     document=semen_prod_ref,
                     )
                 test.save()
@@ -653,18 +655,21 @@ class SemenExtractionDose(ModelSQL, ModelView):
         FarmLine = pool.get('farm.specie.farm_line')
         Lot = pool.get('stock.lot')
 
-        farm_line, = FarmLine.search([
-                ('specie', '=', self.event.specie.id),
-                ('farm', '=', self.event.farm.id),
-                ('has_male', '=', True),
-                ])
+        farm_line = FarmLine.get_farm_line(self.event.specie.id,
+            self.event.farm.id, 'male')
+        if not farm_line:
+            raise UserError(gettext('farm.no_farm_specie_farm_line_available',
+                    farm=self.event.farm.rec_name,
+                    animal_type='male',
+                    specie=self.event.specie.rec_name,
+                    ))
 
         number = []
         number.append(self.event.animal.breed.rec_name)
         number.append(self.event.animal.rec_name)
         if self.event.reference:
             number.append(self.event.reference)
-        number.append(farm_line.dose_lot_sequence.get())
+        number.append(farm_line.get_numbers('dose_lot_sequence')[0])
         number = '/'.join(number)
         return Lot(number=number, product=self.dose_product.id,
             expiration_date=(self.event.timestamp +
@@ -9,17 +9,23 @@ No possibility of creating individuals from here. Maybe in the future we
 - Farrowing creates groups and weaning is for groups (current implementation)
 - Farrowing creates groups and weaning is for individuals
 """
+from datetime import datetime
+
 from trytond.model import fields, ModelView, ModelSQL, Workflow, Unique
-from trytond.pyson import Eval, Id, If, Equal, Or
+from trytond.pyson import Eval, Id, If, Equal, Or, PYSONEncoder
 from trytond.pool import Pool
+from trytond.rpc import RPC
 from trytond.transaction import Transaction
+from trytond.wizard import Wizard, StateView, StateAction, Button
 from trytond.exceptions import UserError
 from trytond.i18n import gettext
 
+from ..archive import ArchiveMixin
 from .abstract_event import AbstractEvent, ImportedEventMixin, \
     _STATES_WRITE_DRAFT, _STATES_VALIDATED
 
-__all__ = ['WeaningEvent', 'WeaningEventFemaleCycle']
+__all__ = ['WeaningEvent', 'WeaningEventFemaleCycle', 'WeanLocationStart',
+    'WeanLocation']
 
 _INVISIBLE_NOT_GROUP = {
     'invisible': ~Equal(Eval('produced_animal_type'), 'group')
@@ -148,6 +154,10 @@ class WeaningEvent(AbstractEvent, ImportedEventMixin):
             cls.animal.depends.add('imported')
         # TODO: not added constraint for non negative quantity but negative
         # quantities are not suported
+        cls.__rpc__.update({
+                'wean_location': RPC(readonly=False,
+                    result=lambda r: list(map(int, r))),
+                })
 
     @staticmethod
     def default_animal_type():
@@ -161,15 +171,6 @@ class WeaningEvent(AbstractEvent, ImportedEventMixin):
     def valid_animal_types():
         return ['female']
 
-    def get_rec_name(self, name):
-        cycle = (self.female_cycle and self.female_cycle.sequence or
-            self.animal.current_cycle and self.animal.current_cycle.sequence
-            or None)
-        if cycle:
-            return "%s on cycle %s %s" % (self.animal.rec_name, cycle,
-                self.timestamp)
-        return super(WeaningEvent, self).get_rec_name(name)
-
     @fields.depends('specie')
     def on_change_with_produced_animal_type(self, name=None):
         if self.specie and self.specie.produced_animal_type:
@@ -269,95 +270,166 @@ class WeaningEvent(AbstractEvent, ImportedEventMixin):
         AnimalMove = pool.get('farm.weaning.event-farm.animal')
         todo_moves = []
         todo_trans_events = []
+        todo_animal_moves = []
         for weaning_event in events:
-            assert (not weaning_event.female_move and
-                not weaning_event.weaned_move), ('Weaning Event %s already '
-                'has related stock moves when it is to validate.'
-                % weaning_event.id)
-
-            current_cycle = weaning_event.animal.current_cycle
-            weaning_event.female_cycle = current_cycle
-            maximum = (current_cycle.live + current_cycle.fostered +
-                weaning_event.last_minute_fostered)
-            if weaning_event.quantity > maximum:
-                raise UserError(gettext('farm.incorrect_quantity',
-                        quantity=maximum))
-
-            if (weaning_event.female_to_location and
-                    weaning_event.female_to_location !=
-                    weaning_event.animal.location):
-                weaning_event.animal.check_allowed_location(
-                    weaning_event.female_to_location, weaning_event.rec_name)
-
-                female_move = weaning_event._get_female_move()
-                female_move.save()
-                weaning_event.female_move = female_move
-                todo_moves.append(female_move)
-
-            if weaning_event.casualties != 0:
-                lost_move = weaning_event._get_lost_move(
-                    weaning_event.casualties)
-                lost_move.save()
-                weaning_event.lost_move = lost_move
-                todo_moves.append(lost_move)
-
-            if weaning_event.last_minute_fostered !=0:
-                last_minute_fostered_move = (
-                    weaning_event._get_last_minute_fostered_move(
-                        weaning_event.last_minute_fostered))
-                last_minute_fostered_move.save()
-                todo_moves.append(last_minute_fostered_move)
-
-            if weaning_event.produced_animal_type == 'individual':
-                to_save = []
-
-                for animal in weaning_event.farrowing_animals:
-                    animalMove = AnimalMove()
-                    animalMove.event = weaning_event
-                    animalMove.animal = animal
-                    to_save.append(animalMove)
-                AnimalMove.save(to_save)
-
-            if (weaning_event.quantity and weaning_event.weaned_group and
-                    weaning_event.weaned_group !=
-                    weaning_event.farrowing_group):
-                transformation_event = (
-                    weaning_event._get_transformation_event())
-                transformation_event.save()
-                weaning_event.transformation_event = transformation_event
+            moves, transformation_event, animal_moves = (
+                weaning_event._get_validation_records())
+            todo_moves.extend(moves)
+            if transformation_event:
                 todo_trans_events.append(transformation_event)
-            elif (weaning_event.quantity and weaning_event.animal.location !=
-                    weaning_event.weaned_to_location):
-                # same group but different locations
-                if weaning_event.produced_animal_type == 'individual':
-                    for animalMove in weaning_event.weaned_animals:
-                        animal = animalMove.animal
-                        animal.check_allowed_location(
-                            weaning_event.weaned_to_location,
-                            weaning_event.rec_name)
-                        move = weaning_event._get_weaned_move(animal)
-                        move.save()
-                        animalMove.move = move
-                        animalMove.save()
-                        todo_moves.append(move)
-                else:
-                    weaning_event.farrowing_group.check_allowed_location(
-                        weaning_event.weaned_to_location,
-                        weaning_event.rec_name)
-                    weaned_move = weaning_event._get_weaned_move()
-                    weaned_move.save()
-
-                    weaning_event.weaned_move = weaned_move
-                    todo_moves.append(weaned_move)
-
-            weaning_event.save()
-            current_cycle.update_state(weaning_event)
+            todo_animal_moves.extend(animal_moves)
+
+        Move.save(todo_moves)
+        TransformationEvent.save(todo_trans_events)
+        cls.save(events)
+        AnimalMove.save(todo_animal_moves)
         if todo_moves:
             Move.assign(todo_moves)
             Move.do(todo_moves)
         if todo_trans_events:
             TransformationEvent.validate_event(todo_trans_events)
 
+        for weaning_event in events:
+            weaning_event.female_cycle.update_state(weaning_event)
+
+    def _get_validation_records(self):
+        """
+        Checks the event can be validated and returns the stock moves, the
+        transformation event and the weaned animals to create for it. The
+        moves and the transformation event are set on the event but nothing
+        is saved.
+        """
+        AnimalMove = Pool().get('farm.weaning.event-farm.animal')
+
+        assert not self.female_move and not self.weaned_move, (
+            'Weaning Event %s already has related stock moves when it is to '
+            'validate.' % self.id)
+
+        current_cycle = self.animal.current_cycle
+        self.female_cycle = current_cycle
+        maximum = (current_cycle.live + current_cycle.fostered +
+            self.last_minute_fostered)
+        if self.quantity > maximum:
+            raise UserError(gettext('farm.incorrect_quantity',
+                    quantity=maximum))
+
+        moves = []
+        transformation_event = None
+        animal_moves = []
+        if (self.female_to_location and
+                self.female_to_location != self.animal.location):
+            self.animal.check_allowed_location(self.female_to_location,
+                self.rec_name)
+            self.female_move = self._get_female_move()
+            moves.append(self.female_move)
+
+        if self.casualties != 0:
+            self.lost_move = self._get_lost_move(self.casualties)
+            moves.append(self.lost_move)
+
+        if self.last_minute_fostered != 0:
+            moves.append(self._get_last_minute_fostered_move(
+                    self.last_minute_fostered))
+
+        if self.produced_animal_type == 'individual':
+            animal_moves = [AnimalMove(event=self, animal=animal)
+                for animal in self.farrowing_animals]
+
+        if (self.quantity and self.weaned_group and
+                self.weaned_group != self.farrowing_group):
+            transformation_event = self._get_transformation_event()
+            self.transformation_event = transformation_event
+        elif (self.quantity and
+                self.animal.location != self.weaned_to_location):
+            # same group but different locations
+            if self.produced_animal_type == 'individual':
+                for animal_move in animal_moves:
+                    animal_move.animal.check_allowed_location(
+                        self.weaned_to_location, self.rec_name)
+                    animal_move.move = self._get_weaned_move(
+                        animal_move.animal)
+                    moves.append(animal_move.move)
+            else:
+                self.farrowing_group.check_allowed_location(
+                    self.weaned_to_location, self.rec_name)
+                self.weaned_move = self._get_weaned_move()
+                moves.append(self.weaned_move)
+        return moves, transformation_event, animal_moves
+
+    @classmethod
+    def wean_location(cls, specie, location, timestamp,
+            female_to_location=None, weaned_to_location=None,
+            weaned_group=None):
+        """
+        Wean all the lactating females of the specie that are in location, or
+        in any of its children, at timestamp.
+
+        The quantity to wean of every farrowing group is computed with a single
+        stock query. If no destination is given, females and weaned animals
+        stay in the female's location.
+
+        Returns the list of validated weaning events.
+        """
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+
+        location = Location(int(location))
+        females = Animal.search([
+                ('specie', '=', int(specie)),
+                ('type', '=', 'female'),
+                ('location', 'child_of', [location.id], 'parent'),
+                ('current_cycle.state', '=', 'lactating'),
+                ])
+        if not females:
+            raise UserError(gettext('farm.location_without_lactating_females',
+                    location=location.rec_name))
+
+        groups = [f.farrowing_group for f in females if f.farrowing_group]
+        farm_locations = Location.search([
+                ('parent', 'child_of',
+                    list({f.farm.storage_location.id for f in females})),
+                ])
+        with Transaction().set_context(stock_date_end=timestamp.date()):
+            quantities = Lot.quantity_by_location([g.lot for g in groups],
+                [l.id for l in farm_locations],
+                quantity_domain=('quantity', '>', 0.0))
+
+        vlist = []
+        for female in females:
+            quantity = 0
+            if female.farrowing_group:
+                group_quantities = {l: q for l, q in quantities.get(
+                        female.farrowing_group.lot.id, {}).items() if q > 0}
+                # The litter is weaned from the location of the female, so it
+                # can not be counted as casualties if it is elsewhere
+                if set(group_quantities) - {female.location.id}:
+                    raise UserError(gettext(
+                            'farm.farrowing_group_not_in_female_location',
+                            group=female.farrowing_group.rec_name,
+                            female=female.rec_name,
+                            location=female.location.rec_name))
+                quantity = group_quantities.get(female.location.id, 0)
+            vlist.append({
+                    'animal_type': 'female',
+                    'specie': female.specie.id,
+                    'farm': female.farm.id,
+                    'animal': female.id,
+                    'timestamp': timestamp,
+                    'quantity': int(quantity),
+                    'last_minute_fostered': 0,
+                    'female_to_location': int(
+                        female_to_location or female.location),
+                    'weaned_to_location': int(
+                        weaned_to_location or female.location),
+                    'weaned_group': (int(weaned_group) if weaned_group
+                        else None),
+                    })
+        events = cls.create(vlist)
+        cls.validate_event(events)
+        return events
+
     def _get_female_move(self):
         pool = Pool()
         Move = pool.get('stock.move')
@@ -506,9 +578,84 @@ class WeaningEvent(AbstractEvent, ImportedEventMixin):
         return super(WeaningEvent, cls).copy(records, default=default)
 
 
-class WeaningEventFemaleCycle(ModelSQL):
+class WeanLocationStart(ModelView):
+    'Wean Location Start'
+    __name__ = 'farm.weaning.location.start'
+
+    specie = fields.Many2One('farm.specie', 'Specie', required=True,
+        readonly=True)
+    location = fields.Many2One('stock.location', 'Location', required=True,
+        domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ],
+        context={
+            'restrict_by_specie_animal_type': True,
+            },
+        help='The lactating females of this location and its children will '
+        'be weaned.')
+    timestamp = fields.DateTime('Date & Time', required=True)
+    female_to_location = fields.Many2One('stock.location',
+        'Female Destination', domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ],
+        help='If left blank the females stay in their location.')
+    weaned_to_location = fields.Many2One('stock.location',
+        'Weaned Destination', domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ],
+        help='If left blank the weaned animals stay in the female location.')
+    weaned_group = fields.Many2One('farm.animal.group', 'Weaned Group',
+        domain=[
+            ('specie', '=', Eval('specie')),
+            ],
+        help='Group in which weaned animals should be added to. If left blank '
+        'they will keep the same group.')
+
+    @staticmethod
+    def default_specie():
+        context = Transaction().context
+        if context.get('active_model') == 'ir.ui.menu':
+            pool = Pool()
+            Menu = pool.get('ir.ui.menu')
+            return Menu(context.get('active_id')).specie.id
+        return context.get('specie')
+
+    @staticmethod
+    def default_timestamp():
+        return datetime.now()
+
+
+class WeanLocation(Wizard):
+    'Wean Location'
+    __name__ = 'farm.weaning.location'
+
+    start = StateView('farm.weaning.location.start',
+        'farm.farm_weaning_location_start_view', [
+            Button('Cancel', 'end', 'tryton-cancel'),
+            Button('Wean', 'wean', 'tryton-ok', default=True),
+            ])
+    wean = StateAction('farm.act_farm_weaning_event')
+
+    def do_wean(self, action):
+        WeaningEvent = Pool().get('farm.weaning.event')
+        events = WeaningEvent.wean_location(self.start.specie,
+            self.start.location, self.start.timestamp,
+            female_to_location=self.start.female_to_location,
+            weaned_to_location=self.start.weaned_to_location,
+            weaned_group=self.start.weaned_group)
+        action['pyson_domain'] = PYSONEncoder().encode([
+                ('id', 'in', [e.id for e in events]),
+                ])
+        return action, {}
+
+
+class WeaningEventFemaleCycle(ArchiveMixin, ModelSQL):
     "Weaning Event - Female Cycle"
     __name__ = 'farm.weaning.event-farm.animal.female_cycle'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.weaning.event', 'Weaning Event',
         required=True, ondelete='RESTRICT')
@@ -525,9 +672,10 @@ class WeaningEventFemaleCycle(ModelSQL):
             ]
 
 
-class WeaningEventAnimal(ModelSQL, ModelView):
+class WeaningEventAnimal(ArchiveMixin, ModelSQL, ModelView):
     "Weaning Event - Animal"
     __name__ = 'farm.weaning.event-farm.animal'
+    _archive_parent = 'event'
 
     event = fields.Many2One('farm.weaning.event', 'Weaning Event',
         required=True, ondelete='RESTRICT')
@@ -0,0 +1,211 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import csv
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from sql import Column
+from sql.conditionals import Coalesce
+
+from trytond import backend
+from trytond.config import config
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model import ModelSQL, fields, Unique
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.transaction import Transaction
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__all__ = ['EventExport']
+
+
+def _arrow_type(field):
+    if isinstance(field, (fields.Integer, fields.Many2One)):
+        return pyarrow.int64()
+    if isinstance(field, (fields.Float, fields.Numeric)):
+        return pyarrow.float64()
+    if isinstance(field, fields.Boolean):
+        return pyarrow.bool_()
+    if isinstance(field, (fields.DateTime, fields.Timestamp)):
+        return pyarrow.timestamp('us')
+    if isinstance(field, fields.Date):
+        return pyarrow.date32()
+    return pyarrow.string()
+
+
+def _arrow_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+class _CSVWriter:
+    "Writes each batch of rows to a new CSV file"
+
+    def __init__(self, path, columns, model):
+        self.path = path
+        self.columns = columns
+        self.paths = []
+
+    def write(self, rows):
+        path = '%s_%04d.csv' % (self.path, len(self.paths) + 1)
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(self.columns)
+            writer.writerows(rows)
+        self.paths.append(path)
+
+    def close(self):
+        return self.paths
+
+
+class _ParquetWriter:
+    "Writes each batch of rows as a row group of a Parquet file"
+
+    def __init__(self, path, columns, model):
+        self.path = '%s.parquet' % path
+        self.columns = columns
+        self.schema = pyarrow.schema([
+                (c, _arrow_type(model._fields[c])) for c in columns])
+        self.writer = None
+
+    def write(self, rows):
+        if self.writer is None:
+            self.writer = pyarrow.parquet.ParquetWriter(self.path,
+                self.schema)
+        data = [[_arrow_value(v) for v in c] for c in zip(*rows)]
+        self.writer.write_table(
+            pyarrow.Table.from_arrays(data, schema=self.schema))
+
+    def close(self):
+        if self.writer is None:
+            return []
+        self.writer.close()
+        return [self.path]
+
+
+class EventExport(ModelSQL):
+    '''
+    Farm Event Export
+
+    The write date and id up to which the events of a model have been exported
+    to a target.
+    '''
+    __name__ = 'farm.event.export'
+
+    target = fields.Char('Target', required=True)
+    model = fields.Char('Model', required=True)
+    watermark = fields.DateTime('Watermark', required=True)
+    last_id = fields.Integer('Last ID',
+        help='The last exported id of the records modified at the watermark.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('target_model_uniq', Unique(t, t.target, t.model),
+                'farm.event_export_unique'),
+            ]
+        cls.__rpc__.update({
+                'export': RPC(readonly=False),
+                })
+
+    @classmethod
+    def export_events(cls):
+        "Exports the changes of the events to the default target"
+        cls.export()
+
+    @classmethod
+    def export(cls, target='default', models=None, full=False):
+        '''
+        Exports the events created or modified since the last export to
+        target into files of the directory export_directory of the farm
+        section of the configuration. Returns the paths of the files.
+        '''
+        pool = Pool()
+        Journal = pool.get('farm.animal.cycle.events')
+        ModelAccess = pool.get('ir.model.access')
+
+        # The watermarks are shared by all the users of the target
+        ModelAccess.check(cls.__name__, 'write')
+        allowed = set(Journal._get_fieldname()) | {Journal.__name__}
+        for model in models or []:
+            if model not in allowed:
+                raise UserError(gettext('farm.invalid_export_model',
+                        model=model))
+
+        directory = config.get('farm', 'export_directory', default=None)
+        if not directory:
+            raise UserError(gettext('farm.missing_export_directory'))
+        directory = os.path.join(directory, os.path.basename(target))
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for model in models or Journal._get_fieldname():
+            paths.extend(cls._export_model(directory, target, model, full))
+        return paths
+
+    @classmethod
+    def _export_model(cls, directory, target, model, full=False):
+        pool = Pool()
+        Model = pool.get(model)
+        transaction = Transaction()
+        batch_size = config.getint('farm', 'export_batch_size',
+            default=10000)
+        table = Model.__table__()
+        modified = Coalesce(table.write_date, table.create_date)
+
+        exports = cls.search([
+                ('target', '=', target),
+                ('model', '=', model),
+                ], limit=1)
+        export = exports[0] if exports else cls(target=target, model=model)
+        columns = Model._archive_columns()
+        where = None
+        if not full and export.id is not None:
+            # Records modified at the same time as the watermark may have been
+            # exported, so they are compared by id
+            where = ((modified > export.watermark)
+                | ((modified == export.watermark)
+                    & (table.id > (export.last_id or 0))))
+
+        if backend.name == 'postgresql':
+            # Server-side cursor to not load all the table in memory
+            cursor = transaction.connection.cursor(
+                'farm_event_export_%s' % Model._table)
+            cursor.itersize = batch_size
+        else:
+            cursor = transaction.connection.cursor()
+        cursor.execute(*table.select(modified, table.id,
+                *[Column(table, c) for c in columns],
+                where=where, order_by=[modified.asc, table.id.asc]))
+
+        name = '%s_%s' % (Model._table,
+            datetime.now().strftime('%Y%m%d%H%M%S'))
+        Writer = _ParquetWriter if pyarrow else _CSVWriter
+        writer = Writer(os.path.join(directory, name), columns, Model)
+        watermark, last_id = export.watermark, export.last_id
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if (watermark is None
+                    or tuple(rows[-1][:2]) > (watermark, last_id or 0)):
+                watermark, last_id = rows[-1][:2]
+            writer.write([r[2:] for r in rows])
+        cursor.close()
+        paths = writer.close()
+
+        if (watermark, last_id) != (export.watermark, export.last_id):
+            export.watermark = watermark
+            export.last_id = last_id
+            export.save()
+        return paths
@@ -0,0 +1,37 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from trytond.pool import Pool, PoolMeta
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.extend([
+                ('farm.animal.cycle.events|create_event_partitions',
+                    "Create Event Partitions"),
+                ('farm.animal|archive_removed', "Archive Removed Animals"),
+                ('farm.stock.snapshot|roll_forward',
+                    "Roll Stock Snapshots Forward"),
+                ('farm.animal.group.performance.week|update_weeks',
+                    "Update Weekly Performance of Groups"),
+                ('farm.herd.kpi|update_kpis', "Update Herd KPIs"),
+                ('farm.event.export|export_events', "Export Events"),
+                ('farm.animal.group.weight.reading|aggregate_readings',
+                    "Aggregate Scale Readings"),
+                ('farm.silo.sensor|create_inventories',
+                    "Create Provisional Inventories from Silo Sensors"),
+                ])
+
+
+class Model(metaclass=PoolMeta):
+    __name__ = 'ir.model'
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        QualityTemplate = pool.get('quality.template')
+        super().write(*args)
+        QualityTemplate._get_model_cache.clear()
@@ -0,0 +1,247 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+
+from sql import Null
+
+from trytond.model import ModelSQL, ModelView, fields
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['HerdKpi']
+
+_FEMALE_EVENTS = ['farm.insemination.event', 'farm.abort.event',
+    'farm.farrowing.event', 'farm.foster.event', 'farm.weaning.event']
+_KPI_FIELDS = ['female_days', 'female_inventory', 'services', 'farrowings',
+    'farrowing_rate', 'born_alive', 'weaned', 'pre_weaning_mortality',
+    'pwsy', 'npd']
+
+
+class HerdKpi(ModelSQL, ModelView):
+    '''
+    Herd KPI
+
+    Productivity of the sows of a farm in a period following the NPPC
+    standards. The KPIs of closed periods are stored and removed when an
+    event of the period changes.
+    '''
+    __name__ = 'farm.herd.kpi'
+    _order = [('start_date', 'DESC'), ('farm', 'ASC')]
+
+    farm = fields.Many2One('stock.location', 'Farm', required=True,
+        readonly=True, domain=[('type', '=', 'warehouse')],
+        ondelete='CASCADE')
+    specie = fields.Many2One('farm.specie', 'Specie', required=True,
+        readonly=True, ondelete='CASCADE')
+    start_date = fields.Date('Start Date', required=True, readonly=True)
+    end_date = fields.Date('End Date', required=True, readonly=True)
+    female_days = fields.Integer('Female Days', readonly=True,
+        help='Days of the females in the herd, from their first service.')
+    female_inventory = fields.Float('Average Inventory', digits=(16, 2),
+        readonly=True)
+    services = fields.Integer('Services', readonly=True,
+        help='Cycles with their first insemination in the period.')
+    farrowings = fields.Integer('Farrowings', readonly=True,
+        help='Serviced cycles of the period that farrowed.')
+    farrowing_rate = fields.Float('Farrowing Rate (%)', digits=(16, 2),
+        readonly=True, help='Farrowings of the services of the period that '
+        'already have a result.')
+    born_alive = fields.Integer('Born Alive', readonly=True,
+        help='Born alive and fostered of the litters weaned in the period.')
+    weaned = fields.Integer('Weaned', readonly=True)
+    pre_weaning_mortality = fields.Float('Pre-weaning Mortality (%)',
+        digits=(16, 2), readonly=True)
+    pwsy = fields.Float('Weaned per Sow and Year', digits=(16, 2),
+        readonly=True)
+    npd = fields.Float('Non-productive Days per Sow and Year',
+        digits=(16, 2), readonly=True, help='Days of the females not '
+        'pregnant nor lactating.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.__rpc__.update({
+                'get_kpis': RPC(readonly=False),
+                })
+
+    @classmethod
+    def get_kpis(cls, farm_id, specie_id, start_date, end_date):
+        '''
+        Returns the KPIs of the farm and specie between start_date and
+        end_date as a dictionary. They are stored if the period is closed.
+        '''
+        if end_date >= date.today():
+            return cls._compute(farm_id, specie_id, start_date, end_date)
+        kpis = cls.search([
+                ('farm', '=', farm_id),
+                ('specie', '=', specie_id),
+                ('start_date', '=', start_date),
+                ('end_date', '=', end_date),
+                ], limit=1)
+        if kpis:
+            kpi, = kpis
+            return {f: getattr(kpi, f) for f in _KPI_FIELDS}
+        values = cls._compute(farm_id, specie_id, start_date, end_date)
+        with Transaction().set_context(_check_access=False):
+            cls.create([dict(values, farm=farm_id, specie=specie_id,
+                        start_date=start_date, end_date=end_date)])
+        return values
+
+    @classmethod
+    def update_kpis(cls):
+        "Stores the KPIs of the previous month of the farms with females"
+        pool = Pool()
+        FarmLine = pool.get('farm.specie.farm_line')
+        end_date = date.today().replace(day=1) - timedelta(days=1)
+        start_date = end_date.replace(day=1)
+        for line in FarmLine.search([('has_female', '=', True)]):
+            cls.get_kpis(line.farm.id, line.specie.id, start_date, end_date)
+
+    @classmethod
+    def invalidate(cls, values):
+        '''
+        Removes the stored KPIs of the periods changed by the events journal
+        values
+        '''
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        dates = {}
+        for vals in values:
+            if vals['event_type'] not in _FEMALE_EVENTS + [
+                    'farm.removal.event']:
+                continue
+            key = (vals['farm'], vals['specie'])
+            event_date = vals['timestamp'].date()
+            dates[key] = min(dates.get(key, event_date), event_date)
+        for (farm_id, specie_id), event_date in dates.items():
+            cursor.execute(*table.delete(
+                    where=(table.farm == farm_id)
+                    & (table.specie == specie_id)
+                    & (table.end_date >= event_date)))
+
+    @classmethod
+    def _compute(cls, farm_id, specie_id, start_date, end_date):
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        FarrowingEvent = pool.get('farm.farrowing.event')
+        FosterEvent = pool.get('farm.foster.event')
+        Journal = pool.get('farm.animal.cycle.events')
+        WeaningEvent = pool.get('farm.weaning.event')
+        cursor = Transaction().connection.cursor()
+        journal = Journal.__table__()
+        animal = Animal.__table__()
+
+        # Validated events of the females present in the period, the whole
+        # history is needed to know their first service and open cycles
+        cursor.execute(*journal.join(animal,
+                condition=journal.animal == animal.id
+                ).select(journal.animal, journal.cycle, journal.event_type,
+                journal.event_id, journal.timestamp, animal.removal_date,
+                where=(journal.farm == farm_id)
+                & (journal.specie == specie_id)
+                & (journal.state == 'validated')
+                & journal.event_type.in_(_FEMALE_EVENTS)
+                & (journal.timestamp <= datetime.combine(end_date, time.max))
+                & ((animal.removal_date == Null)
+                    | (animal.removal_date >= start_date)),
+                order_by=[journal.animal, journal.timestamp]))
+        columns = list(zip(*cursor)) or [()] * 6
+        animals, cycles, event_types, event_ids, timestamps, removals = (
+            columns)
+
+        quantities = {}
+        for Event, name in [
+                (FarrowingEvent, 'live'),
+                (WeaningEvent, 'quantity'),
+                (FosterEvent, 'quantity'),
+                ]:
+            ids = [i for t, i in zip(event_types, event_ids)
+                if t == Event.__name__]
+            event = Event.__table__()
+            for sub_ids in grouped_slice(ids):
+                cursor.execute(*event.select(event.id, getattr(event, name),
+                        where=reduce_ids(event.id, sub_ids)))
+                for event_id, quantity in cursor:
+                    quantities[(Event.__name__, event_id)] = quantity or 0
+
+        first_service = {}
+        exit_date = {}
+        last_cycle = {}
+        cycle_info = defaultdict(dict)
+        for animal_id, cycle_id, event_type, event_id, timestamp, removal in (
+                zip(*columns)):
+            day = timestamp.date()
+            exit_date[animal_id] = min(removal or end_date, end_date)
+            if not cycle_id:
+                continue
+            info = cycle_info[cycle_id]
+            info['animal'] = animal_id
+            quantity = quantities.get((event_type, event_id), 0)
+            if event_type == 'farm.insemination.event':
+                first_service.setdefault(animal_id, day)
+                info.setdefault('service', day)
+                last_cycle[animal_id] = cycle_id
+            elif event_type == 'farm.abort.event':
+                info['abort'] = day
+            elif event_type == 'farm.farrowing.event':
+                info['farrowing'] = day
+                info['live'] = quantity
+            elif event_type == 'farm.foster.event':
+                info['fostered'] = info.get('fostered', 0) + quantity
+            elif event_type == 'farm.weaning.event':
+                info['weaning'] = day
+                info['weaned'] = quantity
+
+        def days(first, last):
+            first, last = max(first, start_date), min(last, end_date)
+            return max((last - first).days + 1, 0)
+
+        female_days = sum(days(first_service[a], exit_date[a])
+            for a in first_service)
+        productive_days = 0
+        services = farrowings = pending = 0
+        born_alive = weaned = 0
+        for cycle_id, info in cycle_info.items():
+            service = info.get('service')
+            if not service:
+                continue
+            animal_id = info['animal']
+            open_cycle = (last_cycle.get(animal_id) == cycle_id
+                and not info.get('abort')
+                and exit_date[animal_id] >= end_date)
+            if info.get('farrowing'):
+                last = (info['weaning'] - timedelta(days=1)
+                    if info.get('weaning') else exit_date[animal_id])
+                productive_days += days(service, last)
+            elif open_cycle:
+                productive_days += days(service, exit_date[animal_id])
+            if start_date <= service <= end_date:
+                services += 1
+                if info.get('farrowing'):
+                    farrowings += 1
+                elif open_cycle:
+                    pending += 1
+            if (info.get('weaning')
+                    and start_date <= info['weaning'] <= end_date):
+                born_alive += info.get('live', 0) + info.get('fostered', 0)
+                weaned += info.get('weaned', 0)
+
+        period_days = (end_date - start_date).days + 1
+        return {
+            'female_days': female_days,
+            'female_inventory': female_days / period_days,
+            'services': services,
+            'farrowings': farrowings,
+            'farrowing_rate': (farrowings * 100 / (services - pending)
+                if services > pending else None),
+            'born_alive': born_alive,
+            'weaned': weaned,
+            'pre_weaning_mortality': ((born_alive - weaned) * 100 / born_alive
+                if born_alive else None),
+            'pwsy': weaned * 365 / female_days if female_days else None,
+            'npd': ((female_days - productive_days) * 365 / female_days
+                if female_days else None),
+            }
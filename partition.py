@@ -0,0 +1,186 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import datetime
+
+from trytond import backend
+from trytond.config import config
+from trytond.transaction import Transaction
+
+__all__ = ['partition_interval', 'is_partitioned', 'partition_table',
+    'unpartition_table', 'create_partitions', 'split_default_partition']
+
+
+def partition_interval():
+    "Returns the configured partition interval or None if it is disabled"
+    interval = config.get('farm', 'partition', default=None)
+    if backend.name != 'postgresql' or interval not in ('month', 'year'):
+        return None
+    return interval
+
+
+def _period_start(date, interval):
+    if interval == 'year':
+        return datetime.date(date.year, 1, 1)
+    return datetime.date(date.year, date.month, 1)
+
+
+def _next_period(date, interval):
+    if interval == 'year':
+        return datetime.date(date.year + 1, 1, 1)
+    if date.month == 12:
+        return datetime.date(date.year + 1, 1, 1)
+    return datetime.date(date.year, date.month + 1, 1)
+
+
+def _partition_name(table, date, interval):
+    return '%s__p%s' % (table,
+        date.strftime('%Y' if interval == 'year' else '%Y_%m'))
+
+
+def is_partitioned(table):
+    cursor = Transaction().connection.cursor()
+    cursor.execute('SELECT 1 FROM pg_partitioned_table '
+        'WHERE partrelid = to_regclass(%s)', (table,))
+    return bool(cursor.fetchone())
+
+
+def _is_referenced(table):
+    cursor = Transaction().connection.cursor()
+    cursor.execute('SELECT 1 FROM pg_constraint '
+        'WHERE contype = \'f\' AND confrelid = to_regclass(%s) LIMIT 1',
+        (table,))
+    return bool(cursor.fetchone())
+
+
+def create_partitions(table, interval, start=None):
+    """
+    Creates the missing partitions of table from the period of start (today
+    by default) up to the number of future periods configured
+    """
+    cursor = Transaction().connection.cursor()
+    today = datetime.date.today()
+    ahead = config.getint('farm', 'partition_ahead', default=3)
+    cursor.execute('SELECT c.relname FROM pg_inherits AS i '
+        'JOIN pg_class AS c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(%s)', (table,))
+    existing = {r for r, in cursor}
+
+    date = _period_start(start or today, interval)
+    end = _period_start(today, interval)
+    for _ in range(ahead + 1):
+        end = _next_period(end, interval)
+    while date < end:
+        next_date = _next_period(date, interval)
+        name = _partition_name(table, date, interval)
+        if name not in existing:
+            cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" '
+                'FOR VALUES FROM (%%s) TO (%%s)' % (name, table),
+                (date, next_date))
+        date = next_date
+
+
+def split_default_partition(table, column, interval):
+    """
+    Moves the rows of the default partition of table to new partitions of
+    their periods, so back-dated rows are pruned like any other row
+    """
+    cursor = Transaction().connection.cursor()
+    default = '%s__default' % table
+    cursor.execute('SELECT DISTINCT CAST(date_trunc(%%s, "%s") AS DATE) '
+        'FROM "%s"' % (column, default), (interval,))
+    for date, in cursor.fetchall():
+        next_date = _next_period(date, interval)
+        name = _partition_name(table, date, interval)
+        # A partition can not be created while the default one has rows of
+        # its range
+        cursor.execute('CREATE TEMPORARY TABLE "%s__rows" AS '
+            'SELECT * FROM "%s" WHERE "%s" >= %%s AND "%s" < %%s'
+            % (name, default, column, column), (date, next_date))
+        cursor.execute('DELETE FROM "%s" WHERE "%s" >= %%s AND "%s" < %%s'
+            % (default, column, column), (date, next_date))
+        cursor.execute('CREATE TABLE "%s" PARTITION OF "%s" '
+            'FOR VALUES FROM (%%s) TO (%%s)' % (name, table),
+            (date, next_date))
+        cursor.execute('INSERT INTO "%s" SELECT * FROM "%s__rows"'
+            % (table, name))
+        cursor.execute('DROP TABLE "%s__rows"' % name)
+
+
+def _rename_primary_key(table):
+    "Frees the name of the primary key of table for its replacement"
+    cursor = Transaction().connection.cursor()
+    cursor.execute('SELECT conname FROM pg_constraint '
+        'WHERE contype = \'p\' AND conrelid = to_regclass(%s)', (table,))
+    for name, in cursor.fetchall():
+        cursor.execute('ALTER TABLE "%s" RENAME CONSTRAINT "%s" TO "%s"'
+            % (table, name, '%s_pkey' % table))
+
+
+def _replace_table(table, old_table):
+    "Moves the rows and the id sequence of old_table to table and drops it"
+    cursor = Transaction().connection.cursor()
+    cursor.execute('INSERT INTO "%s" SELECT * FROM "%s"'
+        % (table, old_table))
+    cursor.execute('SELECT pg_get_serial_sequence(%s, \'id\')',
+        (old_table,))
+    sequence, = cursor.fetchone()
+    if sequence:
+        cursor.execute('ALTER SEQUENCE %s OWNED BY "%s".id'
+            % (sequence, table))
+    cursor.execute('DROP TABLE "%s"' % old_table)
+
+
+def partition_table(table, column, interval, referenced=False):
+    """
+    Converts table into a table partitioned by range of column, or back into
+    a regular table if it is referenced.
+
+    Tables referenced by foreign keys, in the database or by the models when
+    referenced is set, are kept as regular tables because the primary key of
+    a partitioned table must include the partition column. This is checked at
+    every update, as the referencing tables may be created after the table.
+    Returns True if the table has been converted.
+    """
+    referenced = referenced or _is_referenced(table)
+    if is_partitioned(table):
+        if referenced:
+            unpartition_table(table)
+            return True
+        create_partitions(table, interval)
+        split_default_partition(table, column, interval)
+        return False
+    if referenced:
+        return False
+
+    cursor = Transaction().connection.cursor()
+    old_table = '%s__unpartitioned' % table
+    cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (table, old_table))
+    _rename_primary_key(old_table)
+    cursor.execute('CREATE TABLE "%s" '
+        '(LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE ("%s")' % (table, old_table, column))
+    cursor.execute('ALTER TABLE "%s" ADD PRIMARY KEY (id, "%s")'
+        % (table, column))
+    # Rows out of the range of the partitions go there until the scheduled
+    # task moves them to the partitions of their periods
+    cursor.execute('CREATE TABLE "%s__default" PARTITION OF "%s" DEFAULT'
+        % (table, table))
+    cursor.execute('SELECT MIN("%s") FROM "%s"' % (column, old_table))
+    first, = cursor.fetchone()
+    create_partitions(table, interval,
+        start=first.date() if first else None)
+    _replace_table(table, old_table)
+    return True
+
+
+def unpartition_table(table):
+    "Converts the partitioned table back into a regular table"
+    cursor = Transaction().connection.cursor()
+    old_table = '%s__partitioned' % table
+    cursor.execute('ALTER TABLE "%s" RENAME TO "%s"' % (table, old_table))
+    _rename_primary_key(old_table)
+    cursor.execute('CREATE TABLE "%s" '
+        '(LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        % (table, old_table))
+    cursor.execute('ALTER TABLE "%s" ADD PRIMARY KEY (id)' % table)
+    _replace_table(table, old_table)
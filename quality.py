@@ -1,5 +1,6 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
+from trytond.cache import Cache
 from trytond.model import fields
 from trytond.pyson import Bool, Eval, Not
 from trytond.pool import PoolMeta, Pool
@@ -11,17 +12,76 @@ class QualityTemplate(metaclass=PoolMeta):
     __name__ = 'quality.template'
 
     document = fields.Reference('Document', selection='get_model')
+    _get_model_cache = Cache('quality.template.get_model')
+    _document_template_cache = Cache('quality.template.document_template',
+        context=False)
 
     @classmethod
     def get_model(cls):
         pool = Pool()
         ConfigLine = pool.get('quality.configuration.line')
+        res = cls._get_model_cache.get(None)
+        if res is not None:
+            return res
         lines = ConfigLine.search([])
         res = [('', '')]
         for line in lines:
             res.append((line.document.name, line.document.string))
+        cls._get_model_cache.set(None, res)
         return res
 
+    @classmethod
+    def get_document_template(cls, document):
+        "Return the first template of the document reference or None"
+        template_id = cls._document_template_cache.get(document, -1)
+        if template_id == -1:
+            templates = cls.search([
+                    ('document', '=', document),
+                    ], limit=1)
+            template_id = templates[0].id if templates else None
+            cls._document_template_cache.set(document, template_id)
+        return cls(template_id) if template_id is not None else None
+
+    @classmethod
+    def create(cls, vlist):
+        cls._document_template_cache.clear()
+        return super(QualityTemplate, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        super(QualityTemplate, cls).write(*args)
+        cls._document_template_cache.clear()
+
+    @classmethod
+    def delete(cls, templates):
+        super(QualityTemplate, cls).delete(templates)
+        cls._document_template_cache.clear()
+
+
+class QualityConfigurationLine(metaclass=PoolMeta):
+    __name__ = 'quality.configuration.line'
+
+    @classmethod
+    def create(cls, vlist):
+        pool = Pool()
+        QualityTemplate = pool.get('quality.template')
+        QualityTemplate._get_model_cache.clear()
+        return super(QualityConfigurationLine, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        QualityTemplate = pool.get('quality.template')
+        super(QualityConfigurationLine, cls).write(*args)
+        QualityTemplate._get_model_cache.clear()
+
+    @classmethod
+    def delete(cls, lines):
+        pool = Pool()
+        QualityTemplate = pool.get('quality.template')
+        super(QualityConfigurationLine, cls).delete(lines)
+        QualityTemplate._get_model_cache.clear()
+
 
 class QualityTest(metaclass=PoolMeta):
     __name__ = 'quality.test'
@@ -0,0 +1,291 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+from collections import defaultdict
+from datetime import timedelta
+
+from sql import Null
+from sql.aggregate import Max
+
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model import ModelSQL, ModelView, fields, Index, Unique
+from trytond.pool import Pool
+from trytond.pyson import Eval
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['RfidGate', 'RfidRead']
+
+
+class RfidGate(ModelSQL, ModelView):
+    '''
+    RFID Gate
+
+    Reader of the tags of the animals that pass between two locations. The
+    animals read are moved to the location where they are not.
+    '''
+    __name__ = 'farm.rfid.gate'
+    _rec_name = 'code'
+
+    code = fields.Char('Code', required=True,
+        help='The identifier of the gate in its reads.')
+    from_location = fields.Many2One('stock.location', 'Origin',
+        required=True, domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ])
+    to_location = fields.Many2One('stock.location', 'Destination',
+        required=True, domain=[
+            ('type', '=', 'storage'),
+            ('silo', '=', False),
+            ('id', '!=', Eval('from_location', -1)),
+            ])
+    debounce = fields.Integer('Debounce (Seconds)', required=True,
+        help='Reads of the same tag in the gate within these seconds of the '
+        'previous one are discarded.')
+    active = fields.Boolean('Active')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('code_uniq', Unique(t, t.code), 'farm.rfid_gate_code_unique'),
+            ]
+
+    @staticmethod
+    def default_debounce():
+        return 60
+
+    @staticmethod
+    def default_active():
+        return True
+
+
+class RfidRead(ModelSQL, ModelView):
+    '''
+    RFID Read
+
+    Tag read by a gate, with the animal of the tag and the move event it
+    generated if any or the reason why the animal could not be moved.
+    '''
+    __name__ = 'farm.rfid.read'
+    _order = [('timestamp', 'DESC')]
+
+    gate = fields.Many2One('farm.rfid.gate', 'Gate', required=True,
+        readonly=True, ondelete='CASCADE')
+    tag = fields.Char('Tag', required=True, readonly=True)
+    timestamp = fields.DateTime('Date & Time', required=True, readonly=True)
+    animal = fields.Many2One('farm.animal', 'Animal', readonly=True,
+        ondelete='SET NULL')
+    move_event = fields.Many2One('farm.move.event', 'Move Event',
+        readonly=True, ondelete='SET NULL')
+    error = fields.Char('Error', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.gate, Index.Equality()),
+                    (t.tag, Index.Equality()),
+                    (t.timestamp, Index.Range())),
+                Index(t,
+                    (t.timestamp, Index.Range()),
+                    where=t.move_event == Null),
+                })
+        cls.__rpc__.update({
+                'ingest': RPC(readonly=False,
+                    result=lambda r: list(map(int, r))),
+                })
+
+    @classmethod
+    def ingest(cls, reads):
+        '''
+        Stores the reads given as tuples of (tag, gate code, timestamp) and
+        creates and validates the move events of the animals read. Reads of
+        the same tag and gate within the debounce of the gate are discarded.
+        The animals that can not be moved keep the error in their read.
+        Returns the list of validated move events.
+        '''
+        pool = Pool()
+        Gate = pool.get('farm.rfid.gate')
+        MoveEvent = pool.get('farm.move.event')
+
+        gates = {}
+        for sub_codes in grouped_slice(list({r[1] for r in reads})):
+            gates.update((g.code, g) for g in Gate.search([
+                        ('code', 'in', list(sub_codes)),
+                        ]))
+        for _, code, _ in reads:
+            if code not in gates:
+                raise UserError(gettext('farm.unknown_rfid_gate', gate=code))
+        for gate in gates.values():
+            for location in [gate.from_location, gate.to_location]:
+                if not location.warehouse:
+                    raise UserError(gettext('farm.rfid_gate_without_farm',
+                            gate=gate.rec_name, location=location.rec_name))
+
+        reads = cls._debounce([(tag, gates[code], timestamp)
+                for tag, code, timestamp in reads])
+        animals = cls._resolve_tags({r[0] for r in reads})
+        records = cls.create([{
+                    'tag': tag,
+                    'gate': gate.id,
+                    'timestamp': timestamp,
+                    'animal': animals.get(tag),
+                    } for tag, gate, timestamp in reads])
+
+        locations = cls._get_animal_locations(
+            [r for r in records if r.animal])
+        # Each wave moves an animal once, as the origin of its move events
+        # must be its current location when they are created
+        waves = []
+        moves = defaultdict(int)
+        for record in records:
+            animal, gate = record.animal, record.gate
+            if not animal or (animal.type == 'female'
+                    and animal.farrowing_group):
+                # Lactating females are moved with their litter
+                continue
+            location = locations.get(animal.id)
+            if location == gate.from_location:
+                to_location = gate.to_location
+            elif location == gate.to_location:
+                to_location = gate.from_location
+            else:
+                continue
+            try:
+                animal.check_allowed_location(to_location, gate.rec_name)
+            except UserError as exception:
+                record.error = exception.message
+                continue
+            locations[animal.id] = to_location
+            if len(waves) <= moves[animal.id]:
+                waves.append([])
+            waves[moves[animal.id]].append((record, {
+                        'animal_type': animal.type,
+                        'specie': animal.specie.id,
+                        'farm': location.warehouse.id,
+                        'animal': animal.id,
+                        'timestamp': record.timestamp,
+                        'from_location': location.id,
+                        'to_location': to_location.id,
+                        'quantity': 1,
+                        'unit_price': animal.lot.product.cost_price,
+                        }))
+            moves[animal.id] += 1
+
+        events = []
+        for wave in waves:
+            wave_events = MoveEvent.create([v for _, v in wave])
+            MoveEvent.validate_location_contents(wave_events)
+            for (record, _), event in zip(wave, wave_events):
+                record.move_event = event
+            events.extend(wave_events)
+        cls.save([r for r in records if r.move_event or r.error])
+        return events
+
+    @classmethod
+    def _debounce(cls, reads):
+        '''
+        Returns the reads, ordered by timestamp, without those within the
+        debounce of the previous read of the tag in the gate, so a tag read
+        continuously is kept once
+        '''
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        last = {}
+        tags = list({r[0] for r in reads})
+        gate_ids = list({r[1].id for r in reads})
+        for sub_tags in grouped_slice(tags):
+            cursor.execute(*table.select(table.tag, table.gate,
+                    Max(table.timestamp),
+                    where=table.tag.in_(list(sub_tags))
+                    & reduce_ids(table.gate, gate_ids),
+                    group_by=[table.tag, table.gate]))
+            for tag, gate_id, timestamp in cursor:
+                last[(tag, gate_id)] = timestamp
+
+        result = []
+        for tag, gate, timestamp in sorted(reads,
+                key=lambda r: (r[0], r[1].id, r[2])):
+            key = (tag, gate.id)
+            previous, last[key] = last.get(key), timestamp
+            if (previous
+                    and timestamp - previous < timedelta(
+                        seconds=gate.debounce)):
+                continue
+            result.append((tag, gate, timestamp))
+        result.sort(key=lambda r: r[2])
+        return result
+
+    @classmethod
+    def _resolve_tags(cls, tags):
+        '''
+        Returns the active animal of each tag, which may be the number of the
+        animal or one of its tags, with a single query
+        '''
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        AnimalTag = pool.get('farm.animal-farm.tag')
+        Lot = pool.get('stock.lot')
+        Tag = pool.get('farm.tag')
+        cursor = Transaction().connection.cursor()
+        animal = Animal.__table__()
+        animal_tag = AnimalTag.__table__()
+        lot = Lot.__table__()
+        tag = Tag.__table__()
+
+        result, by_tag = {}, {}
+        for sub_tags in grouped_slice(list(tags)):
+            sub_tags = list(sub_tags)
+            cursor.execute(*animal.join(lot,
+                    condition=animal.lot == lot.id
+                    ).join(animal_tag, 'LEFT',
+                    condition=animal_tag.animal == animal.id
+                    ).join(tag, 'LEFT',
+                    condition=(animal_tag.tag == tag.id)
+                    & tag.name.in_(sub_tags)
+                    ).select(animal.id, lot.number, tag.name,
+                    where=(animal.active == True)
+                    & (lot.number.in_(sub_tags) | (tag.id != Null))))
+            for animal_id, number, tag_name in cursor:
+                if number in tags:
+                    result[number] = animal_id
+                if tag_name:
+                    by_tag[tag_name] = animal_id
+        # The numbers take precedence over the tags
+        for tag_name, animal_id in by_tag.items():
+            result.setdefault(tag_name, animal_id)
+        return result
+
+    @classmethod
+    def _get_animal_locations(cls, reads):
+        '''
+        Returns the location of the gates of the reads where each animal is
+        at the date of the first read, with a single stock query
+        '''
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+
+        if not reads:
+            return {}
+        location_ids = list({l.id for r in reads
+                for l in [r.gate.from_location, r.gate.to_location]})
+        lots = {r.animal.lot.id: r.animal.id for r in reads}
+        with Transaction().set_context(
+                stock_date_end=min(r.timestamp for r in reads).date()):
+            quantities = Lot.quantity_by_location(
+                Lot.browse(list(lots)), location_ids,
+                quantity_domain=('quantity', '>', 0.0))
+        result = {}
+        for lot_id, location_quantities in quantities.items():
+            for location_id, quantity in location_quantities.items():
+                if quantity > 0 and lot_id in lots:
+                    result[lots[lot_id]] = Location(location_id)
+        return result
@@ -0,0 +1,149 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import math
+from datetime import date
+from decimal import Decimal
+
+from sql import Column, Null
+from sql.aggregate import Count, Max, Sum
+from sql.functions import CurrentTimestamp
+
+from trytond.model import ModelSQL, ModelView, fields, Index
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice
+from trytond.transaction import Transaction
+
+__all__ = ['ScaleReading']
+
+
+class ScaleReading(ModelSQL, ModelView):
+    '''
+    Farm Scale Reading
+
+    Weight in kilograms of an animal of a group read by a walk-over scale.
+    The readings of each group and day are aggregated into a group weight.
+    '''
+    __name__ = 'farm.animal.group.weight.reading'
+    _order = [('timestamp', 'DESC')]
+
+    group = fields.Many2One('farm.animal.group', 'Group', required=True,
+        readonly=True, ondelete='CASCADE')
+    scale = fields.Char('Scale', readonly=True)
+    timestamp = fields.DateTime('Date & Time', required=True, readonly=True)
+    date = fields.Date('Date', required=True, readonly=True)
+    weight = fields.Float('Weight (Kg)', digits=(16, 3), required=True,
+        readonly=True)
+    group_weight = fields.Many2One('farm.animal.group.weight', 'Group Weight',
+        readonly=True, ondelete='SET NULL',
+        help='The weight of the group that aggregates the reading.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (Column(t, 'group'), Index.Equality()),
+                    (t.date, Index.Range())),
+                Index(t,
+                    (t.date, Index.Range()),
+                    where=t.group_weight == Null),
+                })
+        cls.__rpc__.update({
+                'ingest': RPC(readonly=False),
+                })
+
+    @classmethod
+    def ingest(cls, readings):
+        '''
+        Stores the readings given as tuples of (group id, timestamp, kilograms)
+        or (group id, timestamp, kilograms, scale). Returns the number of
+        readings stored.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        columns = [table.create_uid, table.create_date, Column(table, 'group'),
+            table.timestamp, table.date, table.weight, table.scale]
+        count = 0
+        for sub_readings in grouped_slice(readings):
+            values = []
+            for reading in sub_readings:
+                group_id, timestamp, weight = reading[:3]
+                scale = reading[3] if len(reading) > 3 else None
+                values.append([transaction.user, CurrentTimestamp(),
+                        group_id, timestamp, timestamp.date(), float(weight),
+                        scale])
+            cursor.execute(*table.insert(columns, values))
+            count += len(values)
+        return count
+
+    @classmethod
+    def aggregate_readings(cls):
+        "Aggregates the readings of the days before today"
+        cls.aggregate(date.today())
+
+    @classmethod
+    def aggregate(cls, until=None):
+        '''
+        Creates a group weight with the readings of each group and day with
+        new readings before until. The previous weight of the group and day is
+        replaced.
+        '''
+        pool = Pool()
+        GroupWeight = pool.get('farm.animal.group.weight')
+        ModelData = pool.get('ir.model.data')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        group = Column(table, 'group')
+        where = table.group_weight == Null
+        if until:
+            where &= table.date < until
+        pending = table.select(group.as_('group'), table.date,
+            where=where, group_by=[group, table.date])
+        query = table.join(pending,
+            condition=(group == Column(pending, 'group'))
+            & (table.date == pending.date))
+
+        cursor.execute(*query.select(table.group_weight,
+                where=table.group_weight != Null,
+                group_by=[table.group_weight]))
+        old_weights = GroupWeight.browse([r for r, in cursor])
+        if old_weights:
+            GroupWeight.delete(old_weights)
+
+        kg_id = ModelData.get_id('product', 'uom_kilogram')
+        cursor.execute(*query.select(group, table.date, Count(table.id),
+                Sum(table.weight), Sum(table.weight * table.weight),
+                Max(table.timestamp),
+                group_by=[group, table.date]))
+        days, to_create = [], []
+        for group_id, day, count, total, squares, timestamp in cursor:
+            days.append((group_id, day))
+            to_create.append({
+                    'group': group_id,
+                    'timestamp': timestamp,
+                    'quantity': count,
+                    'uom': kg_id,
+                    'weight': Decimal(str(round(total, 3))),
+                    'cv': cls._cv(count, total, squares),
+                    })
+        if not to_create:
+            return []
+        weights = GroupWeight.create(to_create)
+        for (group_id, day), weight in zip(days, weights):
+            cursor.execute(*table.update([table.group_weight], [weight.id],
+                    where=(group == group_id) & (table.date == day)))
+        return weights
+
+    @staticmethod
+    def _cv(count, total, squares):
+        "Returns the coefficient of variation in percentage"
+        if count < 2 or not total:
+            return None
+        variance = max(count * squares - total * total, 0) / (
+            count * (count - 1))
+        return math.sqrt(variance) * 100 / (total / count)
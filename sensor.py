@@ -0,0 +1,276 @@
+# The COPYRIGHT file at the top level of this repository contains the full
+# copyright notices and license terms.
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from sql import Window
+from sql.functions import CurrentTimestamp, RowNumber
+
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model import ModelSQL, ModelView, fields, Index, Unique
+from trytond.pool import Pool
+from trytond.rpc import RPC
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
+
+__all__ = ['SiloSensor', 'SiloSensorReading']
+
+logger = logging.getLogger(__name__)
+
+
+class SiloSensor(ModelSQL, ModelView):
+    '''
+    Silo Sensor
+
+    Load cell of a silo. Its readings are used to create provisional
+    inventories of the silo.
+    '''
+    __name__ = 'farm.silo.sensor'
+    _rec_name = 'code'
+
+    code = fields.Char('Code', required=True,
+        help='The identifier of the sensor in its readings.')
+    silo = fields.Many2One('stock.location', 'Silo', required=True,
+        domain=[
+            ('silo', '=', True),
+            ])
+    specie = fields.Many2One('farm.specie', 'Specie', required=True)
+    resolution = fields.Float('Resolution (Kg)', digits=(16, 2),
+        required=True, help='Readings that differ less than this from the '
+        'last stored reading are discarded.')
+    refill_threshold = fields.Float('Refill Threshold (Kg)', digits=(16, 2),
+        required=True, help='Minimum increase of the quantity of the silo '
+        'considered a refill.')
+    inventory_interval = fields.Integer('Inventory Interval (Days)',
+        required=True, help='Days between the provisional inventories '
+        'created from the readings.')
+    active = fields.Boolean('Active')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('code_uniq', Unique(t, t.code), 'farm.silo_sensor_code_unique'),
+            ]
+
+    @staticmethod
+    def default_specie():
+        return Transaction().context.get('specie')
+
+    @staticmethod
+    def default_resolution():
+        return 10.0
+
+    @staticmethod
+    def default_refill_threshold():
+        return 500.0
+
+    @staticmethod
+    def default_inventory_interval():
+        return 7
+
+    @staticmethod
+    def default_active():
+        return True
+
+    @classmethod
+    def create_inventories(cls):
+        '''
+        Creates and confirms the provisional inventories of the silos of the
+        active sensors with the quantities of their readings
+        '''
+        pool = Pool()
+        ProvisionalInventory = pool.get('farm.feed.provisional_inventory')
+        ModelData = pool.get('ir.model.data')
+
+        kg_id = ModelData.get_id('product', 'uom_kilogram')
+        for sensor in cls.search([]):
+            last = sensor._get_last_inventory_timestamp()
+            if not last:
+                continue
+            reading = sensor._get_inventory_reading(last)
+            while reading:
+                inventory = ProvisionalInventory(
+                    specie=sensor.specie,
+                    location=sensor.silo,
+                    dest_locations=sensor.silo.locations_to_fed,
+                    timestamp=reading.timestamp,
+                    uom=kg_id,
+                    quantity=Decimal(str(round(reading.quantity, 2))))
+                inventory.save()
+                try:
+                    ProvisionalInventory.confirm([inventory])
+                except UserError as exception:
+                    # Left in draft to be reviewed
+                    logger.warning('Provisional inventory "%s" of sensor '
+                        '"%s" not confirmed: %s', inventory.id, sensor.code,
+                        exception)
+                    break
+                reading = sensor._get_inventory_reading(reading.timestamp)
+
+    def _get_last_inventory_timestamp(self):
+        '''
+        Returns the timestamp of the last inventory of the silo or None if it
+        does not have a real inventory or its last provisional inventory is
+        still a draft to review.
+        '''
+        pool = Pool()
+        FeedInventory = pool.get('farm.feed.inventory')
+        ProvisionalInventory = pool.get('farm.feed.provisional_inventory')
+
+        inventories = FeedInventory.search([
+                ('location', '=', self.silo.id),
+                ('state', '=', 'validated'),
+                ], order=[('timestamp', 'DESC')], limit=1)
+        if not inventories:
+            return
+        timestamp = inventories[0].timestamp
+        provisionals = ProvisionalInventory.search([
+                ('location', '=', self.silo.id),
+                ('timestamp', '>', timestamp),
+                ('state', 'in', ['draft', 'validated']),
+                ], order=[('timestamp', 'DESC')], limit=1)
+        if provisionals:
+            if provisionals[0].state == 'draft':
+                return
+            timestamp = provisionals[0].timestamp
+        return timestamp
+
+    def _get_inventory_reading(self, last):
+        '''
+        Returns the reading for the next provisional inventory after the last
+        one at timestamp last.
+        It is the first reading once the inventory interval is elapsed or, if
+        it is earlier, the last reading of the day before the next refill. So
+        a backlog of readings gets an inventory for each interval.
+        '''
+        pool = Pool()
+        Reading = pool.get('farm.silo.sensor.reading')
+
+        next_day = datetime.combine(last.date() + timedelta(days=1), time.min)
+        readings = Reading.search([
+                ('sensor', '=', self.id),
+                ('timestamp', '>=', max(next_day,
+                        last + timedelta(days=self.inventory_interval))),
+                ], order=[('timestamp', 'ASC')], limit=1)
+        reading = readings[0] if readings else None
+        refills = Reading.search([
+                ('sensor', '=', self.id),
+                ('timestamp', '>', last),
+                ('refill', '=', True),
+                ], order=[('timestamp', 'ASC')], limit=1)
+        if refills:
+            readings = Reading.search([
+                    ('sensor', '=', self.id),
+                    ('timestamp', '>=', next_day),
+                    ('timestamp', '<', datetime.combine(
+                            refills[0].timestamp.date(), time.min)),
+                    ], order=[('timestamp', 'DESC')], limit=1)
+            if readings and (not reading
+                    or readings[0].timestamp < reading.timestamp):
+                return readings[0]
+        return reading
+
+
+class SiloSensorReading(ModelSQL, ModelView):
+    '''
+    Silo Sensor Reading
+
+    Quantity of the silo measured by a sensor. Only the readings that change
+    the quantity by at least the resolution of the sensor are stored.
+    '''
+    __name__ = 'farm.silo.sensor.reading'
+    _order = [('timestamp', 'DESC')]
+
+    sensor = fields.Many2One('farm.silo.sensor', 'Sensor', required=True,
+        readonly=True, ondelete='CASCADE')
+    timestamp = fields.DateTime('Date & Time', required=True, readonly=True)
+    quantity = fields.Float('Quantity (Kg)', digits=(16, 2), required=True,
+        readonly=True)
+    refill = fields.Boolean('Refill', readonly=True,
+        help='The quantity increased by at least the refill threshold.')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.sensor, Index.Equality()),
+                    (t.timestamp, Index.Range())),
+                Index(t,
+                    (t.sensor, Index.Equality()),
+                    (t.timestamp, Index.Range()),
+                    where=t.refill == True),
+                })
+        cls.__rpc__.update({
+                'ingest': RPC(readonly=False),
+                })
+
+    @classmethod
+    def ingest(cls, readings):
+        '''
+        Stores the readings given as tuples of (sensor code, timestamp,
+        kilograms). The readings within the resolution of the previous stored
+        reading of the sensor are discarded and the increases over the refill
+        threshold are flagged as refills. Returns the number of readings
+        stored.
+        '''
+        pool = Pool()
+        Sensor = pool.get('farm.silo.sensor')
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+
+        sensors = {}
+        for sub_codes in grouped_slice(list({r[0] for r in readings})):
+            sensors.update((s.code, s) for s in Sensor.search([
+                        ('code', 'in', list(sub_codes)),
+                        ]))
+        for code, _, _ in readings:
+            if code not in sensors:
+                raise UserError(gettext('farm.unknown_silo_sensor',
+                        sensor=code))
+        last = cls._get_last_quantities([s.id for s in sensors.values()])
+
+        values = []
+        for code, timestamp, quantity in sorted(readings,
+                key=lambda r: (r[0], r[1])):
+            sensor = sensors[code]
+            quantity = float(quantity)
+            previous = last.get(sensor.id)
+            refill = (previous is not None
+                and quantity - previous >= sensor.refill_threshold)
+            if (previous is not None and not refill
+                    and abs(quantity - previous) < sensor.resolution):
+                continue
+            values.append([transaction.user, CurrentTimestamp(), sensor.id,
+                    timestamp, quantity, refill])
+            last[sensor.id] = quantity
+
+        columns = [table.create_uid, table.create_date, table.sensor,
+            table.timestamp, table.quantity, table.refill]
+        for sub_values in grouped_slice(values):
+            cursor.execute(*table.insert(columns, list(sub_values)))
+        return len(values)
+
+    @classmethod
+    def _get_last_quantities(cls, sensor_ids):
+        "Returns the quantity of the last stored reading of each sensor"
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        rank = RowNumber(window=Window([table.sensor],
+                order_by=[table.timestamp.desc, table.id.desc]))
+        result = {}
+        for sub_ids in grouped_slice(sensor_ids):
+            query = table.select(table.sensor, table.quantity,
+                rank.as_('rank'),
+                where=reduce_ids(table.sensor, sub_ids))
+            cursor.execute(*query.select(query.sensor, query.quantity,
+                    where=query.rank == 1))
+            result.update(cursor)
+        return result
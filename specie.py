@@ -1,8 +1,13 @@
 # The COPYRIGHT file at the top level of this repository contains the full
 # copyright notices and license terms.
 import logging
+from collections import deque
+from datetime import date
 from operator import attrgetter
+from threading import Lock
 
+from trytond.cache import Cache
+from trytond.config import config
 from trytond.model import ModelView, ModelSQL, fields, Unique
 from trytond.pool import Pool, PoolMeta
 from trytond.pyson import PYSONDecoder, PYSONEncoder, Bool, Eval, Id, Not, Or
@@ -12,6 +17,10 @@ from trytond.i18n import gettext
 
 MODULE_NAME = 'farm'
 
+# Numbers reserved by this process by (database, sequence, day)
+_number_blocks = {}
+_number_blocks_lock = Lock()
+
 
 def _enabled_STATES(depending_fieldname):
     return {
@@ -99,6 +108,14 @@ class Specie(ModelSQL, ModelView):
     reclassification_products = fields.Many2Many(
         'farm.specie-product.product', 'specie', 'product',
         'Reclassification Products')
+    feed_move_aggregation = fields.Selection([
+            (None, 'Per Event'),
+            ('inventory', 'Per Inventory and Lot'),
+            ('day', 'Per Day and Lot'),
+            ], 'Feed Moves',
+        help='The stock moves of the feed and medication events validated '
+        'together are posted as one move per silo, lot and inventory or day. '
+        'Each event is allocated its quantity of the move.')
 
     @classmethod
     def __setup__(cls):
@@ -118,6 +135,20 @@ class Specie(ModelSQL, ModelView):
     def default_produced_animal_type():
         return 'group'
 
+    @classmethod
+    def write(cls, *args):
+        pool = Pool()
+        FarmLine = pool.get('farm.specie.farm_line')
+        super(Specie, cls).write(*args)
+        FarmLine._clear_caches()
+
+    @classmethod
+    def delete(cls, species):
+        pool = Pool()
+        FarmLine = pool.get('farm.specie.farm_line')
+        super(Specie, cls).delete(species)
+        FarmLine._clear_caches()
+
     @staticmethod
     def default_male_enabled():
         return True
@@ -617,6 +648,8 @@ class SpecieFarmLine(ModelSQL, ModelView):
             ],
         states=_enabled_STATES('has_group'),
         help='Sequence used for group production lots and animals.')
+    _farm_line_cache = Cache('farm.specie.farm_line.get_farm_line',
+        context=False)
 
     @classmethod
     def __setup__(cls):
@@ -627,6 +660,101 @@ class SpecieFarmLine(ModelSQL, ModelView):
                 'farm.specie_farm_unique'),
             ]
 
+    @classmethod
+    def get_farm_line(cls, specie_id, farm_id, animal_type=None):
+        """
+        Return the farm line of the specie in the farm, which must have
+        animals of animal_type if it is set, or None.
+        """
+        key = (specie_id, farm_id, animal_type)
+        line_id = cls._farm_line_cache.get(key, -1)
+        if line_id == -1:
+            domain = [
+                ('specie', '=', specie_id),
+                ('farm', '=', farm_id),
+                ]
+            if animal_type:
+                domain.append(('has_' + animal_type, '=', True))
+            lines = cls.search(domain, limit=1)
+            line_id = lines[0].id if lines else None
+            cls._farm_line_cache.set(key, line_id)
+        return cls(line_id) if line_id is not None else None
+
+    @classmethod
+    def _clear_caches(cls):
+        pool = Pool()
+        Location = pool.get('stock.location')
+        cls._farm_line_cache.clear()
+        Location._allowed_locations_cache.clear()
+
+    @classmethod
+    def create(cls, vlist):
+        cls._clear_caches()
+        return super(SpecieFarmLine, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        super(SpecieFarmLine, cls).write(*args)
+        cls._clear_caches()
+
+    @classmethod
+    def delete(cls, lines):
+        super(SpecieFarmLine, cls).delete(lines)
+        cls._clear_caches()
+
+    def get_numbers(self, sequence_fieldname, count=1):
+        """
+        Return a list of count numbers of the sequence in sequence_fieldname.
+        """
+        return self._get_numbers(getattr(self, sequence_fieldname), count)
+
+    @classmethod
+    def _get_numbers(cls, sequence, count):
+        """
+        Return a list of count numbers of the sequence.
+
+        If the sequence_block_size option of the farm section of the
+        configuration is greater than 1, numbers are reserved in blocks of
+        that size in their own transaction and handed out from memory by each
+        worker process, so the sequence row is not locked until the end of the
+        calling transaction. Each process has its own blocks, so the numbers
+        are not given in order among processes, and up to block size - 1
+        numbers by sequence and process are lost when the process stops or
+        the day changes. Strict sequences can not lose numbers, so they are
+        never reserved in blocks.
+        """
+        block_size = config.getint('farm', 'sequence_block_size', default=1)
+        if block_size <= 1 or sequence.__name__ == 'ir.sequence.strict':
+            return [sequence.get() for _ in range(count)]
+
+        today = date.today()
+        key = (Transaction().database.name, sequence.id, today)
+        with _number_blocks_lock:
+            for old_key in [k for k in _number_blocks if k[2] != today]:
+                del _number_blocks[old_key]
+            numbers = _number_blocks.setdefault(key, deque())
+            result = [numbers.popleft()
+                for _ in range(min(count, len(numbers)))]
+        missing = count - len(result)
+        if missing:
+            # The lock is not held during the reservation to not block the
+            # other threads of the process on the database
+            reserved = cls._reserve_numbers(sequence,
+                max(block_size, missing))
+            result.extend(reserved[:missing])
+            with _number_blocks_lock:
+                _number_blocks.setdefault(key, deque()).extend(
+                    reserved[missing:])
+        return result
+
+    @staticmethod
+    def _reserve_numbers(sequence, count):
+        with Transaction().new_transaction() as transaction:
+            sequence = sequence.__class__(sequence.id)
+            numbers = [sequence.get() for _ in range(count)]
+            transaction.commit()
+        return numbers
+
 
 class SpecieModel(ModelSQL):
     'Specie - Model'
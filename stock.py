@@ -1,14 +1,73 @@
 #The COPYRIGHT file at the top level of this repository contains the full
 #copyright notices and license terms.
 import datetime
+import operator
 from collections import defaultdict
 from decimal import Decimal
+from weakref import WeakKeyDictionary
 
-from trytond.model import ModelView, ModelSQL, fields, Workflow
+from trytond.cache import Cache
+from trytond.model import ModelView, ModelSQL, fields, Workflow, Index
 from trytond.pyson import Equal, Eval, Not
 from trytond.pool import Pool, PoolMeta
+from trytond.tools import grouped_slice, reduce_ids
 from trytond.transaction import Transaction
-from sql import Table
+from sql import Null, Table
+from sql.aggregate import Sum
+from sql.conditionals import Case
+from sql.functions import CurrentTimestamp
+
+# Lot quantities already computed by transaction, cleared when a move changes
+_quantity_memo = WeakKeyDictionary()
+_QUANTITY_CONTEXT_KEYS = ('locations', 'stock_date_start', 'stock_date_end',
+    'stock_assign', 'forecast', 'stock_skip_warehouse', 'stock_destinations',
+    'with_childs', 'company')
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def _quantity_key(*args):
+    context = Transaction().context
+    return _hashable(args) + tuple(
+        _hashable(context.get(k)) for k in _QUANTITY_CONTEXT_KEYS)
+
+
+def clear_quantity_memo():
+    '''
+    Forgets the lot quantities computed by the transaction. It must be called
+    by the code that changes the stock moves with SQL instead of the model.
+    '''
+    _quantity_memo.pop(Transaction(), None)
+
+
+_QUANTITY_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    }
+
+
+def _quantity_filter(quantity_domain):
+    '''
+    Returns a function that tells if a quantity matches quantity_domain or
+    None if the domain is not a simple condition on the quantity.
+    '''
+    if not quantity_domain:
+        return lambda quantity: True
+    if (len(quantity_domain) == 3 and quantity_domain[0] == 'quantity'
+            and quantity_domain[1] in _QUANTITY_OPERATORS):
+        _, op, value = quantity_domain
+        op = _QUANTITY_OPERATORS[op]
+        return lambda quantity: op(quantity, value)
 
 
 class Lot(metaclass=PoolMeta):
@@ -65,17 +124,69 @@ class Lot(metaclass=PoolMeta):
     def default_animal_type():
         return ''
 
-    def get_rec_name(self, name):
-        rec_name = super(Lot, self).get_rec_name(name)
-        if not self.animal_type:
-            return rec_name
-        if self.animal_type == 'group' and self.animal_group:
-            if not self.animal_group.active:
-                rec_name += " (*)"
-        elif self.animal:
-            if not self.animal.active:
-                rec_name += " (*)"
-        return rec_name
+    @classmethod
+    def get_rec_name(cls, lots, name):
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        AnimalGroup = pool.get('farm.animal.group')
+        LotGroup = pool.get('stock.lot-farm.animal.group')
+        cursor = Transaction().connection.cursor()
+        animal = Animal.__table__()
+        group = AnimalGroup.__table__()
+        lot_group = LotGroup.__table__()
+
+        names = {l.id: super(Lot, l).get_rec_name(name) for l in lots}
+        animal_lots = [l.id for l in lots if l.animal_type]
+        inactive = set()
+        for sub_ids in grouped_slice(animal_lots):
+            sub_ids = list(sub_ids)
+            cursor.execute(*animal.select(animal.lot,
+                    where=reduce_ids(animal.lot, sub_ids)
+                    & (animal.active == False)))
+            inactive.update(r for r, in cursor)
+            cursor.execute(*lot_group.join(group,
+                    condition=lot_group.animal_group == group.id
+                    ).select(lot_group.lot,
+                    where=reduce_ids(lot_group.lot, sub_ids)
+                    & (group.active == False)))
+            inactive.update(r for r, in cursor)
+        for lot_id in inactive:
+            names[lot_id] += " (*)"
+        return names
+
+    @classmethod
+    def get_quantity(cls, lots, name):
+        memo = _quantity_memo.setdefault(Transaction(), {})
+        key = _quantity_key('get_quantity', sorted(l.id for l in lots), name)
+        if key not in memo:
+            memo[key] = super(Lot, cls).get_quantity(lots, name)
+        return dict(memo[key])
+
+    @classmethod
+    def link_animals(cls, animal_by_lot):
+        '''
+        Set the animal of the lots given as a dictionary of animal ids by lot
+        id with a single UPDATE statement. It is intended for lots just
+        created with their animals, so no check is done.
+        '''
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        table = cls.__table__()
+        for sub_ids in grouped_slice(list(animal_by_lot)):
+            sub_ids = list(sub_ids)
+            cursor.execute(*table.update(
+                    columns=[table.animal, table.write_uid, table.write_date],
+                    values=[
+                        Case(*((table.id == l, animal_by_lot[l])
+                                for l in sub_ids)),
+                        transaction.user, CurrentTimestamp()],
+                    where=reduce_ids(table.id, sub_ids)))
+        # The lots read in the transaction must not keep their old animal
+        transaction.counter += 1
+        for cache in transaction.cache.values():
+            if cls.__name__ in cache:
+                for lot_id in animal_by_lot:
+                    cache[cls.__name__].pop(lot_id, None)
 
     @classmethod
     def quantity_by_location(cls, lots, location_ids, quantity_domain=None,
@@ -87,13 +198,51 @@ class Lot(metaclass=PoolMeta):
                 zone.
         location_ids is the list of IDs of locations to take account to compute
             the stock. It can't be empty.
+        The result is kept for the rest of the transaction until a stock move
+        is created, modified or deleted.
         """
+        if not location_ids:
+            return {}
+
+        memo = _quantity_memo.setdefault(Transaction(), {})
+        key = _quantity_key('quantity_by_location',
+            None if lots is None else sorted(l.id for l in lots),
+            sorted(location_ids), quantity_domain, with_childs)
+        if key not in memo:
+            memo[key] = cls._quantity_by_location(lots, location_ids,
+                quantity_domain=quantity_domain, with_childs=with_childs)
+        return {l: dict(q) for l, q in memo[key].items()}
+
+    @classmethod
+    def _quantity_by_location(cls, lots, location_ids, quantity_domain=None,
+            with_childs=False):
         pool = Pool()
         Location = pool.get('stock.location')
         Move = pool.get('stock.move')
-
-        if not location_ids:
-            return {}
+        Snapshot = pool.get('farm.stock.snapshot')
+
+        snapshot_date = Snapshot.get_snapshot_date(location_ids)
+        quantity_filter = _quantity_filter(quantity_domain)
+        if snapshot_date and quantity_filter:
+            # Only the moves done after the snapshot are summed
+            with Transaction().set_context(
+                    stock_date_start=(
+                        snapshot_date + datetime.timedelta(days=1))):
+                res = cls._quantity_by_location(lots, location_ids,
+                    with_childs=with_childs)
+            snapshot = Snapshot.get_quantities(snapshot_date, lots,
+                location_ids, with_childs=with_childs)
+            for lot_id, location_quantities in snapshot.items():
+                lot_quantities = res.setdefault(lot_id, {})
+                for location_id, quantity in location_quantities.items():
+                    lot_quantities[location_id] = (
+                        lot_quantities.get(location_id, 0.0) + quantity)
+            for lot_id in list(res):
+                res[lot_id] = {l: q for l, q in res[lot_id].items()
+                    if quantity_filter(q)}
+                if not res[lot_id]:
+                    del res[lot_id]
+            return res
 
         # Skip warehouse location in favor of their storage location
         # to compute quantities. Keep track of which ids to remove
@@ -181,6 +330,8 @@ class Location(metaclass=PoolMeta):
             },
         help='Indicates the locations the silo feeds. Note that this will '
         'only be a default value.')
+    _allowed_locations_cache = Cache('stock.location.allowed_locations',
+        context=False)
 
     @staticmethod
     def default_silo():
@@ -228,29 +379,16 @@ class Location(metaclass=PoolMeta):
     @classmethod
     def search(cls, args, offset=0, limit=None, order=None, count=False,
             query=False):
-        FarmLine = Pool().get('farm.specie.farm_line')
-
         args = args[:]
         context = Transaction().context
         if context.get('restrict_by_specie_animal_type'):
-            domain = []
-            specie = context.get('specie')
-            if specie:
-                domain += ('specie', '=', specie),
-            animal_type = context.get('animal_type')
-            if animal_type:
-                domain += ('has_' + animal_type, '=', True),
-            farm_lines = FarmLine.search(domain)
-            if not farm_lines:
+            location_ids = cls.get_allowed_locations(context.get('specie'),
+                context.get('animal_type'))
+            if location_ids is None:
                 return []
-            storage_locations = [fl.farm.storage_location.id
-                for fl in farm_lines]
-            #args.append(('parent', 'child_of', storage_locations))
             args += [[
                 'OR', [
-                        ('parent', 'child_of', storage_locations),
-                        ], [
-                        ('id', 'in', [fl.farm.id for fl in farm_lines]),
+                        ('id', 'in', location_ids),
                         ], [
                         ('type', 'not in', ['warehouse', 'storage']),
                         ]
@@ -259,6 +397,60 @@ class Location(metaclass=PoolMeta):
             order=order, count=count, query=query)
         return res
 
+    @classmethod
+    def get_allowed_locations(cls, specie_id, animal_type):
+        """
+        Return the ids of the farms with animals of the specie and type and
+        of the locations under their storage location, or None if there is
+        no such farm.
+        """
+        pool = Pool()
+        FarmLine = pool.get('farm.specie.farm_line')
+
+        key = (specie_id, animal_type)
+        location_ids = cls._allowed_locations_cache.get(key, -1)
+        if location_ids != -1:
+            return location_ids
+
+        domain = []
+        if specie_id:
+            domain.append(('specie', '=', specie_id))
+        if animal_type:
+            domain.append(('has_' + animal_type, '=', True))
+        farm_lines = FarmLine.search(domain)
+        if not farm_lines:
+            location_ids = None
+        else:
+            storage_locations = [fl.farm.storage_location.id
+                for fl in farm_lines]
+            # The cached ids are shared by all users, the caller search
+            # applies the access rules and the active filter
+            with Transaction().set_context(
+                    restrict_by_specie_animal_type=False,
+                    active_test=False, _check_access=False):
+                location_ids = [l.id for l in cls.search([
+                            ('parent', 'child_of', storage_locations),
+                            ])]
+            location_ids = sorted(set(location_ids)
+                | {fl.farm.id for fl in farm_lines})
+        cls._allowed_locations_cache.set(key, location_ids)
+        return location_ids
+
+    @classmethod
+    def create(cls, vlist):
+        cls._allowed_locations_cache.clear()
+        return super(Location, cls).create(vlist)
+
+    @classmethod
+    def write(cls, *args):
+        super(Location, cls).write(*args)
+        cls._allowed_locations_cache.clear()
+
+    @classmethod
+    def delete(cls, locations):
+        super(Location, cls).delete(locations)
+        cls._allowed_locations_cache.clear()
+
     def get_lot_fifo(self, stock_date=None, to_uom=None):
         '''
         Only for 'silo' locations, it returns the list of tuples of lots in
@@ -369,6 +561,50 @@ class LocationSiloLocation(ModelSQL):
 class Move(metaclass=PoolMeta):
     __name__ = 'stock.move'
 
+    @classmethod
+    def __setup__(cls):
+        super(Move, cls).__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.lot, Index.Equality()),
+                (t.to_location, Index.Equality()),
+                (t.effective_date, Index.Range()),
+                where=t.lot != Null))
+
+    @classmethod
+    def create(cls, vlist):
+        moves = super(Move, cls).create(vlist)
+        clear_quantity_memo()
+        cls._invalidate_snapshots(moves)
+        return moves
+
+    @classmethod
+    def write(cls, *args):
+        moves = []
+        for records in args[::2]:
+            moves.extend(records)
+        cls._invalidate_snapshots(moves)
+        super(Move, cls).write(*args)
+        clear_quantity_memo()
+        cls._invalidate_snapshots(cls.browse(moves))
+
+    @classmethod
+    def delete(cls, moves):
+        cls._invalidate_snapshots(moves)
+        super(Move, cls).delete(moves)
+        clear_quantity_memo()
+
+    @classmethod
+    def _invalidate_snapshots(cls, moves):
+        "Removes the stock snapshots that include any of the done moves"
+        Snapshot = Pool().get('farm.stock.snapshot')
+        dates = [m.effective_date or m.planned_date for m in moves
+            if m.state == 'done']
+        dates = [d for d in dates if d]
+        if dates:
+            Snapshot.invalidate(min(dates))
+
     @classmethod
     def _get_origin(cls):
         models = super(Move, cls)._get_origin()
@@ -379,6 +615,8 @@ class Move(metaclass=PoolMeta):
             'farm.transformation.event',
             'farm.removal.event',
             'farm.feed.event',
+            'farm.feed.inventory',
+            'farm.feed.provisional_inventory',
             'farm.medication.event',
             'farm.semen_extraction.event',
             'farm.insemination.event',
@@ -393,11 +631,214 @@ class Move(metaclass=PoolMeta):
     @ModelView.button
     @Workflow.transition('done')
     def do(cls, moves):
+        pool = Pool()
+        Animal = pool.get('farm.animal')
+        Census = pool.get('farm.census')
         res = super(Move, cls).do(moves)
+        clear_quantity_memo()
+        Census.add_moves(moves)
+        to_write = defaultdict(list)
         for move in moves:
             if (not move.lot or not move.lot.animal_type or
                     move.lot.animal_type == 'group'):
                 continue
-            move.lot.animal.location = move.to_location.id
-            move.lot.animal.save()
+            to_write[move.to_location.id].append(move.lot.animal)
+        args = []
+        for location_id, animals in to_write.items():
+            args.extend((animals, {'location': location_id}))
+        if args:
+            Animal.write(*args)
+        return res
+
+    @classmethod
+    @ModelView.button
+    @Workflow.transition('cancelled')
+    def cancel(cls, moves):
+        Census = Pool().get('farm.census')
+        Census.remove_moves(moves)
+        super(Move, cls).cancel(moves)
+
+
+class StockSnapshot(ModelSQL):
+    """
+    Farm Stock Snapshot
+
+    Quantity of each lot in each internal location at the end of a date. The
+    quantity of lots at a later date is computed from the nearest snapshot
+    adding only the moves done after it.
+    """
+    __name__ = 'farm.stock.snapshot'
+
+    date = fields.Date('Date', required=True, readonly=True)
+    location = fields.Many2One('stock.location', 'Location', required=True,
+        readonly=True, ondelete='CASCADE')
+    lot = fields.Many2One('stock.lot', 'Lot', required=True, readonly=True,
+        ondelete='CASCADE')
+    quantity = fields.Float('Quantity', required=True, readonly=True)
+    _dates_cache = Cache('farm.stock.snapshot.dates', context=False)
+    _location_types = ['warehouse', 'storage', 'view', 'lost_found']
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.date, Index.Range()),
+                (t.lot, Index.Equality()),
+                (t.location, Index.Equality())))
+
+    @classmethod
+    def get_dates(cls):
+        "Returns the sorted list of dates with snapshot"
+        dates = cls._dates_cache.get(None)
+        if dates is not None:
+            return dates
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        cursor.execute(*table.select(table.date,
+                group_by=[table.date], order_by=[table.date.asc]))
+        dates = [d for d, in cursor]
+        cls._dates_cache.set(None, dates)
+        return dates
+
+    @classmethod
+    def get_snapshot_date(cls, location_ids):
+        """
+        Returns the date of the snapshot from which the quantities of the
+        locations can be computed in the current context or None
+        """
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Location = pool.get('stock.location')
+        context = Transaction().context
+        if (context.get('stock_date_start')
+                or context.get('forecast')
+                or context.get('stock_assign')
+                or context.get('stock_skip_warehouse')):
+            return
+        date_end = min(context.get('stock_date_end') or datetime.date.max,
+            Date.today())
+        dates = [d for d in cls.get_dates() if d <= date_end]
+        if not dates:
+            return
+        with Transaction().set_context(_check_access=False):
+            locations = Location.browse(list(location_ids))
+            if any(l.type not in cls._location_types for l in locations):
+                return
+        return dates[-1]
+
+    @classmethod
+    def get_quantities(cls, date, lots, location_ids, with_childs=False):
+        """
+        Returns the quantities of the snapshot of the date as a dictionary of
+        quantities by location id by lot id. If with_childs is set, the
+        quantities of the child locations are added to their parents.
+        """
+        pool = Pool()
+        Location = pool.get('stock.location')
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+
+        where = table.date == date
+        if lots is not None:
+            if not lots:
+                return {}
+            where &= reduce_ids(table.lot, [l.id for l in lots])
+        res = {}
+        for sub_ids in grouped_slice(location_ids):
+            if with_childs:
+                location = Location.__table__()
+                parent = Location.__table__()
+                query = table.join(location,
+                    condition=table.location == location.id
+                    ).join(parent,
+                    condition=(location.left >= parent.left)
+                    & (location.right <= parent.right)
+                    ).select(parent.id, table.lot, Sum(table.quantity),
+                    where=where & reduce_ids(parent.id, sub_ids),
+                    group_by=[parent.id, table.lot])
+            else:
+                query = table.select(table.location, table.lot,
+                    table.quantity,
+                    where=where & reduce_ids(table.location, sub_ids))
+            cursor.execute(*query)
+            for location_id, lot_id, quantity in cursor:
+                res.setdefault(lot_id, {})[location_id] = quantity
         return res
+
+    @classmethod
+    def take(cls, date):
+        "Stores the quantities of all lots in internal locations at date"
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+
+        with Transaction().set_context(_check_access=False,
+                active_test=False):
+            locations = Location.search([
+                    ('type', 'in', cls._location_types),
+                    ])
+        if not locations:
+            return
+        with Transaction().set_context(stock_date_end=date):
+            quantities = Lot._quantity_by_location(None,
+                [l.id for l in locations])
+        cls.delete(cls.search([('date', '=', date)]))
+        to_create = []
+        for lot_id, location_quantities in quantities.items():
+            for location_id, quantity in location_quantities.items():
+                if quantity:
+                    to_create.append({
+                            'date': date,
+                            'location': location_id,
+                            'lot': lot_id,
+                            'quantity': quantity,
+                            })
+        cls.create(to_create)
+
+    @staticmethod
+    def _month_end(date):
+        return ((date.replace(day=28) + datetime.timedelta(days=4)).replace(
+                day=1) - datetime.timedelta(days=1))
+
+    @classmethod
+    def roll_forward(cls):
+        '''
+        Takes the snapshots of the end of the months after the last snapshot
+        up to the previous month, so the snapshots removed by a move are taken
+        again. Each snapshot is computed from the one before.
+        '''
+        Date = Pool().get('ir.date')
+        today = Date.today()
+        end = today.replace(day=1) - datetime.timedelta(days=1)
+        dates = cls.get_dates()
+        if dates:
+            date = cls._month_end(dates[-1] + datetime.timedelta(days=1))
+        else:
+            date = end
+        while date <= end:
+            cls.take(date)
+            date = cls._month_end(date + datetime.timedelta(days=1))
+
+    @classmethod
+    def invalidate(cls, date):
+        "Removes the snapshots that would change by a move done on date"
+        dates = cls.get_dates()
+        if not dates or date > dates[-1]:
+            return
+        cursor = Transaction().connection.cursor()
+        table = cls.__table__()
+        cursor.execute(*table.delete(where=table.date >= date))
+        cls._dates_cache.clear()
+
+    @classmethod
+    def create(cls, vlist):
+        records = super().create(vlist)
+        cls._dates_cache.clear()
+        return records
+
+    @classmethod
+    def delete(cls, records):
+        super().delete(records)
+        cls._dates_cache.clear()
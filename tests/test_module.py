@@ -2,9 +2,26 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
 
+import csv
+import datetime
+import re
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+
 from trytond import backend
+from trytond.config import config
+from trytond.exceptions import UserError
+from trytond.pool import Pool
 from trytond.tests.test_tryton import ModuleTestCase, with_transaction
-from trytond.modules.company.tests import CompanyTestMixin
+from trytond.transaction import Transaction
+from trytond.modules.company.tests import (CompanyTestMixin, create_company,
+    set_company)
+from trytond.modules.farm import export
+from trytond.modules.farm.partition import (is_partitioned, partition_table,
+    split_default_partition, unpartition_table)
+from trytond.modules.farm.stock import _quantity_memo, clear_quantity_memo
 
 
 class FarmTestCase(CompanyTestMixin, ModuleTestCase):
@@ -23,5 +40,441 @@ class FarmTestCase(CompanyTestMixin, ModuleTestCase):
             return
         super().test_ir_action_window()
 
+    def _get_index_names(self, table, columns):
+        "Return the names of the indexes of the table on exactly the columns"
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT indexname, indexdef FROM pg_indexes '
+            'WHERE tablename = %s', (table,))
+        names = []
+        for name, definition in cursor.fetchall():
+            match = re.search(r'USING \w+ \((.*?)\)(?: WHERE |$)',
+                definition)
+            if not match:
+                continue
+            index_columns = [c.split()[0].strip('"')
+                for c in match.group(1).split(',')]
+            if index_columns == list(columns):
+                names.append(name)
+        return names
+
+    def assertIndexScan(self, query, table, *indexes):
+        """
+        Assert the plan of the query uses one of the indexes of the table,
+        given as the list of their columns, and doesn't scan the whole table
+        """
+        names = [n for columns in indexes
+            for n in self._get_index_names(table, columns)]
+        self.assertTrue(names, 'No index on %s of %s' % (indexes, table))
+        cursor = Transaction().connection.cursor()
+        cursor.execute('EXPLAIN ' + str(query), query.params)
+        plan = '\n'.join(r[0] for r in cursor.fetchall())
+        self.assertTrue(any(n in plan for n in names),
+            'None of %s used in:\n%s' % (names, plan))
+        self.assertNotIn('Seq Scan', plan)
+
+    @unittest.skipIf(backend.name != 'postgresql',
+        'the plans are checked on PostgreSQL')
+    @with_transaction()
+    def test_index_scans(self):
+        "Test the most frequent filters use the declared indexes"
+        pool = Pool()
+        FeedEvent = pool.get('farm.feed.event')
+        FemaleCycle = pool.get('farm.animal.female_cycle')
+        Move = pool.get('stock.move')
+        FeedInventoryLocation = pool.get('farm.feed.inventory-stock.location')
+        cursor = Transaction().connection.cursor()
+        # Tables are empty on a new database so the planner must be forced
+        # to choose between the indexes
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        now = datetime.datetime.now()
+
+        event = FeedEvent.__table__()
+        self.assertIndexScan(event.select(event.id,
+                where=(event.animal_group == 1)
+                & (event.state == 'validated')
+                & (event.timestamp <= now)),
+            FeedEvent._table, ('animal_group', 'state', 'timestamp'))
+        self.assertIndexScan(event.select(event.id,
+                where=(event.animal == 1) & (event.state == 'validated'),
+                order_by=event.timestamp.desc, limit=1),
+            FeedEvent._table, ('animal', 'state', 'timestamp'))
+        self.assertIndexScan(event.select(event.id,
+                where=(event.animal_type == 'group')
+                & (event.state == 'validated')
+                & (event.timestamp >= now)),
+            FeedEvent._table, ('animal_type', 'state', 'timestamp'))
+        self.assertIndexScan(event.select(event.id,
+                where=(event.farm == 1) & (event.specie == 1)
+                & (event.timestamp > now),
+                order_by=[event.timestamp.asc, event.id.desc], limit=10),
+            FeedEvent._table, ('farm', 'specie', 'timestamp', 'id'))
+
+        cycle = FemaleCycle.__table__()
+        self.assertIndexScan(cycle.select(cycle.id,
+                where=cycle.animal == 1,
+                order_by=cycle.sequence.desc, limit=1),
+            FemaleCycle._table, ('animal', 'sequence'))
+
+        move = Move.__table__()
+        self.assertIndexScan(move.select(move.id,
+                where=(move.lot == 1) & (move.to_location == 1)
+                & (move.effective_date <= now.date())),
+            Move._table, ('lot', 'to_location', 'effective_date'))
+
+        inventory_location = FeedInventoryLocation.__table__()
+        self.assertIndexScan(inventory_location.select(
+                inventory_location.location,
+                where=inventory_location.inventory == 'farm.feed.inventory,1'),
+            FeedInventoryLocation._table, ('inventory',))
+
+    @unittest.skipIf(backend.name == 'sqlite',
+        'the blocks are committed in their own transaction')
+    @with_transaction()
+    def test_sequence_number_blocks(self):
+        "Test the numbers of a sequence are reserved in blocks"
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        SequenceStrict = pool.get('ir.sequence.strict')
+        FarmLine = pool.get('farm.specie.farm_line')
+        ModelData = pool.get('ir.model.data')
+
+        sequence_type = ModelData.get_id('farm', 'sequence_type_animal')
+        with Transaction().new_transaction() as transaction:
+            sequence, = Sequence.create([{
+                        'name': 'Blocks',
+                        'sequence_type': sequence_type,
+                        }])
+            strict_sequence, = SequenceStrict.create([{
+                        'name': 'Strict Blocks',
+                        'sequence_type': sequence_type,
+                        }])
+            transaction.commit()
+        sequence = Sequence(sequence.id)
+        strict_sequence = SequenceStrict(strict_sequence.id)
+
+        if not config.has_section('farm'):
+            config.add_section('farm')
+        config.set('farm', 'sequence_block_size', '3')
+        try:
+            self.assertEqual(FarmLine._get_numbers(sequence, 2), ['1', '2'])
+            self.assertEqual(FarmLine._get_numbers(sequence, 2), ['3', '4'])
+            self.assertEqual(FarmLine._get_numbers(sequence, 4),
+                ['5', '6', '7', '8'])
+            # The last block is reserved up to 9 and 10 is the next number
+            self.assertEqual(sequence.get(), '10')
+
+            self.assertEqual(FarmLine._get_numbers(strict_sequence, 2),
+                ['1', '2'])
+            self.assertEqual(strict_sequence.get(), '3')
+        finally:
+            config.remove_option('farm', 'sequence_block_size')
+
+    def _get_partition_rows(self, table):
+        "Return the number of rows of each partition of the table"
+        cursor = Transaction().connection.cursor()
+        cursor.execute('SELECT c.relname FROM pg_inherits AS i '
+            'JOIN pg_class AS c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)', (table,))
+        rows = {}
+        for name, in cursor.fetchall():
+            cursor.execute('SELECT COUNT(*) FROM "%s"' % name)
+            rows[name], = cursor.fetchone()
+        return rows
+
+    @unittest.skipIf(backend.name != 'postgresql',
+        'the tables are partitioned on PostgreSQL')
+    @with_transaction()
+    def test_partitions(self):
+        "Test the tables are partitioned and the back-dated rows are moved"
+        cursor = Transaction().connection.cursor()
+        table = 'farm_partition_test'
+        now = datetime.datetime.now()
+        month = '%s__p%s' % (table, now.strftime('%Y_%m'))
+        back_dated = datetime.datetime(now.year - 3, 6, 15)
+
+        cursor.execute('CREATE TABLE "%s" (id SERIAL PRIMARY KEY, '
+            '"timestamp" TIMESTAMP NOT NULL)' % table)
+        cursor.execute('INSERT INTO "%s" ("timestamp") VALUES (%%s), (%%s)'
+            % table, (now - datetime.timedelta(days=400), now))
+        self.assertTrue(partition_table(table, 'timestamp', 'month'))
+        self.assertTrue(is_partitioned(table))
+        rows = self._get_partition_rows(table)
+        self.assertEqual(rows[month], 1)
+        self.assertEqual(rows['%s__default' % table], 0)
+        self.assertEqual(sum(rows.values()), 2)
+
+        # Back-dated rows go to the default partition until they are moved
+        cursor.execute('INSERT INTO "%s" ("timestamp") VALUES (%%s)' % table,
+            (back_dated,))
+        self.assertEqual(
+            self._get_partition_rows(table)['%s__default' % table], 1)
+        split_default_partition(table, 'timestamp', 'month')
+        rows = self._get_partition_rows(table)
+        self.assertEqual(rows['%s__default' % table], 0)
+        self.assertEqual(
+            rows['%s__p%s' % (table, back_dated.strftime('%Y_%m'))], 1)
+
+        # Referenced tables are converted back
+        self.assertTrue(partition_table(table, 'timestamp', 'month',
+                referenced=True))
+        self.assertFalse(is_partitioned(table))
+        cursor.execute('INSERT INTO "%s" ("timestamp") VALUES (%%s) '
+            'RETURNING id' % table, (now,))
+        new_id, = cursor.fetchone()
+        self.assertEqual(new_id, 4)
+        cursor.execute('SELECT COUNT(*) FROM "%s"' % table)
+        self.assertEqual(cursor.fetchone(), (4,))
+
+    @unittest.skipIf(backend.name != 'postgresql',
+        'the tables are partitioned on PostgreSQL')
+    @with_transaction()
+    def test_create_event_partitions(self):
+        "Test the scheduled task creates the partitions of the event tables"
+        pool = Pool()
+        FeedEvent = pool.get('farm.feed.event')
+        EventJournal = pool.get('farm.animal.cycle.events')
+        table = FeedEvent._table
+
+        self.assertFalse(FeedEvent._is_referenced())
+        self.assertTrue(partition_table(table, 'timestamp', 'month'))
+        if not config.has_section('farm'):
+            config.add_section('farm')
+        config.set('farm', 'partition', 'month')
+        config.set('farm', 'partition_ahead', '5')
+        try:
+            EventJournal.create_event_partitions()
+        finally:
+            config.remove_option('farm', 'partition')
+            config.remove_option('farm', 'partition_ahead')
+        # The default partition, the current month and the 5 next ones
+        self.assertEqual(len(self._get_partition_rows(table)), 7)
+        unpartition_table(table)
+        self.assertFalse(is_partitioned(table))
+
+    @with_transaction()
+    def test_model_cache_invalidation(self):
+        "Test writing ir.model clears the documents of quality templates"
+        pool = Pool()
+        IrModel = pool.get('ir.model')
+        QualityTemplate = pool.get('quality.template')
+
+        self.assertEqual(QualityTemplate.get_model(), [('', '')])
+        QualityTemplate._get_model_cache.set(None, [('', ''), ('old', 'Old')])
+        self.assertEqual(QualityTemplate.get_model(),
+            [('', ''), ('old', 'Old')])
+        IrModel.write(IrModel.search([], limit=1), {})
+        self.assertEqual(QualityTemplate.get_model(), [('', '')])
+
+    def _create_stock_lot(self, company):
+        "Return a lot of a new product and a function to move it to storage"
+        pool = Pool()
+        Location = pool.get('stock.location')
+        Lot = pool.get('stock.lot')
+        Move = pool.get('stock.move')
+        Product = pool.get('product.product')
+        Template = pool.get('product.template')
+        Uom = pool.get('product.uom')
+
+        unit, = Uom.search([('name', '=', 'Unit')])
+        supplier, = Location.search([('code', '=', 'SUP')])
+        storage, = Location.search([('code', '=', 'STO')])
+        template, = Template.create([{
+                    'name': 'Product',
+                    'type': 'goods',
+                    'default_uom': unit.id,
+                    }])
+        product, = Product.create([{'template': template.id}])
+        lot, = Lot.create([{'number': '1', 'product': product.id}])
+
+        def create_move(quantity, date=None):
+            move, = Move.create([{
+                        'product': product.id,
+                        'lot': lot.id,
+                        'unit': unit.id,
+                        'quantity': quantity,
+                        'from_location': supplier.id,
+                        'to_location': storage.id,
+                        'company': company.id,
+                        'unit_price': Decimal('1'),
+                        'currency': company.currency.id,
+                        'effective_date': date or datetime.date.today(),
+                        }])
+            return move
+        return lot, storage, create_move
+
+    @with_transaction()
+    def test_quantity_memo(self):
+        "Test the lot quantities are forgotten when a stock move changes"
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        Move = pool.get('stock.move')
+        transaction = Transaction()
+
+        company = create_company()
+        with set_company(company):
+            lot, storage, create_move = self._create_stock_lot(company)
+
+            def quantity():
+                return Lot.quantity_by_location([lot], [storage.id]).get(
+                    lot.id, {}).get(storage.id, 0)
+
+            move1 = create_move(10)
+            Move.do([move1])
+            self.assertEqual(quantity(), 10)
+            self.assertIn(transaction, _quantity_memo)
+
+            move2 = create_move(5)
+            self.assertNotIn(transaction, _quantity_memo)
+            self.assertEqual(quantity(), 10)
+
+            # The moves can be given as a tuple
+            Move.write((move2,), {'quantity': 6})
+            self.assertNotIn(transaction, _quantity_memo)
+            self.assertEqual(quantity(), 10)
+
+            Move.do([move2])
+            self.assertNotIn(transaction, _quantity_memo)
+            self.assertEqual(quantity(), 16)
+
+            # Updates with SQL keep the quantities until the memo is cleared
+            move = Move.__table__()
+            cursor = transaction.connection.cursor()
+            cursor.execute(*move.update(
+                    [move.quantity, move.internal_quantity], [8, 8],
+                    where=move.id == move2.id))
+            self.assertEqual(quantity(), 16)
+            clear_quantity_memo()
+            self.assertEqual(quantity(), 18)
+
+    @with_transaction()
+    def test_stock_snapshots(self):
+        "Test the quantities from a snapshot match the ones of all the moves"
+        pool = Pool()
+        Lot = pool.get('stock.lot')
+        Move = pool.get('stock.move')
+        Snapshot = pool.get('farm.stock.snapshot')
+
+        today = datetime.date.today()
+        last_month = today.replace(day=1) - datetime.timedelta(days=1)
+        previous_month = (last_month.replace(day=1)
+            - datetime.timedelta(days=1))
+
+        company = create_company()
+        with set_company(company):
+            lot, storage, create_move = self._create_stock_lot(company)
+
+            def quantities(date=None):
+                "Return the quantity from the snapshot and from all moves"
+                with Transaction().set_context(stock_date_end=date):
+                    quantity = Lot.quantity_by_location([lot], [storage.id])
+                    # Snapshots are not used skipping the warehouses
+                    with Transaction().set_context(
+                            stock_skip_warehouse=True):
+                        full = Lot.quantity_by_location([lot], [storage.id])
+                return (quantity.get(lot.id, {}).get(storage.id, 0),
+                    full.get(lot.id, {}).get(storage.id, 0))
+
+            Move.do([create_move(10, previous_month)])
+            Move.do([create_move(3, last_month)])
+            Move.do([create_move(4)])
+
+            Snapshot.take(previous_month)
+            Snapshot.roll_forward()
+            self.assertEqual(Snapshot.get_dates(),
+                [previous_month, last_month])
+            self.assertEqual(
+                Snapshot.get_quantities(last_month, [lot], [storage.id]),
+                {lot.id: {storage.id: 13}})
+            self.assertEqual(quantities(), (17, 17))
+            self.assertEqual(quantities(previous_month), (10, 10))
+
+            # A move done on the date of a snapshot removes it and the task
+            # takes it again
+            Move.do([create_move(2, last_month)])
+            self.assertEqual(Snapshot.get_dates(), [previous_month])
+            self.assertEqual(quantities(), (19, 19))
+            Snapshot.roll_forward()
+            self.assertEqual(Snapshot.get_dates(),
+                [previous_month, last_month])
+            self.assertEqual(
+                Snapshot.get_quantities(last_month, [lot], [storage.id]),
+                {lot.id: {storage.id: 15}})
+            self.assertEqual(quantities(), (19, 19))
+            self.assertEqual(quantities(last_month), (15, 15))
+
+    @with_transaction()
+    def test_event_export(self):
+        "Test the exports only write the events changed since the previous one"
+        pool = Pool()
+        EventExport = pool.get('farm.event.export')
+        Journal = pool.get('farm.animal.cycle.events')
+        model = Journal.__name__
+        table = Journal.__table__()
+        cursor = Transaction().connection.cursor()
+        now = datetime.datetime.now()
+
+        def create_lines(*event_ids):
+            return Journal.create([{
+                        'event_type': 'farm.insemination.event',
+                        'event_id': i,
+                        'timestamp': now,
+                        } for i in event_ids])
+
+        def run(full=False):
+            "Export the journal and return the event ids of each file"
+            paths = EventExport.export('test', [model], full)
+            ids = []
+            for path in paths:
+                self.assertTrue(path.endswith('.csv'))
+                with open(path, newline='') as file:
+                    ids.append([int(r['event_id'])
+                            for r in csv.DictReader(file)])
+            return ids
+
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.object(export, 'pyarrow', None):
+            if not config.has_section('farm'):
+                config.add_section('farm')
+            config.set('farm', 'export_directory', directory)
+            config.set('farm', 'export_batch_size', '2')
+            try:
+                create_lines(1, 2, 3)
+                # Without pyarrow each batch is written to a CSV file
+                self.assertEqual(run(), [[1, 2], [3]])
+                export_, = EventExport.search([
+                        ('target', '=', 'test'),
+                        ('model', '=', model),
+                        ])
+                self.assertEqual(export_.last_id,
+                    max(l.id for l in Journal.search([])))
+
+                # Nothing changed
+                self.assertEqual(run(), [])
+
+                # Lines modified at the watermark are exported by their id
+                line4, = create_lines(4)
+                cursor.execute(*table.update([table.create_date],
+                        [export_.watermark], where=table.id == line4.id))
+                self.assertEqual(run(), [[4]])
+
+                # Modified lines are exported again
+                line1, = Journal.search([('event_id', '=', 1)])
+                Journal.write([line1], {'state': 'validated'})
+                cursor.execute(*table.update([table.write_date],
+                        [now + datetime.timedelta(minutes=1)],
+                        where=table.id == line1.id))
+                self.assertEqual(run(), [[1]])
+                self.assertEqual(run(), [])
+
+                # A full export writes all the lines
+                self.assertEqual(sorted(sum(run(full=True), [])),
+                    [1, 2, 3, 4])
+
+                # Only the events and their journal can be exported
+                with self.assertRaises(UserError):
+                    EventExport.export('test', ['res.user'])
+            finally:
+                config.remove_option('farm', 'export_directory')
+                config.remove_option('farm', 'export_batch_size')
 
 del ModuleTestCase
@@ -0,0 +1,69 @@
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, products = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Create a location outside the farm
+        outside = Location(name='Outside', type='storage')
+        outside.save()
+
+        def allowed_locations():
+            with config.set_context(restrict_by_specie_animal_type=True,
+                    specie=specie.id, animal_type='male'):
+                return Location.find([('type', '=', 'storage')])
+
+        # The locations of the farm with males are allowed
+        locations = allowed_locations()
+        self.assertIn(warehouse.storage_location, locations)
+        self.assertNotIn(outside, locations)
+
+        # Moving the location into the farm allows it
+        outside.parent = warehouse.storage_location
+        outside.save()
+        self.assertIn(outside, allowed_locations())
+
+        # Moving it out of the farm refuses it again
+        outside.parent = None
+        outside.save()
+        self.assertNotIn(outside, allowed_locations())
+
+        # New locations of the farm are allowed
+        pen = Location(name='Pen', type='storage',
+            parent=warehouse.storage_location)
+        pen.save()
+        self.assertIn(pen, allowed_locations())
+
+        # Locations of a farm without males are refused
+        farm_line, = specie.farm_lines
+        farm_line.has_male = False
+        farm_line.save()
+        self.assertEqual(allowed_locations(), [])
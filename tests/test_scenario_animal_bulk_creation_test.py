@@ -0,0 +1,106 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, products = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+        location1 = Location()
+        location1.name = 'Location 1'
+        location1.type = 'storage'
+        location1.parent = warehouse.storage_location
+        location1.save()
+        location2 = Location()
+        location2.name = 'Location 2'
+        location2.type = 'storage'
+        location2.parent = warehouse.storage_location
+        location2.save()
+
+        # Create individuals in two locations with a single call
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'individual'
+        Animal = Model.get('farm.animal')
+        today = datetime.date.today()
+        animal_ids = Animal.create([{
+                    'type': 'individual',
+                    'specie': specie.id,
+                    'breed': breed.id,
+                    'arrival_date': today,
+                    'initial_location': location.id,
+                    } for location in [location1, location1, location2]],
+            config.context)
+        animals = [Animal(i) for i in animal_ids]
+
+        # Check each animal has its own number and lot linked back to it
+        numbers = [a.number for a in animals]
+        self.assertEqual(len(set(numbers)), 3)
+        self.assertEqual(all(numbers), True)
+        for animal, location in zip(animals,
+                [location1, location1, location2]):
+            self.assertEqual(animal.lot.number, animal.number)
+            self.assertEqual(animal.lot.animal, animal)
+            self.assertEqual(animal.location, location)
+
+        # Create groups with a single call
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group_ids = AnimalGroup.create([{
+                    'specie': specie.id,
+                    'breed': breed.id,
+                    'arrival_date': today,
+                    'initial_location': location.id,
+                    'initial_quantity': quantity,
+                    } for location, quantity in [
+                    (location1, 10), (location2, 20)]], config.context)
+        groups = [AnimalGroup(i) for i in group_ids]
+        numbers = [g.number for g in groups]
+        self.assertEqual(len(set(numbers)), 2)
+        for group, location, quantity in zip(groups,
+                [location1, location2], [10, 20]):
+            self.assertEqual(group.lot.number, group.number)
+            self.assertEqual(group.lot.animal_type, 'group')
+            with config.set_context(locations=[location.id]):
+                self.assertEqual(AnimalGroup(group.id).quantity, quantity)
+
+        # Females with the number of an active female of the farm are refused
+        config._context['animal_type'] = 'female'
+        female_values = {
+            'type': 'female',
+            'specie': specie.id,
+            'breed': breed.id,
+            'arrival_date': today,
+            'initial_location': location1.id,
+            }
+        Animal.create([dict(female_values, number='F1')], config.context)
+        with self.assertRaises(Exception):
+            Animal.create([
+                    dict(female_values, number='F2'),
+                    dict(female_values, number='F1'),
+                    ], config.context)
@@ -0,0 +1,140 @@
+import datetime
+import unittest
+
+from dateutil.relativedelta import relativedelta
+from proteus import Model
+from trytond.config import config as trytond_config
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Compute dates
+        now = datetime.datetime.now()
+        three_years_ago = now - relativedelta(years=3)
+        two_years_ago = now - relativedelta(years=2)
+
+        # Set specie in context to work as in the menus
+        config._context['specie'] = specie.id
+
+        # Create a male and an individual that arrived three years ago
+        config._context['animal_type'] = 'individual'
+        Animal = Model.get('farm.animal')
+        male = Animal(type='male', specie=specie, breed=breed,
+            arrival_date=three_years_ago.date(),
+            initial_location=warehouse.storage_location)
+        male.save()
+        individual = Animal(type='individual', specie=specie, breed=breed,
+            sex='undetermined', arrival_date=three_years_ago.date(),
+            initial_location=warehouse.storage_location)
+        individual.save()
+
+        # Create a group that is still alive
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group = AnimalGroup(specie=specie, breed=breed,
+            arrival_date=three_years_ago.date(),
+            initial_location=warehouse.storage_location,
+            initial_quantity=4)
+        group.save()
+
+        # Remove the male two years ago
+        config._context['animal_type'] = 'male'
+        RemovalType = Model.get('farm.removal.type')
+        removal_type = RemovalType.find([], limit=1)[0]
+        RemovalReason = Model.get('farm.removal.reason')
+        removal_reason = RemovalReason.find([], limit=1)[0]
+        RemovalEvent = Model.get('farm.removal.event')
+        removal = RemovalEvent(animal_type='male', specie=specie,
+            farm=warehouse, animal=male, timestamp=two_years_ago,
+            from_location=male.location, removal_type=removal_type,
+            reason=removal_reason)
+        removal.save()
+        removal.click('validate_event')
+        removal.reload()
+        removal_move = removal.move
+        self.assertEqual(removal_move.origin, removal)
+
+        # Transform the individual into the group two years ago
+        config._context['animal_type'] = 'individual'
+        TransformationEvent = Model.get('farm.transformation.event')
+        transformation = TransformationEvent(animal_type='individual',
+            specie=specie, farm=warehouse, timestamp=two_years_ago,
+            animal=individual, from_location=individual.location,
+            to_animal_type='group', to_location=warehouse.storage_location,
+            to_animal_group=group)
+        transformation.save()
+        TransformationEvent.validate_event([transformation.id],
+            config.context)
+        individual.reload()
+        individual.active = False
+        individual.save()
+
+        # Archive the animals removed more than one year ago
+        if not trytond_config.has_section('farm'):
+            trytond_config.add_section('farm')
+        trytond_config.set('farm', 'archive_years', '1')
+        try:
+            Cron = Model.get('ir.cron')
+            cron, = Cron.find([
+                    ('method', '=', 'farm.animal|archive_removed'),
+                    ])
+            cron.click('run_once')
+        finally:
+            trytond_config.remove_option('farm', 'archive_years')
+
+        # The removal event is moved to the archive with its journal line
+        self.assertEqual(RemovalEvent.find([('id', '=', removal.id)]), [])
+        EventJournal = Model.get('farm.animal.cycle.events')
+        with config.set_context(farm_archive=True):
+            archived, = RemovalEvent.find([('id', '=', removal.id)])
+            self.assertEqual(archived.animal.id, male.id)
+            self.assertEqual(len(EventJournal.find([
+                            ('event_type', '=', 'farm.removal.event'),
+                            ('event_id', '=', removal.id),
+                            ])), 1)
+
+        # The stock move of the removal loses its origin
+        Move = Model.get('stock.move')
+        removal_move = Move(removal_move.id)
+        self.assertEqual(removal_move.origin, None)
+
+        # The transformation into the live group keeps its history
+        transformation.reload()
+        self.assertEqual(transformation.state, 'validated')
+        self.assertEqual(len(EventJournal.find([
+                        ('event_type', '=', 'farm.transformation.event'),
+                        ('event_id', '=', transformation.id),
+                        ])), 1)
+        group.reload()
+        self.assertEqual(group.active, True)
+
+        # No stock period is closed by default
+        Period = Model.get('stock.period')
+        self.assertEqual(Period.find([]), [])
@@ -0,0 +1,116 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+        pen1 = Location(name='Pen 1', type='storage',
+            parent=warehouse.storage_location)
+        pen1.save()
+        pen2 = Location(name='Pen 2', type='storage',
+            parent=warehouse.storage_location)
+        pen2.save()
+
+        today = datetime.date.today()
+
+        def day(days_ago):
+            return today - datetime.timedelta(days=days_ago)
+
+        def at(days_ago):
+            return datetime.datetime.combine(day(days_ago),
+                datetime.time(10))
+
+        Census = Model.get('farm.census')
+
+        def census(days_ago):
+            "Returns the heads of females by location and state"
+            series = Census.get_series(day(days_ago), day(days_ago),
+                ['location', 'state'], warehouse.id, specie.id, 'female',
+                config.context)
+            return {(r['location'], r['state']): r['heads'] for r in series}
+
+        # Create a female that arrived 30 days ago
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'female'
+        Animal = Model.get('farm.animal')
+        female = Animal(type='female', specie=specie, breed=breed,
+            arrival_date=day(30), initial_location=pen1)
+        female.save()
+        self.assertEqual(census(30), {(pen1.id, 'prospective'): 1})
+
+        # Move it 20 days ago
+        MoveEvent = Model.get('farm.move.event')
+        move_event = MoveEvent(animal_type='female', specie=specie,
+            farm=warehouse, timestamp=at(20), animal=female,
+            from_location=pen1, to_location=pen2)
+        move_event.save()
+        move_event.click('validate_event')
+        self.assertEqual(census(20), {(pen2.id, 'prospective'): 1})
+
+        def validate(Event, days_ago, **values):
+            event = Event(animal_type='female', specie=specie,
+                farm=warehouse, timestamp=at(days_ago), animal=female,
+                **values)
+            event.save()
+            event.click('validate_event')
+            return event
+
+        # An insemination before the move is counted where the female was
+        validate(Model.get('farm.insemination.event'), 25)
+        self.assertEqual(census(25), {(pen1.id, 'mated'): 1})
+        self.assertEqual(census(20), {(pen2.id, 'mated'): 1})
+
+        # Farrow and wean the female into the first pen
+        validate(Model.get('farm.pregnancy_diagnosis.event'), 15,
+            result='positive')
+        validate(Model.get('farm.farrowing.event'), 10, live=5)
+        self.assertEqual(census(10), {(pen2.id, 'mated'): 1})
+        validate(Model.get('farm.weaning.event'), 5, quantity=5,
+            female_to_location=pen1, weaned_to_location=pen2)
+        self.assertEqual(census(5), {(pen1.id, 'unmated'): 1})
+
+        # Cancelling a move of the female reverses it
+        move_event = MoveEvent(animal_type='female', specie=specie,
+            farm=warehouse, timestamp=at(2), animal=female,
+            from_location=pen1, to_location=pen2)
+        move_event.save()
+        move_event.click('validate_event')
+        self.assertEqual(census(2), {(pen2.id, 'unmated'): 1})
+        Move = Model.get('stock.move')
+        move = Move(move_event.move.id)
+        move.click('cancel')
+        self.assertEqual(move.state, 'cancelled')
+        self.assertEqual(census(2), {(pen1.id, 'unmated'): 1})
+        self.assertEqual(census(0), {(pen1.id, 'unmated'): 1})
+
+        # The history is kept
+        self.assertEqual(census(25), {(pen1.id, 'mated'): 1})
+        self.assertEqual(census(20), {(pen2.id, 'mated'): 1})
@@ -0,0 +1,117 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie that produces individuals
+        specie, breed, products = create_specie('Pig')
+        specie.produced_animal_type = 'individual'
+        specie.save()
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+        pens = []
+        for i in range(2):
+            pen = Location()
+            pen.name = 'Pen %s' % i
+            pen.type = 'storage'
+            pen.parent = warehouse.storage_location
+            pen.save()
+            pens.append(pen)
+
+        # Set animal_type and specie in context to work as in the menus
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'female'
+
+        # Create a pregnant female in each pen
+        Animal = Model.get('farm.animal')
+        females = []
+        for pen in pens:
+            female = Animal()
+            female.type = 'female'
+            female.specie = specie
+            female.breed = breed
+            female.initial_location = pen
+            female.save()
+            females.append(female)
+
+        now = datetime.datetime.now()
+        InseminationEvent = Model.get('farm.insemination.event')
+        event_ids = InseminationEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+        } for f in females], config.context)
+        InseminationEvent.validate_event(event_ids, config.context)
+        PregnancyDiagnosisEvent = Model.get('farm.pregnancy_diagnosis.event')
+        event_ids = PregnancyDiagnosisEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+            'result': 'positive',
+        } for f in females], config.context)
+        PregnancyDiagnosisEvent.validate_event(event_ids, config.context)
+
+        # Farrow both females at once
+        FarrowingEvent = Model.get('farm.farrowing.event')
+        event_ids = FarrowingEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+            'live': live,
+        } for f, live in zip(females, [3, 2])], config.context)
+        FarrowingEvent.validate_event(event_ids, config.context)
+        events = [FarrowingEvent(i) for i in event_ids]
+        self.assertEqual([e.state for e in events], ['validated'] * 2)
+
+        # Check the piglets are created in the location of their mother with
+        # their own number and lot
+        self.assertEqual([len(e.produced_animals) for e in events], [3, 2])
+        produced = [(e, p) for e in events for p in e.produced_animals]
+        numbers = [p.animal.number for _, p in produced]
+        self.assertEqual(len(set(numbers)), 5)
+        self.assertEqual(all(numbers), True)
+        for event, produced_animal in produced:
+            animal = produced_animal.animal
+            self.assertEqual(animal.type, 'individual')
+            self.assertEqual(animal.lot.number, animal.number)
+            self.assertEqual(animal.lot.animal, animal)
+            self.assertEqual(produced_animal.move.state, 'done')
+            self.assertEqual(produced_animal.move.lot, animal.lot)
+            self.assertEqual(animal.location, event.animal.location)
+
+        # Check the females are lactating
+        females = [Animal(f.id) for f in females]
+        self.assertEqual(
+            [f.current_cycle.state for f in females], ['lactating'] * 2)
+        self.assertEqual([f.current_cycle.live for f in females], [3, 2])
@@ -169,3 +169,63 @@ class Test(unittest.TestCase):
         lot = Lot(silo1.current_lot.id)
         self.assertEqual(lot.quantity, 0.1)
         self.assertEqual(lot.product.quantity, 0.1)
+
+        # The consumed feed is converted to kilograms
+        individual.reload()
+        self.assertAlmostEqual(float(individual.consumed_feed), 2.1)
+        animal_group.reload()
+        self.assertAlmostEqual(float(animal_group.consumed_feed), 0.75)
+
+        # The feed of all the events of a group is accumulated
+        del config._context['locations']
+        provisioning_move2 = Move()
+        provisioning_move2.product = feed_product
+        provisioning_move2.unit = feed_product.default_uom
+        provisioning_move2.quantity = 10
+        provisioning_move2.from_location = company.party.supplier_location
+        provisioning_move2.to_location = silo1
+        provisioning_move2.planned_date = now.date()
+        provisioning_move2.effective_date = now.date()
+        provisioning_move2.company = company
+        provisioning_move2.lot = feed_lot
+        provisioning_move2.unit_price = feed_product.template.list_price
+        provisioning_move2.currency = company.currency
+        provisioning_move2.save()
+        provisioning_move2.click('do')
+        kg, = ProductUom.find([('name', '=', 'Kilogram')])
+        feed_animal_group2 = FeedEvent()
+        feed_animal_group2.animal_type = 'group'
+        feed_animal_group2.specie = specie
+        feed_animal_group2.farm = warehouse
+        feed_animal_group2.animal_group = animal_group
+        feed_animal_group2.quantity = 4
+        feed_animal_group2.timestamp = now
+        feed_animal_group2.location = location2
+        feed_animal_group2.feed_location = silo1
+        feed_animal_group2.feed_product = feed_product
+        feed_animal_group2.feed_lot = feed_lot
+        feed_animal_group2.uom = kg
+        feed_animal_group2.feed_quantity = Decimal('2.0')
+        feed_animal_group2.save()
+        feed_animal_group2.click('validate_event')
+        animal_group.reload()
+        self.assertAlmostEqual(float(animal_group.consumed_feed), 1.25)
+
+        # The groups are searched by the feed consumed per head
+        animal_group2 = AnimalGroup()
+        animal_group2.specie = specie
+        animal_group2.breed = breed
+        animal_group2.initial_location = location2
+        animal_group2.initial_quantity = 2
+        animal_group2.save()
+        self.assertEqual(AnimalGroup.find([('consumed_feed', '>', 1)]),
+            [animal_group])
+        self.assertEqual(AnimalGroup.find([('consumed_feed', '=', 0)]),
+            [animal_group2])
+        self.assertEqual(
+            sorted(g.id for g in AnimalGroup.find([
+                        ('consumed_feed', '<=', 1.25)])),
+            sorted([animal_group.id, animal_group2.id]))
+        self.assertEqual(Animal.find([('consumed_feed', '>=', 2)]),
+            [individual])
+        self.assertEqual(Animal.find([('consumed_feed', '>', 3)]), [])
@@ -0,0 +1,186 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.modules.farm.tests.tools import create_feed_product, create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Create specie aggregating the feed moves per inventory
+        specie, breed, _ = create_specie('Pig')
+        specie.feed_move_aggregation = 'inventory'
+        specie.save()
+
+        # Compute dates
+        now = datetime.datetime.now()
+        today = now.date()
+
+        def ago(days):
+            return now - datetime.timedelta(days=days)
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+        pen1 = Location(name='Pen 1', type='storage',
+            parent=warehouse.storage_location)
+        pen1.save()
+        pen2 = Location(name='Pen 2', type='storage',
+            parent=warehouse.storage_location)
+        pen2.save()
+        silo = Location(name='Silo', type='storage',
+            parent=warehouse.storage_location, silo=True)
+        silo.locations_to_fed.append(Location(pen1.id))
+        silo.locations_to_fed.append(Location(pen2.id))
+        silo.save()
+
+        # Fill the silo
+        feed_product = create_feed_product('Feed', 40, 25)
+        Lot = Model.get('stock.lot')
+        feed_lot = Lot(number='F001', product=feed_product)
+        feed_lot.save()
+        Move = Model.get('stock.move')
+        move = Move()
+        move.product = feed_product
+        move.unit = feed_product.default_uom
+        move.quantity = 1000
+        move.from_location = company.party.supplier_location
+        move.to_location = silo
+        move.planned_date = today - datetime.timedelta(days=10)
+        move.effective_date = today - datetime.timedelta(days=10)
+        move.company = company
+        move.lot = feed_lot
+        move.unit_price = feed_product.template.list_price
+        move.currency = company.currency
+        move.save()
+        move.click('do')
+
+        # Create the initial inventory of the silo
+        FeedInventory = Model.get('farm.feed.inventory')
+        inventory = FeedInventory(location=silo, timestamp=ago(9),
+            quantity=Decimal('1000'), uom=feed_product.default_uom)
+        inventory.save()
+        inventory.click('confirm')
+
+        # Create a group in each pen
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group1 = AnimalGroup(specie=specie, breed=breed,
+            arrival_date=today - datetime.timedelta(days=8),
+            initial_location=pen1, initial_quantity=10)
+        group1.save()
+        group2 = AnimalGroup(specie=specie, breed=breed,
+            arrival_date=today - datetime.timedelta(days=8),
+            initial_location=pen2, initial_quantity=5)
+        group2.save()
+
+        FeedEvent = Model.get('farm.feed.event')
+        Allocation = Model.get('farm.feed.move.allocation')
+
+        def create_events(*values):
+            return FeedEvent.create([{
+                        'animal_type': 'group',
+                        'specie': specie.id,
+                        'farm': warehouse.id,
+                        'animal_group': group.id,
+                        'quantity': group.initial_quantity,
+                        'location': group.initial_location.id,
+                        'feed_location': silo.id,
+                        'feed_product': feed_product.id,
+                        'feed_lot': feed_lot.id,
+                        'uom': feed_product.default_uom.id,
+                        'feed_quantity': Decimal(quantity),
+                        'timestamp': timestamp,
+                        'feed_inventory': ('farm.feed.inventory,%s'
+                            % feed_inventory.id if feed_inventory else None),
+                        } for group, quantity, timestamp, feed_inventory
+                    in values], config.context)
+
+        def allocations(move):
+            return sorted((a.event.id, a.quantity)
+                for a in Allocation.find([('move', '=', move.id)]))
+
+        # Validate together the events of the inventory and of another day
+        event_ids = create_events(
+            (group1, '100', ago(2), inventory),
+            (group2, '50', ago(2), inventory),
+            (group1, '30', ago(1), None),
+            (group2, '20', ago(1), None),
+            )
+        FeedEvent.validate_event(event_ids, config.context)
+        event1, event2, event3, event4 = [FeedEvent(i) for i in event_ids]
+
+        # The events of the inventory share a move originated by it
+        self.assertEqual(event1.move, event2.move)
+        inventory_move = event1.move
+        self.assertEqual(inventory_move.state, 'done')
+        self.assertEqual(inventory_move.quantity, 150)
+        self.assertEqual(inventory_move.origin, inventory)
+        self.assertEqual(allocations(inventory_move),
+            [(event1.id, 100.0), (event2.id, 50.0)])
+
+        # The other events share a move of their day originated by the first
+        self.assertEqual(event3.move, event4.move)
+        day_move = event3.move
+        self.assertNotEqual(day_move, inventory_move)
+        self.assertEqual(day_move.quantity, 50)
+        self.assertEqual(day_move.effective_date, ago(1).date())
+        self.assertEqual(day_move.origin, event3)
+        self.assertEqual(allocations(day_move),
+            [(event3.id, 30.0), (event4.id, 20.0)])
+
+        # Aggregating per day mixes the events with and without inventory
+        specie.feed_move_aggregation = 'day'
+        specie.save()
+        event_ids = create_events(
+            (group1, '10', ago(1), inventory),
+            (group2, '15', ago(1), None),
+            )
+        FeedEvent.validate_event(event_ids, config.context)
+        event5, event6 = [FeedEvent(i) for i in event_ids]
+        self.assertEqual(event5.move, event6.move)
+        self.assertNotEqual(event5.move, day_move)
+        self.assertEqual(event5.move.quantity, 25)
+        self.assertEqual(event5.move.origin, event5)
+        self.assertEqual(allocations(event5.move),
+            [(event5.id, 10.0), (event6.id, 15.0)])
+
+        # Deleting the event origin of a move moves the origin to the next
+        # event allocated
+        event3.click('draft')
+        event3.delete()
+        day_move.reload()
+        self.assertEqual(day_move.origin, event4)
+        self.assertEqual(day_move.quantity, 50)
+        self.assertEqual(allocations(day_move), [(event4.id, 20.0)])
+
+        # Deleting the last event allocated leaves the move without origin
+        event4.click('draft')
+        event4.delete()
+        day_move.reload()
+        self.assertEqual(day_move.origin, None)
+        self.assertEqual(allocations(day_move), [])
+        self.assertEqual(allocations(inventory_move),
+            [(event1.id, 100.0), (event2.id, 50.0)])
@@ -0,0 +1,184 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.modules.farm.tests.tools import create_feed_product, create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Compute the Monday of three weeks ago
+        today = datetime.date.today()
+        monday = (today - datetime.timedelta(days=today.weekday())
+            - datetime.timedelta(weeks=3))
+
+        def at(day):
+            return datetime.datetime.combine(
+                monday + datetime.timedelta(days=day), datetime.time(10))
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+        pen = Location(name='Pen', type='storage',
+            parent=warehouse.storage_location)
+        pen.save()
+        silo = Location(name='Silo', type='storage',
+            parent=warehouse.storage_location, silo=True)
+        silo.locations_to_fed.append(Location(pen.id))
+        silo.save()
+
+        # Fill the silo before the arrival of the group
+        feed_product = create_feed_product('Feed', 40, 25)
+        Lot = Model.get('stock.lot')
+        feed_lot = Lot(number='F001', product=feed_product)
+        feed_lot.save()
+        Move = Model.get('stock.move')
+        move = Move()
+        move.product = feed_product
+        move.unit = feed_product.default_uom
+        move.quantity = 500
+        move.from_location = company.party.supplier_location
+        move.to_location = silo
+        move.planned_date = monday - datetime.timedelta(days=1)
+        move.effective_date = monday - datetime.timedelta(days=1)
+        move.company = company
+        move.lot = feed_lot
+        move.unit_price = feed_product.template.list_price
+        move.currency = company.currency
+        move.save()
+        move.click('do')
+
+        # Create a group of 10 animals that arrived on Monday
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group = AnimalGroup(specie=specie, breed=breed,
+            arrival_date=monday, initial_location=pen, initial_quantity=10)
+        group.save()
+
+        # Weigh it on arrival and two weeks later
+        GroupWeight = Model.get('farm.animal.group.weight')
+        GroupWeight(group=group, timestamp=at(0), quantity=10,
+            weight=Decimal('100')).save()
+        GroupWeight(group=group, timestamp=at(14), quantity=9,
+            weight=Decimal('180')).save()
+
+        # Feed it 200 kg during the two weeks
+        kg, = Model.get('product.uom').find([('name', '=', 'Kilogram')])
+        FeedEvent = Model.get('farm.feed.event')
+        feed = FeedEvent(animal_type='group', specie=specie, farm=warehouse,
+            animal_group=group, quantity=10, timestamp=at(14),
+            location=pen, feed_location=silo, feed_product=feed_product,
+            feed_lot=feed_lot, uom=kg, feed_quantity=Decimal('200'),
+            start_date=monday, end_date=monday + datetime.timedelta(days=14))
+        feed.save()
+        feed.click('validate_event')
+
+        # One animal dies in the second week
+        RemovalType = Model.get('farm.removal.type')
+        ModelData = Model.get('ir.model.data')
+        death_data, = ModelData.find([
+                ('module', '=', 'farm'),
+                ('fs_id', '=', 'removal_type_death_on_farm'),
+                ])
+        death = RemovalType(death_data.db_id)
+        reason = Model.get('farm.removal.reason').find([], limit=1)[0]
+        RemovalEvent = Model.get('farm.removal.event')
+        removal = RemovalEvent(animal_type='group', specie=specie,
+            farm=warehouse, animal_group=group, quantity=1, timestamp=at(8),
+            from_location=pen, removal_type=death, reason=reason)
+        removal.save()
+        removal.click('validate_event')
+
+        # Check the performance computed without stored weeks
+        group.reload()
+        self.assertAlmostEqual(group.adg, 10 / 14, places=3)
+        self.assertAlmostEqual(group.fcr, 2.0, places=3)
+        self.assertAlmostEqual(group.mortality, 10.0, places=2)
+
+        # Store the closed weeks and check the performance is the same
+        Week = Model.get('farm.animal.group.performance.week')
+        self.assertEqual(Week.find([('group', '=', group.id)]), [])
+        Cron = Model.get('ir.cron')
+        cron, = Cron.find([
+                ('method', '=',
+                    'farm.animal.group.performance.week|update_weeks'),
+                ])
+        cron.click('run_once')
+        weeks = Week.find([('group', '=', group.id)],
+            order=[('week', 'ASC')])
+        self.assertEqual([w.week for w in weeks],
+            [monday + datetime.timedelta(weeks=i) for i in range(3)])
+        self.assertEqual([w.deaths for w in weeks], [0, 1, 0])
+        self.assertAlmostEqual(sum(w.feed for w in weeks), 20.0, places=3)
+        group.reload()
+        self.assertAlmostEqual(group.adg, 10 / 14, places=3)
+        self.assertAlmostEqual(group.fcr, 2.0, places=3)
+        self.assertAlmostEqual(group.mortality, 10.0, places=2)
+
+        # A back-dated death removes the stored weeks from its date
+        removal2 = RemovalEvent(animal_type='group', specie=specie,
+            farm=warehouse, animal_group=group, quantity=1, timestamp=at(2),
+            from_location=pen, removal_type=death, reason=reason)
+        removal2.save()
+        self.assertEqual(Week.find([('group', '=', group.id)]), [])
+        removal2.click('validate_event')
+        group.reload()
+        self.assertAlmostEqual(group.mortality, 20.0, places=2)
+
+        # Running the task again stores the weeks with the new death
+        cron.click('run_once')
+        weeks = Week.find([('group', '=', group.id)],
+            order=[('week', 'ASC')])
+        self.assertEqual([w.deaths for w in weeks], [1, 1, 0])
+        group.reload()
+        self.assertAlmostEqual(group.mortality, 20.0, places=2)
+
+        # Moving several events in one write removes the weeks of all of them
+        draft_ids = RemovalEvent.create([{
+                    'animal_type': 'group',
+                    'specie': specie.id,
+                    'farm': warehouse.id,
+                    'animal_group': group.id,
+                    'quantity': 1,
+                    'timestamp': at(day),
+                    'from_location': pen.id,
+                    'removal_type': death.id,
+                    'reason': reason.id,
+                    } for day in [16, 17]], config.context)
+        cron.click('run_once')
+        self.assertEqual(len(Week.find([('group', '=', group.id)])), 3)
+        draft1, draft2 = draft_ids
+        RemovalEvent.write([draft1], {'timestamp': at(2)},
+            [draft2], {'timestamp': at(16)}, config.context)
+        self.assertEqual(Week.find([('group', '=', group.id)]), [])
+
+        # The draft events are not counted
+        cron.click('run_once')
+        weeks = Week.find([('group', '=', group.id)],
+            order=[('week', 'ASC')])
+        self.assertEqual([w.deaths for w in weeks], [1, 1, 0])
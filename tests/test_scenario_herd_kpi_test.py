@@ -0,0 +1,127 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # The period starts 200 days ago and ends yesterday
+        today = datetime.date.today()
+        start = today - datetime.timedelta(days=200)
+        end = today - datetime.timedelta(days=1)
+
+        def at(day):
+            return datetime.datetime.combine(
+                start + datetime.timedelta(days=day), datetime.time(10))
+
+        # Create three females that arrived before the period
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'female'
+        Animal = Model.get('farm.animal')
+        female_ids = Animal.create([{
+                    'type': 'female',
+                    'specie': specie.id,
+                    'breed': breed.id,
+                    'arrival_date': start - datetime.timedelta(days=10),
+                    'initial_location': warehouse.storage_location.id,
+                    } for _ in range(3)], config.context)
+        female1, female2, female3 = [Animal(i) for i in female_ids]
+
+        def validate(Event, day, female, **values):
+            event = Event(animal_type='female', specie=specie,
+                farm=warehouse, timestamp=at(day), animal=female, **values)
+            event.save()
+            event.click('validate_event')
+            return event
+
+        InseminationEvent = Model.get('farm.insemination.event')
+        DiagnosisEvent = Model.get('farm.pregnancy_diagnosis.event')
+        FarrowingEvent = Model.get('farm.farrowing.event')
+        WeaningEvent = Model.get('farm.weaning.event')
+        AbortEvent = Model.get('farm.abort.event')
+
+        # The first female farrows 10 piglets and weans 9
+        validate(InseminationEvent, 0, female1)
+        validate(DiagnosisEvent, 30, female1, result='positive')
+        validate(FarrowingEvent, 114, female1, live=10)
+        female1.reload()
+        validate(WeaningEvent, 135, female1, quantity=9,
+            female_to_location=female1.location,
+            weaned_to_location=female1.location)
+
+        # The second female is still pregnant at the end of the period
+        validate(InseminationEvent, 150, female2)
+
+        # The third female aborts
+        validate(InseminationEvent, 10, female3)
+        validate(DiagnosisEvent, 30, female3, result='positive')
+        validate(AbortEvent, 40, female3)
+
+        # Check the KPIs of the period
+        HerdKpi = Model.get('farm.herd.kpi')
+        kpis = HerdKpi.get_kpis(warehouse.id, specie.id, start, end,
+            config.context)
+        # The females are in the herd from their first service
+        self.assertEqual(kpis['female_days'], 200 + 50 + 190)
+        self.assertEqual(kpis['services'], 3)
+        self.assertEqual(kpis['farrowings'], 1)
+        # The pregnant female has no result yet
+        self.assertAlmostEqual(kpis['farrowing_rate'], 50.0)
+        self.assertEqual(kpis['born_alive'], 10)
+        self.assertEqual(kpis['weaned'], 9)
+        self.assertAlmostEqual(kpis['pre_weaning_mortality'], 10.0)
+        self.assertAlmostEqual(kpis['pwsy'], 9 * 365 / 440)
+        # Productive days: from service to the day before weaning of the
+        # first female and to the end of the period of the second one
+        self.assertAlmostEqual(kpis['npd'], (440 - 135 - 50) * 365 / 440)
+
+        # The KPIs of the closed period are stored
+        kpi, = HerdKpi.find([('end_date', '=', end)])
+        self.assertAlmostEqual(kpi.pwsy, 9 * 365 / 440)
+        self.assertEqual(
+            HerdKpi.get_kpis(warehouse.id, specie.id, start, end,
+                config.context)['weaned'], 9)
+
+        # Store the KPIs of the first 60 days with a draft event in them
+        draft = InseminationEvent(animal_type='female', specie=specie,
+            farm=warehouse, timestamp=at(50), animal=female2)
+        draft.save()
+        first_end = start + datetime.timedelta(days=60)
+        HerdKpi.get_kpis(warehouse.id, specie.id, start, first_end,
+            config.context)
+        self.assertEqual(len(HerdKpi.find([('end_date', '=', first_end)])), 1)
+
+        # Moving the event after the period removes the stored KPIs of its
+        # previous date too
+        draft.timestamp = at(170)
+        draft.save()
+        self.assertEqual(HerdKpi.find([('end_date', '=', first_end)]), [])
+        self.assertEqual(HerdKpi.find([('end_date', '=', end)]), [])
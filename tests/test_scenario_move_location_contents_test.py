@@ -0,0 +1,114 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Create locations
+        location1 = Location()
+        location1.name = 'Room 1'
+        location1.code = 'R1'
+        location1.type = 'storage'
+        location1.parent = warehouse.storage_location
+        location1.save()
+        location2 = Location()
+        location2.name = 'Room 2'
+        location2.code = 'R2'
+        location2.type = 'storage'
+        location2.parent = warehouse.storage_location
+        location2.save()
+
+        # Create two individuals and a group in the first room
+        Animal = Model.get('farm.animal')
+        individuals = []
+        for _ in range(2):
+            individual = Animal()
+            individual.type = 'individual'
+            individual.specie = specie
+            individual.breed = breed
+            individual.initial_location = location1
+            individual.save()
+            individuals.append(individual)
+        AnimalGroup = Model.get('farm.animal.group')
+        animal_group = AnimalGroup()
+        animal_group.specie = specie
+        animal_group.breed = breed
+        animal_group.initial_location = location1
+        animal_group.initial_quantity = 10
+        animal_group.save()
+
+        # Move all the contents of the first room to the second one
+        MoveEvent = Model.get('farm.move.event')
+        now = datetime.datetime.now()
+        event_ids = MoveEvent.move_location_contents(specie.id,
+            location1.id, location2.id, now, False, config.context)
+        self.assertEqual(len(event_ids), 3)
+        events = [MoveEvent(i) for i in event_ids]
+        self.assertEqual(all(e.state == 'validated' for e in events), True)
+        self.assertEqual(all(e.move.state == 'done' for e in events), True)
+        group_event, = [e for e in events if e.animal_type == 'group']
+        self.assertEqual(group_event.quantity, 10)
+
+        # Check the animals and the group are in the second room
+        for individual in individuals:
+            individual.reload()
+            self.assertEqual(individual.location, location2)
+        with config.set_context(locations=[location2.id]):
+            animal_group = AnimalGroup(animal_group.id)
+            self.assertEqual(animal_group.quantity, 10)
+
+        # An empty room can not be moved
+        with self.assertRaises(Exception):
+            MoveEvent.move_location_contents(specie.id, location1.id,
+                location2.id, now, False, config.context)
+
+        # A location outside a farm can not be moved
+        storage = Location()
+        storage.name = 'Outside'
+        storage.code = 'OUT'
+        storage.type = 'storage'
+        storage.save()
+        with self.assertRaises(Exception):
+            MoveEvent.move_location_contents(specie.id, storage.id,
+                location2.id, now, False, config.context)
+
+        # Page through the events of the farm following the last one seen
+        page = MoveEvent.search_keyset([], None, 2, warehouse.id, specie.id,
+            config.context)
+        self.assertEqual(len(page['ids']), 2)
+        self.assertNotEqual(page['next'], None)
+        next_page = MoveEvent.search_keyset([], page['next'], 2,
+            warehouse.id, specie.id, config.context)
+        self.assertEqual(len(next_page['ids']), 1)
+        self.assertEqual(next_page['next'], None)
+        self.assertEqual(sorted(page['ids'] + next_page['ids']),
+            sorted(event_ids))
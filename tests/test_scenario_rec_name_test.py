@@ -0,0 +1,131 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, products = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Set specie in context to work as in the menus
+        config._context['specie'] = specie.id
+        now = datetime.datetime.now()
+
+        # Create two females and a group
+        config._context['animal_type'] = 'female'
+        Animal = Model.get('farm.animal')
+        female_ids = Animal.create([{
+                    'type': 'female',
+                    'specie': specie.id,
+                    'breed': breed.id,
+                    'initial_location': warehouse.storage_location.id,
+                    } for _ in range(2)], config.context)
+        female1, female2 = [Animal(i) for i in female_ids]
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group = AnimalGroup(specie=specie, breed=breed,
+            initial_location=warehouse.storage_location,
+            initial_quantity=5)
+        group.save()
+
+        # The names of several records are read at once
+        self.assertEqual(
+            [r['rec_name'] for r in Animal.read(female_ids, ['rec_name'],
+                    config.context)],
+            [female1.number, female2.number])
+        self.assertEqual(group.rec_name, group.number)
+        self.assertEqual(group.lot.rec_name, group.number)
+
+        # The searchers find the records by number
+        self.assertEqual(Animal.find([('rec_name', '=', female2.number)]),
+            [female2])
+        self.assertEqual(
+            AnimalGroup.find([('rec_name', '=', group.number)]), [group])
+
+        # Female events and cycles show the sequence of the cycle
+        config._context['animal_type'] = 'female'
+        InseminationEvent = Model.get('farm.insemination.event')
+        insemination = InseminationEvent(animal_type='female', specie=specie,
+            farm=warehouse, timestamp=now, animal=female1)
+        insemination.save()
+        insemination.click('validate_event')
+        insemination.reload()
+        self.assertTrue(insemination.rec_name.startswith(
+                '%s on cycle 1 ' % female1.number))
+        female1.reload()
+        self.assertEqual(female1.current_cycle.rec_name, '1 (Mated)')
+
+        # Events of groups show the number of the group
+        config._context['animal_type'] = 'group'
+        MoveEvent = Model.get('farm.move.event')
+        location = Location(name='Pen', type='storage',
+            parent=warehouse.storage_location)
+        location.save()
+        move_event = MoveEvent(animal_type='group', specie=specie,
+            farm=warehouse, timestamp=now, animal_group=group,
+            from_location=warehouse.storage_location, to_location=location,
+            quantity=2)
+        move_event.save()
+        self.assertTrue(move_event.rec_name.startswith('%s ' % group.number))
+
+        # Weights show their unit and are found by their value
+        AnimalWeight = Model.get('farm.animal.weight')
+        weight = AnimalWeight(animal=female2, timestamp=now,
+            weight=Decimal('120.5'))
+        weight.save()
+        self.assertTrue(weight.rec_name.startswith('120.5'))
+        self.assertIn(' kg (', weight.rec_name)
+        self.assertEqual(AnimalWeight.find([('rec_name', '=', '120.5')]),
+            [weight])
+        self.assertEqual(AnimalWeight.find([('rec_name', '=', 'heavy')]),
+            [])
+
+        # Removed animals and their lots are marked
+        config._context['animal_type'] = 'female'
+        RemovalType = Model.get('farm.removal.type')
+        removal_type = RemovalType.find([], limit=1)[0]
+        RemovalReason = Model.get('farm.removal.reason')
+        removal_reason = RemovalReason.find([], limit=1)[0]
+        RemovalEvent = Model.get('farm.removal.event')
+        removal = RemovalEvent(animal_type='female', specie=specie,
+            farm=warehouse, timestamp=now, animal=female2,
+            from_location=female2.location, removal_type=removal_type,
+            reason=removal_reason)
+        removal.save()
+        removal.click('validate_event')
+        with config.set_context(active_test=False):
+            female2 = Animal(female2.id)
+            self.assertEqual(female2.rec_name, '%s (*)' % female2.number)
+            self.assertEqual(female2.lot.rec_name,
+                '%s (*)' % female2.number)
+            self.assertEqual(
+                [r['rec_name'] for r in Animal.read(female_ids, ['rec_name'],
+                        config.context)],
+                [female1.number, '%s (*)' % female2.number])
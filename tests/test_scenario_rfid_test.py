@@ -0,0 +1,168 @@
+import csv
+import datetime
+import os
+import unittest
+
+from proteus import Model
+from trytond.exceptions import UserError
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.modules.farm.tests.tools import create_specie, create_users
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Compute now
+        now = datetime.datetime.now()
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Create farm users
+        users = create_users(company)
+        individual_user = users['individual']
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Create locations
+        location1 = Location()
+        location1.name = 'Location 1'
+        location1.code = 'L1'
+        location1.type = 'storage'
+        location1.parent = warehouse.storage_location
+        location1.save()
+        location2 = Location()
+        location2.name = 'Location 2'
+        location2.code = 'L2'
+        location2.type = 'storage'
+        location2.parent = warehouse.storage_location
+        location2.save()
+
+        # Create the gate between both locations
+        RfidGate = Model.get('farm.rfid.gate')
+        gate = RfidGate()
+        gate.code = 'G1'
+        gate.from_location = location1
+        gate.to_location = location2
+        gate.save()
+        self.assertEqual(gate.debounce, 60)
+
+        # Create individuals I1 and I2 in location L1, I2 with tag E0002
+        Tag = Model.get('farm.tag')
+        tag = Tag(name='E0002')
+        tag.save()
+        admin_user = config.user
+        config.user = individual_user.id
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'individual'
+        Animal = Model.get('farm.animal')
+        individual1 = Animal()
+        individual1.breed = breed
+        individual1.number = 'I1'
+        individual1.arrival_date = now.date() - datetime.timedelta(days=1)
+        individual1.initial_location = location1
+        individual1.save()
+        individual2 = Animal()
+        individual2.breed = breed
+        individual2.number = 'I2'
+        individual2.arrival_date = now.date() - datetime.timedelta(days=1)
+        individual2.initial_location = location1
+        individual2.tags.append(Tag(tag.id))
+        individual2.save()
+        del config._context['animal_type']
+        config.user = admin_user
+
+        # Replay the reads recorded by the gate from a file
+        filename = os.path.join(os.path.dirname(__file__), 'rfid_reads.csv')
+        with open(filename) as file:
+            reads = [(r['tag'], r['gate'],
+                    now - datetime.timedelta(
+                        seconds=int(r['seconds_before_now'])))
+                for r in csv.DictReader(file)]
+        RfidRead = Model.get('farm.rfid.read')
+        event_ids = RfidRead.ingest(reads, config.context)
+
+        # The repeated reads are discarded and the unknown tag is kept
+        stored_reads = RfidRead.find([], order=[('timestamp', 'ASC')])
+        self.assertEqual([r.tag for r in stored_reads],
+            ['I1', 'E0002', 'I1', 'UNKNOWN'])
+        self.assertEqual([r.animal for r in stored_reads],
+            [individual1, individual2, individual1, None])
+
+        # I1 passed the gate twice and I2 once
+        MoveEvent = Model.get('farm.move.event')
+        events = MoveEvent.find([('id', 'in', event_ids)],
+            order=[('timestamp', 'ASC')])
+        self.assertEqual(len(events), 3)
+        self.assertEqual([e.state for e in events], ['validated'] * 3)
+        self.assertEqual([(e.animal, e.from_location, e.to_location)
+                for e in events], [
+                (individual1, location1, location2),
+                (individual2, location1, location2),
+                (individual1, location2, location1),
+                ])
+        self.assertEqual([r.move_event for r in stored_reads],
+            events + [None])
+        individual1.reload()
+        self.assertEqual(individual1.location, location1)
+        individual2.reload()
+        self.assertEqual(individual2.location, location2)
+
+        # A read within the debounce of the last stored read is discarded
+        event_ids = RfidRead.ingest([
+                ('E0002', 'G1', now - datetime.timedelta(seconds=2950)),
+                ], config.context)
+        self.assertEqual(event_ids, [])
+        self.assertEqual(len(RfidRead.find([])), 4)
+
+        # Unknown gates are refused
+        with self.assertRaises(Exception):
+            RfidRead.ingest([('I1', 'G2', now)], config.context)
+
+        # Gates with a location outside a farm are refused
+        outside = Location(name='Outside', type='storage')
+        outside.save()
+        gate3 = RfidGate(code='G3', from_location=location1,
+            to_location=outside)
+        gate3.save()
+        with self.assertRaises(UserError):
+            RfidRead.ingest([('I1', 'G3', now)], config.context)
+        self.assertEqual(len(RfidRead.find([])), 4)
+
+        # The animals not allowed in the destination keep the error in their
+        # read and the other reads are stored
+        farm_line, = specie.farm_lines
+        farm_line.has_individual = False
+        farm_line.save()
+        event_ids = RfidRead.ingest([
+                ('I2', 'G1', now),
+                ('UNKNOWN', 'G1', now),
+                ], config.context)
+        self.assertEqual(event_ids, [])
+        read, = RfidRead.find([('tag', '=', 'I2')])
+        self.assertEqual(read.animal, individual2)
+        self.assertEqual(read.move_event, None)
+        self.assertTrue(read.error)
+        self.assertEqual(len(RfidRead.find([('tag', '=', 'UNKNOWN')])), 2)
+        individual2.reload()
+        self.assertEqual(individual2.location, location2)
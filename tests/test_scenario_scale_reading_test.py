@@ -0,0 +1,111 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Compute dates
+        today = datetime.date.today()
+        day1 = today - datetime.timedelta(days=2)
+        day2 = today - datetime.timedelta(days=1)
+
+        def at(day, hour):
+            return datetime.datetime.combine(day, datetime.time(hour))
+
+        # Create a group
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group = AnimalGroup(specie=specie, breed=breed,
+            initial_location=warehouse.storage_location, initial_quantity=10)
+        group.save()
+
+        # Ingest the readings of two days and of today
+        ScaleReading = Model.get('farm.animal.group.weight.reading')
+        count = ScaleReading.ingest([
+                (group.id, at(day1, 8), 9.0, 'S1'),
+                (group.id, at(day1, 9), 10.0, 'S1'),
+                (group.id, at(day1, 10), 11.0),
+                (group.id, at(day2, 8), 20.0),
+                (group.id, at(day2, 9), 20.0),
+                (group.id, at(today, 8), 30.0),
+                ], config.context)
+        self.assertEqual(count, 6)
+        readings = ScaleReading.find([], order=[('timestamp', 'ASC')])
+        self.assertEqual([r.date for r in readings],
+            [day1] * 3 + [day2] * 2 + [today])
+        self.assertEqual([r.scale for r in readings],
+            ['S1', 'S1'] + [None] * 4)
+        # The creation date is the time of the ingestion
+        self.assertTrue(all(r.create_date > r.timestamp
+                for r in readings[:-1]))
+
+        # Aggregate the readings of the days before today
+        Cron = Model.get('ir.cron')
+        cron, = Cron.find([
+                ('method', '=',
+                    'farm.animal.group.weight.reading|aggregate_readings'),
+                ])
+        cron.click('run_once')
+        GroupWeight = Model.get('farm.animal.group.weight')
+        weight1, weight2 = GroupWeight.find([('group', '=', group.id)],
+            order=[('timestamp', 'ASC')])
+        self.assertEqual(weight1.timestamp, at(day1, 10))
+        self.assertEqual(weight1.quantity, 3)
+        self.assertEqual(weight1.weight, 30)
+        self.assertAlmostEqual(weight1.cv, 10.0)
+        self.assertEqual(weight2.quantity, 2)
+        self.assertEqual(weight2.weight, 40)
+        self.assertEqual(weight2.cv, 0.0)
+        readings = ScaleReading.find([], order=[('timestamp', 'ASC')])
+        self.assertEqual([r.group_weight for r in readings],
+            [weight1] * 3 + [weight2] * 2 + [None])
+
+        # Nothing changes without new readings
+        cron.click('run_once')
+        self.assertEqual(GroupWeight.find([('group', '=', group.id)],
+                order=[('timestamp', 'ASC')]), [weight1, weight2])
+
+        # A late reading replaces the weight of its day
+        ScaleReading.ingest([(group.id, at(day1, 12), 14.0)], config.context)
+        cron.click('run_once')
+        self.assertEqual(GroupWeight.find([('id', '=', weight1.id)]), [])
+        new_weight1, weight = GroupWeight.find([('group', '=', group.id)],
+            order=[('timestamp', 'ASC')])
+        self.assertEqual(weight, weight2)
+        self.assertEqual(new_weight1.timestamp, at(day1, 12))
+        self.assertEqual(new_weight1.quantity, 4)
+        self.assertEqual(new_weight1.weight, 44)
+        self.assertAlmostEqual(new_weight1.cv, 100 * (14 / 3) ** 0.5 / 11)
+        readings = ScaleReading.find([('date', '=', day1)])
+        self.assertEqual({r.group_weight.id for r in readings},
+            {new_weight1.id})
@@ -3,6 +3,7 @@ import unittest
 from decimal import Decimal
 
 from proteus import Model
+from trytond.exceptions import UserError
 from trytond.modules.company.tests.tools import create_company
 from trytond.modules.farm.tests.tools import create_specie
 from trytond.tests.test_tryton import drop_db
@@ -205,3 +206,22 @@ class Test(unittest.TestCase):
         shipment.click('do')
         shipment.reload()
         self.assertEqual(shipment.state, 'done')
+
+        # Extractions in a farm without males are refused with a clear error
+        extraction2 = SemenExtractionEvent()
+        extraction2.animal_type = 'male'
+        extraction2.specie = specie
+        extraction2.farm = warehouse
+        extraction2.timestamp = now
+        extraction2.animal = male1
+        extraction2.untreated_semen_uom = cm3
+        extraction2.untreated_semen_qty = Decimal('410.0')
+        extraction2.semen_qty = Decimal('610.0')
+        extraction2.dose_location = lab1
+        extraction2.dose_bom = dose_bom
+        extraction2.save()
+        farm_line, = specie.farm_lines
+        farm_line.has_male = False
+        farm_line.save()
+        with self.assertRaises(UserError):
+            extraction2.click('validate_event')
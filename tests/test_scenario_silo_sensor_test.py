@@ -0,0 +1,202 @@
+import csv
+import datetime
+import os
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company, get_company
+from trytond.modules.farm.tests.tools import (create_feed_product,
+                                              create_specie, create_users)
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Compute now
+        now = datetime.datetime.now()
+
+        # Create company
+        _ = create_company()
+        company = get_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Create farm users
+        users = create_users(company)
+        group_user = users['group']
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Prepare farm location L1 and Silo location
+        location1 = Location()
+        location1.name = 'Location 1'
+        location1.code = 'L1'
+        location1.type = 'storage'
+        location1.parent = warehouse.storage_location
+        location1.save()
+        silo1 = Location()
+        silo1.name = 'Silo 1'
+        silo1.code = 'S1'
+        silo1.type = 'storage'
+        silo1.parent = warehouse.storage_location
+        silo1.silo = True
+        silo1.locations_to_fed.append(location1)
+        silo1.save()
+
+        # Create Feed Product and 2 Lots
+        feed_product = create_feed_product('Feed', 40, 25)
+        Lot = Model.get('stock.lot')
+        feed_lot1 = Lot()
+        feed_lot1.number = 'F001'
+        feed_lot1.product = feed_product
+        feed_lot1.save()
+        feed_lot2 = Lot()
+        feed_lot2.number = 'F002'
+        feed_lot2.product = feed_product
+        feed_lot2.save()
+
+        # Create group G1 with 20 units in location L1 arrived 10 days before
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'group'
+        admin_user = config.user
+        config.user = group_user.id
+        AnimalGroup = Model.get('farm.animal.group')
+        animal_group1 = AnimalGroup()
+        animal_group1.specie = specie
+        animal_group1.breed = breed
+        animal_group1.arrival_date = now.date() - datetime.timedelta(days=10)
+        animal_group1.initial_location = location1
+        animal_group1.initial_quantity = 20
+        animal_group1.save()
+        del config._context['animal_type']
+        config.user = admin_user
+
+        # Put 2000 Kg of first Lot of Feed into the silo 8 days before, and
+        # refill it with 1500 Kg of second Lot of Feed 3 days before
+        Move = Model.get('stock.move')
+        for lot, quantity, days in [
+                (feed_lot1, 2000.00, 8),
+                (feed_lot2, 1500.00, 3),
+                ]:
+            provisioning_move = Move()
+            provisioning_move.product = feed_product
+            provisioning_move.lot = lot
+            provisioning_move.unit = feed_product.default_uom
+            provisioning_move.quantity = quantity
+            provisioning_move.from_location = company.party.supplier_location
+            provisioning_move.to_location = silo1
+            provisioning_move.planned_date = now.date() - datetime.timedelta(
+                days=days)
+            provisioning_move.effective_date = (
+                now.date() - datetime.timedelta(days=days))
+            provisioning_move.company = company
+            provisioning_move.unit_price = feed_product.template.list_price
+            provisioning_move.currency = company.currency
+            provisioning_move.save()
+            provisioning_move.click('do')
+
+        # Create and confirm the initial (real) feed inventory 8 days before
+        FeedInventory = Model.get('farm.feed.inventory')
+        feed_inventory0 = FeedInventory()
+        feed_inventory0.location = silo1
+        feed_inventory0.timestamp = now - datetime.timedelta(days=8)
+        feed_inventory0.quantity = Decimal('2000.00')
+        feed_inventory0.uom = feed_product.default_uom
+        feed_inventory0.save()
+        feed_inventory0.click('confirm')
+        self.assertEqual(feed_inventory0.state, 'validated')
+
+        # Create the sensor of the silo
+        SiloSensor = Model.get('farm.silo.sensor')
+        sensor = SiloSensor()
+        sensor.code = 'S1'
+        sensor.silo = silo1
+        sensor.specie = specie
+        sensor.inventory_interval = 2
+        sensor.save()
+
+        # Replay the readings of the sensor every 15 minutes since the initial
+        # inventory from a file. The silo is consumed at 100 Kg per day and
+        # refilled 3 days before
+        filename = os.path.join(os.path.dirname(__file__),
+            'silo_sensor_readings.csv')
+        with open(filename) as file:
+            readings = [(r['sensor'],
+                    now - datetime.timedelta(
+                        minutes=int(r['minutes_before_now'])),
+                    float(r['kilograms']))
+                for r in csv.DictReader(file)]
+        SiloSensorReading = Model.get('farm.silo.sensor.reading')
+        stored = SiloSensorReading.ingest(readings, config.context)
+
+        # Check the readings within the resolution are discarded and the
+        # refill is detected
+        self.assertLess(stored, len(readings) / 2)
+        self.assertEqual(len(SiloSensorReading.find([])), stored)
+        refill, = SiloSensorReading.find([('refill', '=', True)])
+        self.assertEqual(refill.timestamp.date(),
+            now.date() - datetime.timedelta(days=3))
+
+        # The creation date is the time of the ingestion
+        self.assertGreater(refill.create_date, refill.timestamp)
+
+        # Unknown sensors are refused
+        with self.assertRaises(Exception):
+            SiloSensorReading.ingest([('S2', now, 1000.0)], config.context)
+
+        # Run the scheduled task that creates the provisional inventories
+        Cron = Model.get('ir.cron')
+        cron, = Cron.find([
+                ('method', '=', 'farm.silo.sensor|create_inventories'),
+                ])
+        cron.click('run_once')
+
+        # Check an inventory is confirmed for each interval elapsed since the
+        # initial inventory with a reading. The second one is on the day
+        # before the refill
+        FeedProvisionalInventory = Model.get('farm.feed.provisional_inventory')
+        inventory1, inventory2, inventory3 = FeedProvisionalInventory.find([],
+            order=[('timestamp', 'ASC')])
+        for inventory in [inventory1, inventory2, inventory3]:
+            self.assertEqual(inventory.state, 'validated')
+            self.assertEqual(inventory.inventory.state, 'done')
+            self.assertNotEqual(inventory.feed_events, [])
+            reading, = SiloSensorReading.find([
+                    ('timestamp', '=', inventory.timestamp),
+                    ])
+            self.assertEqual(inventory.quantity,
+                Decimal(str(round(reading.quantity, 2))))
+        interval = datetime.timedelta(days=sensor.inventory_interval)
+        self.assertGreaterEqual(inventory1.timestamp,
+            feed_inventory0.timestamp + interval)
+        self.assertLess(inventory1.timestamp,
+            feed_inventory0.timestamp + 2 * interval)
+        self.assertEqual(inventory2.timestamp.date(),
+            now.date() - datetime.timedelta(days=4))
+        self.assertGreaterEqual(inventory3.timestamp,
+            inventory2.timestamp + interval)
+        last_reading = SiloSensorReading.find([],
+            order=[('timestamp', 'DESC')], limit=1)[0]
+        self.assertLess(last_reading.timestamp, inventory3.timestamp + interval)
+
+        # Running the task again does not create more inventories
+        cron.click('run_once')
+        self.assertEqual(len(FeedProvisionalInventory.find([])), 3)
@@ -0,0 +1,157 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Prepare a farrowing room with two pens and a nursery
+        room = Location()
+        room.name = 'Farrowing Room'
+        room.type = 'storage'
+        room.parent = warehouse.storage_location
+        room.save()
+        pens = []
+        for i in range(2):
+            pen = Location()
+            pen.name = 'Pen %s' % i
+            pen.type = 'storage'
+            pen.parent = room
+            pen.save()
+            pens.append(pen)
+        nursery = Location()
+        nursery.name = 'Nursery'
+        nursery.type = 'storage'
+        nursery.parent = warehouse.storage_location
+        nursery.save()
+
+        # Set animal_type and specie in context to work as in the menus
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'female'
+
+        # Create a female in each pen and get them lactating
+        Animal = Model.get('farm.animal')
+        females = []
+        for pen in pens:
+            female = Animal()
+            female.type = 'female'
+            female.specie = specie
+            female.breed = breed
+            female.initial_location = pen
+            female.save()
+            females.append(female)
+
+        now = datetime.datetime.now()
+        InseminationEvent = Model.get('farm.insemination.event')
+        event_ids = InseminationEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+        } for f in females], config.context)
+        InseminationEvent.validate_event(event_ids, config.context)
+        PregnancyDiagnosisEvent = Model.get('farm.pregnancy_diagnosis.event')
+        event_ids = PregnancyDiagnosisEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+            'result': 'positive',
+        } for f in females], config.context)
+        PregnancyDiagnosisEvent.validate_event(event_ids, config.context)
+        FarrowingEvent = Model.get('farm.farrowing.event')
+        event_ids = FarrowingEvent.create([{
+            'animal_type': 'female',
+            'specie': specie.id,
+            'farm': warehouse.id,
+            'timestamp': now,
+            'animal': f.id,
+            'live': 10,
+        } for f in females], config.context)
+        FarrowingEvent.validate_event(event_ids, config.context)
+        females = [Animal(f.id) for f in females]
+        self.assertEqual(
+            all(f.current_cycle.state == 'lactating' for f in females), True)
+
+        # A litter outside the location of its mother is not written off
+        MoveEvent = Model.get('farm.move.event')
+        group = females[0].farrowing_group
+        for from_location, to_location in [
+                (pens[0], nursery), (nursery, pens[0])]:
+            move_event = MoveEvent()
+            move_event.animal_type = 'group'
+            move_event.specie = specie
+            move_event.farm = warehouse
+            move_event.animal_group = group
+            move_event.timestamp = now
+            move_event.from_location = from_location
+            move_event.to_location = to_location
+            move_event.quantity = 10
+            move_event.save()
+            move_event.click('validate_event')
+            if to_location == nursery:
+                WeaningEvent = Model.get('farm.weaning.event')
+                with self.assertRaises(Exception):
+                    WeaningEvent.wean_location(specie.id, room.id, now,
+                        None, nursery.id, None, config.context)
+
+        # Wean the whole farrowing room moving the piglets to the nursery
+        WeaningEvent = Model.get('farm.weaning.event')
+        event_ids = WeaningEvent.wean_location(specie.id, room.id, now,
+            None, nursery.id, None, config.context)
+        self.assertEqual(len(event_ids), 2)
+        events = [WeaningEvent(i) for i in event_ids]
+        self.assertEqual(all(e.state == 'validated' for e in events), True)
+        self.assertEqual(all(e.quantity == 10 for e in events), True)
+        self.assertEqual(
+            all(e.weaned_move.state == 'done' for e in events), True)
+        self.assertEqual(all(not e.female_move for e in events), True)
+
+        # Check cycles and females are updated
+        females = [Animal(f.id) for f in females]
+        self.assertEqual(
+            all(f.current_cycle.state == 'unmated' for f in females), True)
+        self.assertEqual(all(f.state == 'unmated' for f in females), True)
+        self.assertEqual(all(f.current_cycle.weaned == 10 for f in females),
+            True)
+        self.assertEqual(all(f.location in pens for f in females), True)
+
+        # Every female event is registered in the events journal
+        for female in females:
+            self.assertEqual(sorted(e.event_type for e in female.events), [
+                    'farm.farrowing.event', 'farm.insemination.event',
+                    'farm.pregnancy_diagnosis.event', 'farm.weaning.event'])
+            self.assertEqual(
+                all(e.state == 'validated' for e in female.events), True)
+            self.assertEqual(
+                female.events[-1].cycle, female.current_cycle)
@@ -0,0 +1,147 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.modules.farm.tests.tools import create_specie
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        # Install module
+        config = activate_modules('farm')
+
+        # Create company
+        _ = create_company()
+
+        # Create specie
+        specie, breed, _ = create_specie('Pig')
+
+        # Get locations
+        Location = Model.get('stock.location')
+        warehouse, = Location.find([('type', '=', 'warehouse')])
+
+        # Compute dates
+        start = datetime.date.today() - datetime.timedelta(days=20)
+        origin = datetime.datetime.combine(start, datetime.time.min)
+
+        def at(day, hour=10):
+            return origin + datetime.timedelta(days=day, hours=hour)
+
+        def rows(series):
+            return [(r, t, round(v, 6)) for r, t, v in series]
+
+        # Get units
+        Uom = Model.get('product.uom')
+        gram, = Uom.find([('name', '=', 'Gram')])
+
+        # Create two females and a group
+        config._context['specie'] = specie.id
+        config._context['animal_type'] = 'female'
+        Animal = Model.get('farm.animal')
+        female_ids = Animal.create([{
+                    'type': 'female',
+                    'specie': specie.id,
+                    'breed': breed.id,
+                    'initial_location': warehouse.storage_location.id,
+                    } for _ in range(2)], config.context)
+        female1, female2 = [Animal(i) for i in female_ids]
+        config._context['animal_type'] = 'group'
+        AnimalGroup = Model.get('farm.animal.group')
+        group = AnimalGroup(specie=specie, breed=breed,
+            initial_location=warehouse.storage_location, initial_quantity=10)
+        group.save()
+
+        # Weigh the females, the second one twice at the same time
+        AnimalWeight = Model.get('farm.animal.weight')
+        for animal, timestamp, weight, uom in [
+                (female1, at(10), '130', None),
+                (female1, at(0), '100', None),
+                (female1, at(3), '110', None),
+                (female2, at(1), '90000', gram),
+                (female2, at(1), '95', None),
+                ]:
+            record = AnimalWeight(animal=animal, timestamp=timestamp,
+                weight=Decimal(weight))
+            if uom:
+                record.uom = uom
+            record.save()
+        last_weight = record
+
+        # The current weight is the latest one and the last created of the
+        # same time
+        female1.reload()
+        female2.reload()
+        self.assertEqual(female1.current_weight.weight, Decimal('130'))
+        self.assertEqual(female2.current_weight, last_weight)
+
+        # The series is ordered by animal and time in kilograms
+        series = Animal.get_weight_series(female_ids, start, None, None,
+            config.context)
+        self.assertEqual([s[:2] for s in series],
+            sorted(s[:2] for s in series))
+        self.assertEqual(sorted(rows(series)), [
+                (female1.id, at(0), 100.0),
+                (female1.id, at(3), 110.0),
+                (female1.id, at(10), 130.0),
+                (female2.id, at(1), 90.0),
+                (female2.id, at(1), 95.0),
+                ])
+
+        # The dates limit the weighings
+        series = Animal.get_weight_series(female_ids,
+            start + datetime.timedelta(days=2),
+            start + datetime.timedelta(days=3), None, config.context)
+        self.assertEqual(rows(series),
+            [(female1.id, at(3), 110.0)])
+
+        # The weighings are averaged by periods from the start date
+        series = Animal.get_weight_series(female_ids, start, None, 7,
+            config.context)
+        self.assertEqual(rows(series), [
+                (female1.id, at(0, 0), 105.0),
+                (female1.id, at(7, 0), 130.0),
+                (female2.id, at(0, 0), 92.5),
+                ])
+
+        # Without start date the periods start at the first weighing of each
+        # animal
+        series = Animal.get_weight_series(female_ids, None, None, 7,
+            config.context)
+        self.assertEqual(rows(series), [
+                (female1.id, at(0, 0), 105.0),
+                (female1.id, at(7, 0), 130.0),
+                (female2.id, at(1, 0), 92.5),
+                ])
+
+        # The weights of the groups are divided by their heads
+        GroupWeight = Model.get('farm.animal.group.weight')
+        GroupWeight(group=group, timestamp=at(2), quantity=10,
+            weight=Decimal('300')).save()
+        GroupWeight(group=group, timestamp=at(5), quantity=8,
+            weight=Decimal('320')).save()
+        group.reload()
+        self.assertEqual(group.current_weight.weight, Decimal('320'))
+        series = AnimalGroup.get_weight_series([group.id], start, None, None,
+            config.context)
+        self.assertEqual(rows(series), [
+                (group.id, at(2), 30.0),
+                (group.id, at(5), 40.0),
+                ])
+        series = AnimalGroup.get_weight_series([group.id], start, None, 7,
+            config.context)
+        self.assertEqual(rows(series),
+            [(group.id, at(0, 0), 35.0)])